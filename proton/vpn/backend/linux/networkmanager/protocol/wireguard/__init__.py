@@ -1,6 +1,9 @@
 """
 This module contains the backends implementing the supported OpenVPN protocols.
 
+Names are only imported from their modules the first time they are accessed,
+so that importing the package stays cheap.
+
 
 Copyright (c) 2023 Proton AG
 
@@ -19,6 +22,28 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
 """
-from .wireguard import Wireguard
+import importlib
+
+_EXPORTS = {
+    "Wireguard": ".wireguard",
+    "ServerProber": ".server_prober",
+    "ServerProbeResult": ".server_prober",
+    "ConnectionInstrumentation": ".instrumentation",
+    "ConnectionTimeline": ".instrumentation",
+    "SplitTunneling": ".split_tunnel",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
 
-__all__ = ["Wireguard"]
+def __dir__():
+    return sorted(list(globals()) + __all__)
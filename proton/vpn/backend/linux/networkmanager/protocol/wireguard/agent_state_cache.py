@@ -0,0 +1,174 @@
+"""
+On-disk cache of the local agent state of each connection.
+
+When the app restarts while a VPN connection is active, the cached state is
+used to report the connection state right away, while it is verified in
+the background by establishing a new local agent connection.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from proton.utils.environment import VPNExecutionEnvironment
+
+from proton.vpn import logging
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard import local_agent
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.feature_scheduler \
+    import FEATURE_NAMES
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedAgentState:
+    """Last local agent state of a connection."""
+    server_domain: str
+    state: str
+    reason: Optional[int] = None
+    features: Dict[str, Any] = field(default_factory=dict)
+    saved_at: float = 0
+
+    @classmethod
+    def from_status(
+            cls, server_domain: str, status: local_agent.Status,
+            features: Optional[local_agent.AgentFeatures], saved_at: float
+    ) -> CachedAgentState:
+        """Builds the cached state from a local agent status."""
+        values = {name: getattr(features, name, None) for name in FEATURE_NAMES}
+        return cls(
+            server_domain=server_domain,
+            state=status.state.name,
+            reason=status.reason.code.value if status.reason else None,
+            features={name: value for name, value in values.items() if value is not None},
+            saved_at=saved_at
+        )
+
+    def to_status(self) -> local_agent.Status:
+        """
+        Returns the cached local agent status.
+
+        :raises ValueError: if the cached state or reason are unknown.
+        """
+        try:
+            state = local_agent.State[self.state]
+            reason = local_agent.ReasonCode(self.reason) if self.reason is not None else None
+        except (KeyError, TypeError) as exc:
+            raise ValueError(f"Invalid cached agent state: {self}") from exc
+
+        return local_agent.new_status(state, reason)
+
+    def to_features(self) -> Optional[local_agent.AgentFeatures]:
+        """Returns the cached features, or None if there were none set."""
+        return local_agent.AgentFeatures(**self.features) if self.features else None
+
+
+class AgentStateCache:
+    """
+    Stores the last local agent state of each connection on disk, in a
+    JSON file named after the connection UUID.
+
+    Cached states older than the maximum age are not loaded, since the
+    state could have changed while the app was not running.
+    """
+    MAX_AGE_IN_SECS = 15 * 60
+    DIRECTORY_NAME = "wireguard_agent_state"
+
+    def __init__(
+            self, directory: Optional[str] = None,
+            max_age_in_secs: float = MAX_AGE_IN_SECS,
+            clock: Callable[[], float] = time.time
+    ):
+        self._directory = Path(directory) if directory else None
+        self.max_age_in_secs = max_age_in_secs
+        self._clock = clock
+
+    @property
+    def directory(self) -> Path:
+        """Directory where the states are stored, resolved on first use."""
+        if not self._directory:
+            self._directory = Path(VPNExecutionEnvironment().path_cache) / self.DIRECTORY_NAME
+        return self._directory
+
+    def save(
+            self, connection_id: str, server_domain: str, status: local_agent.Status,
+            features: Optional[local_agent.AgentFeatures] = None
+    ):
+        """Stores the local agent state of the connection. Errors are only logged."""
+        cached_state = CachedAgentState.from_status(
+            server_domain, status, features, saved_at=self._clock()
+        )
+        path = self._get_path(connection_id)
+        temp_path = path.with_suffix(".tmp")
+        try:
+            self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+            with open(
+                os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600),
+                "w", encoding="utf-8"
+            ) as file:
+                json.dump(asdict(cached_state), file)
+            # The state is replaced atomically, so that a crash never leaves it half written.
+            os.replace(temp_path, path)
+        except OSError:
+            logger.warning("Unable to cache agent state of %s.", connection_id, exc_info=True)
+
+    def load(self, connection_id: str, server_domain: str) -> Optional[CachedAgentState]:
+        """
+        Returns the cached local agent state of the connection, or None if
+        there is none, it's stale or it was cached for another server.
+        """
+        try:
+            with open(self._get_path(connection_id), encoding="utf-8") as file:
+                cached_state = CachedAgentState(**json.load(file))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError):
+            logger.warning("Unable to load cached agent state of %s.", connection_id, exc_info=True)
+            return None
+
+        age = self._clock() - cached_state.saved_at
+        if not 0 <= age <= self.max_age_in_secs:
+            logger.info("Cached agent state of %s is stale (%.0f s old).", connection_id, age)
+            return None
+        if cached_state.server_domain != server_domain:
+            logger.info("Cached agent state of %s is for another server.", connection_id)
+            return None
+
+        return cached_state
+
+    def remove(self, connection_id: str):
+        """Removes the cached local agent state of the connection, if any."""
+        try:
+            self._get_path(connection_id).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.warning(
+                "Unable to remove cached agent state of %s.", connection_id, exc_info=True
+            )
+
+    def _get_path(self, connection_id: str) -> Path:
+        return self.directory / f"{connection_id}.json"
@@ -0,0 +1,221 @@
+"""
+Wireguard endpoint selection.
+
+Wireguard servers listen on several UDP ports, since some networks throttle or
+block some of them. This module races all of them and selects the one that
+answers first to a Wireguard handshake initiation.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import socket
+import time
+from typing import Callable, Dict, List, Optional
+
+from proton.vpn import logging
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.handshake import \
+    is_handshake_response
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.network import \
+    bind_to_interface, get_default_interface, get_network_id
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class _HandshakeProbeProtocol(asyncio.DatagramProtocol):
+    """Resolves the future as soon as a handshake response is received."""
+
+    def __init__(self, response: asyncio.Future):
+        self._response = response
+
+    def datagram_received(self, data: bytes, addr):
+        if is_handshake_response(data) and not self._response.done():
+            self._response.set_result(data)
+
+    def error_received(self, exc: Exception):
+        if not self._response.done():
+            self._response.set_exception(exc)
+
+
+def _create_bound_socket(host: str, port: int, interface: str) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        bind_to_interface(sock, interface)
+        sock.connect((host, port))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+async def probe_endpoint(
+        host: str, port: int, message: bytes, timeout: float, interface: Optional[str] = None
+) -> float:
+    """
+    Sends a handshake initiation message to the Wireguard endpoint and
+    waits for the handshake response.
+
+    :param interface: interface to send the message through, bypassing the
+        VPN tunnels which might be up.
+    :returns: the round trip time, in seconds.
+    :raises asyncio.TimeoutError: if no response was received in time.
+    :raises OSError: if the endpoint is not reachable.
+    """
+    loop = asyncio.get_running_loop()
+    response = loop.create_future()
+    if interface:
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _HandshakeProbeProtocol(response),
+            sock=_create_bound_socket(host, port, interface)
+        )
+    else:
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _HandshakeProbeProtocol(response), remote_addr=(host, port)
+        )
+    try:
+        start = time.monotonic()
+        transport.sendto(message)
+        await asyncio.wait_for(response, timeout)
+        return time.monotonic() - start
+    finally:
+        transport.close()
+
+
+class EndpointSelector:
+    """
+    Selects the Wireguard server UDP port to connect to.
+
+    The winning port is cached per network and server, so that following
+    connections from the same network skip the race. Races where no port
+    answered are cached for a shorter time, so that they do not delay each
+    connection by the race timeout.
+
+    The probes are sent through the interface of the default route, so that
+    they do not go through the tunnel of the current connection when
+    switching servers.
+    """
+    TIMEOUT_IN_SECS = 1.5
+    CACHE_TTL_IN_SECS = 24 * 60 * 60
+    FAILURE_CACHE_TTL_IN_SECS = 10 * 60
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, timeout: float = TIMEOUT_IN_SECS,
+            cache: Optional[TTLCache] = None,
+            failure_cache: Optional[TTLCache] = None,
+            network_id_getter: Callable[[], Optional[str]] = get_network_id,
+            interface_getter: Callable[[], Optional[str]] = get_default_interface
+    ):
+        self._timeout = timeout
+        self._cache = cache if cache is not None else TTLCache(self.CACHE_TTL_IN_SECS)
+        self._failure_cache = (
+            failure_cache if failure_cache is not None
+            else TTLCache(self.FAILURE_CACHE_TTL_IN_SECS)
+        )
+        self._get_network_id = network_id_getter
+        self._get_interface = interface_getter
+
+    async def select_port(
+            self, server_ip: str, ports: List[int], build_message: Callable[[], bytes]
+    ) -> int:
+        """
+        Returns the port to connect to on the server.
+
+        :param server_ip: Wireguard server IP.
+        :param ports: UDP ports the server listens on.
+        :param build_message: callable returning a new handshake initiation message.
+        """
+        if len(ports) == 1:
+            return ports[0]
+
+        network_id = self._get_network_id()
+        cache_key = (network_id, server_ip)
+        cached_port = self._cache.get(cache_key)
+        if cached_port in ports:
+            logger.info("Using cached Wireguard port %s for %s.", cached_port, server_ip)
+            return cached_port
+        if self._failure_cache.get(cache_key):
+            logger.info(
+                "No Wireguard port answered on %s recently, defaulting to %s.",
+                server_ip, ports[0]
+            )
+            return ports[0]
+
+        port = await self.race(server_ip, ports, build_message)
+        if port is None:
+            logger.warning(
+                "No Wireguard port answered on %s, defaulting to %s.", server_ip, ports[0]
+            )
+            if network_id is not None:
+                self._failure_cache.set(cache_key, True)
+            return ports[0]
+
+        if network_id is not None:
+            self._cache.set(cache_key, port)
+
+        return port
+
+    async def race(
+            self, server_ip: str, ports: List[int], build_message: Callable[[], bytes]
+    ) -> Optional[int]:
+        """
+        Probes all ports concurrently.
+
+        :returns: the port with the fastest handshake response, or None if
+            none of them answered before the timeout.
+        """
+        interface = self._get_interface()
+        probes: Dict[asyncio.Task, int] = {
+            asyncio.create_task(
+                probe_endpoint(server_ip, port, build_message(), self._timeout, interface)
+            ): port
+            for port in ports
+        }
+        pending = set(probes)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                round_trip_times = {}
+                for probe in done:
+                    port = probes[probe]
+                    if probe.exception() is None:
+                        round_trip_times[port] = probe.result()
+                    else:
+                        logger.debug(
+                            "Wireguard port %s on %s did not answer: %r",
+                            port, server_ip, probe.exception()
+                        )
+                if round_trip_times:
+                    port = min(round_trip_times, key=round_trip_times.get)
+                    logger.info(
+                        "Wireguard port %s on %s answered in %.3f s.",
+                        port, server_ip, round_trip_times[port]
+                    )
+                    return port
+        finally:
+            for probe in pending:
+                probe.cancel()
+
+        return None
+
+    def invalidate(self):
+        """Removes all cached ports and failed races."""
+        self._cache.invalidate()
+        self._failure_cache.invalidate()
@@ -0,0 +1,124 @@
+"""
+Builds Wireguard handshake initiation messages used to probe Wireguard servers.
+
+A Wireguard server only answers to valid handshake initiations, so sending one
+and waiting for the handshake response is the only reliable way of checking
+that a server is reachable on a given UDP port. See the Wireguard whitepaper
+for the details: https://www.wireguard.com/papers/wireguard.pdf
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import time
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+MESSAGE_HANDSHAKE_INITIATION = 1
+MESSAGE_HANDSHAKE_RESPONSE = 2
+HANDSHAKE_INITIATION_LENGTH = 148
+HANDSHAKE_RESPONSE_LENGTH = 92
+
+_CONSTRUCTION = b"Noise_IKpsk2_25519_ChaChaPoly_BLAKE2s"
+_IDENTIFIER = b"WireGuard v1 zx2c4 Jason@zx2c4.com"
+_LABEL_MAC1 = b"mac1----"
+_TAI64_BASE = (1 << 62) + 10
+
+
+def _hash(*data: bytes) -> bytes:
+    return hashlib.blake2s(b"".join(data)).digest()
+
+
+def _mac(key: bytes, data: bytes) -> bytes:
+    return hashlib.blake2s(data, digest_size=16, key=key).digest()
+
+
+def _hmac(key: bytes, data: bytes) -> bytes:
+    return hmac.new(key, data, hashlib.blake2s).digest()
+
+
+def _kdf2(key: bytes, data: bytes):
+    prk = _hmac(key, data)
+    first = _hmac(prk, b"\x01")
+    second = _hmac(prk, first + b"\x02")
+    return first, second
+
+
+def _aead(key: bytes, plaintext: bytes, associated_data: bytes) -> bytes:
+    # The counter is always 0 in handshake messages.
+    return ChaCha20Poly1305(key).encrypt(bytes(12), plaintext, associated_data)
+
+
+def _tai64n() -> bytes:
+    now = time.time_ns()
+    return struct.pack(">QI", _TAI64_BASE + now // 10**9, now % 10**9)
+
+
+def _public_bytes(public_key: X25519PublicKey) -> bytes:
+    return public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
+
+
+def build_handshake_initiation(private_key: str, server_public_key: str) -> bytes:
+    """
+    Returns a new Wireguard handshake initiation message.
+
+    :param private_key: base64-encoded client Wireguard private key.
+    :param server_public_key: base64-encoded server Wireguard public key.
+    """
+    static_private = X25519PrivateKey.from_private_bytes(base64.b64decode(private_key))
+    server_public_bytes = base64.b64decode(server_public_key)
+    server_public = X25519PublicKey.from_public_bytes(server_public_bytes)
+    ephemeral_private = X25519PrivateKey.generate()
+    ephemeral_public_bytes = _public_bytes(ephemeral_private.public_key())
+
+    chaining_key = _hash(_CONSTRUCTION)
+    handshake_hash = _hash(chaining_key, _IDENTIFIER)
+    handshake_hash = _hash(handshake_hash, server_public_bytes)
+
+    chaining_key = _hmac(_hmac(chaining_key, ephemeral_public_bytes), b"\x01")
+    handshake_hash = _hash(handshake_hash, ephemeral_public_bytes)
+
+    chaining_key, key = _kdf2(chaining_key, ephemeral_private.exchange(server_public))
+    encrypted_static = _aead(key, _public_bytes(static_private.public_key()), handshake_hash)
+    handshake_hash = _hash(handshake_hash, encrypted_static)
+
+    chaining_key, key = _kdf2(chaining_key, static_private.exchange(server_public))
+    encrypted_timestamp = _aead(key, _tai64n(), handshake_hash)
+
+    message = (
+        struct.pack("<B3xI", MESSAGE_HANDSHAKE_INITIATION, struct.unpack("<I", os.urandom(4))[0])
+        + ephemeral_public_bytes
+        + encrypted_static
+        + encrypted_timestamp
+    )
+    message += _mac(_hash(_LABEL_MAC1, server_public_bytes), message)
+    # mac2 is only required when the server is under load and sent us a cookie.
+    message += bytes(16)
+
+    return message
+
+
+def is_handshake_response(data: bytes) -> bool:
+    """Returns whether the data received looks like a Wireguard handshake response."""
+    return len(data) == HANDSHAKE_RESPONSE_LENGTH and data[0] == MESSAGE_HANDSHAKE_RESPONSE
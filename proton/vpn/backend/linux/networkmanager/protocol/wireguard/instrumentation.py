@@ -0,0 +1,199 @@
+"""
+Connection lifecycle timing instrumentation.
+
+Records when each phase of a connection attempt starts and finishes, so that
+connection latency can be broken down and tracked over time.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import json
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Iterable, List, Optional
+
+# Phases of a Wireguard connection attempt. The local agent listener
+# records its own phases, defined in AgentListener.
+SETUP = "setup"
+ADD_CONNECTION = "add_connection"
+ACTIVATION = "activation"
+CONNECTED = "connected"
+
+
+@dataclass
+class PhaseTiming:
+    """Monotonic timestamps of a connection phase."""
+    started_at: float
+    finished_at: Optional[float] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        """Duration of the phase in seconds, or None if it did not finish."""
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+class ConnectionTimeline:
+    """
+    Timings of the phases of a connection attempt.
+
+    Phases are only started once, so that retried phases account for the
+    time spent in all the attempts. Instant events are recorded as phases
+    which finish as soon as they start.
+    """
+
+    def __init__(self, connection_id: Optional[str] = None, clock: Callable[[], float] = None):
+        self._clock = clock or time.monotonic
+        self.connection_id = connection_id
+        self.started_at = self._clock()
+        self._phases: Dict[str, PhaseTiming] = {}
+
+    def start(self, phase: str):
+        """Records the start of the phase, unless it was already started."""
+        if phase not in self._phases:
+            self._phases[phase] = PhaseTiming(started_at=self._clock())
+
+    def finish(self, phase: str):
+        """Records the end of the phase."""
+        self.start(phase)
+        self._phases[phase].finished_at = self._clock()
+
+    def mark(self, phase: str):
+        """Records an instant event, unless it was already recorded."""
+        if phase not in self._phases:
+            self.finish(phase)
+
+    @contextmanager
+    def measure(self, phase: str):
+        """Records the phase while the context is active. Phases
+        raising an exception are not recorded as finished."""
+        self.start(phase)
+        yield
+        self.finish(phase)
+
+    def get(self, phase: str) -> Optional[PhaseTiming]:
+        """Returns the timings of the phase, if it was recorded."""
+        return self._phases.get(phase)
+
+    def get_duration(self, phase: str) -> Optional[float]:
+        """Returns the duration of the phase in seconds, if it finished."""
+        timing = self._phases.get(phase)
+        return timing.duration if timing else None
+
+    def get_elapsed(self, phase: str) -> Optional[float]:
+        """Returns the time in seconds from the start of the attempt until the phase finished."""
+        timing = self._phases.get(phase)
+        if not timing or timing.finished_at is None:
+            return None
+        return timing.finished_at - self.started_at
+
+    @property
+    def phases(self) -> List[str]:
+        """Phases recorded, in the order they were started."""
+        return list(self._phases)
+
+    def to_dict(self) -> dict:
+        """Returns the timeline with timestamps relative to the start of the attempt."""
+        return {
+            "connection_id": self.connection_id,
+            "phases": {
+                phase: {
+                    "start": timing.started_at - self.started_at,
+                    "end": (
+                        timing.finished_at - self.started_at
+                        if timing.finished_at is not None else None
+                    ),
+                    "duration": timing.duration,
+                }
+                for phase, timing in self._phases.items()
+            }
+        }
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    """Nearest-rank percentile."""
+    rank = max(1, math.ceil(percentile / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class ConnectionInstrumentation:
+    """Keeps the timelines of the most recent connection attempts."""
+    MAX_TIMELINES = 100
+    PERCENTILES = (50, 90, 99)
+    PROMETHEUS_METRIC = "protonvpn_wireguard_connection_phase_duration_seconds"
+
+    def __init__(self, max_timelines: int = MAX_TIMELINES, clock: Callable[[], float] = None):
+        self._timelines: Deque[ConnectionTimeline] = deque(maxlen=max_timelines)
+        self._clock = clock
+
+    def new_timeline(self, connection_id: Optional[str] = None) -> ConnectionTimeline:
+        """Starts recording a new connection attempt."""
+        timeline = ConnectionTimeline(connection_id, clock=self._clock)
+        self._timelines.append(timeline)
+        return timeline
+
+    @property
+    def timelines(self) -> List[ConnectionTimeline]:
+        """Timelines recorded, from oldest to newest."""
+        return list(self._timelines)
+
+    def get_durations(self, phase: str) -> List[float]:
+        """Returns the durations of the phase on all attempts where it finished."""
+        durations = (timeline.get_duration(phase) for timeline in self._timelines)
+        return [duration for duration in durations if duration is not None]
+
+    def get_percentiles(
+            self, phase: str, percentiles: Iterable[float] = PERCENTILES
+    ) -> Dict[float, float]:
+        """Returns the percentiles of the phase duration, or an empty dict if
+        the phase was never recorded."""
+        durations = sorted(self.get_durations(phase))
+        if not durations:
+            return {}
+        return {percentile: _percentile(durations, percentile) for percentile in percentiles}
+
+    def _get_phases(self) -> List[str]:
+        phases = {}
+        for timeline in self._timelines:
+            phases.update(dict.fromkeys(timeline.phases))
+        return list(phases)
+
+    def to_json(self) -> str:
+        """Dumps all timelines as JSON."""
+        return json.dumps([timeline.to_dict() for timeline in self._timelines])
+
+    def to_prometheus(self) -> str:
+        """Dumps the phase durations as a Prometheus summary, in the text exposition format."""
+        lines = [
+            f"# HELP {self.PROMETHEUS_METRIC} Duration of Wireguard connection phases.",
+            f"# TYPE {self.PROMETHEUS_METRIC} summary",
+        ]
+        for phase in self._get_phases():
+            durations = self.get_durations(phase)
+            for percentile, value in self.get_percentiles(phase).items():
+                lines.append(
+                    f'{self.PROMETHEUS_METRIC}{{phase="{phase}",quantile="{percentile / 100}"}} '
+                    f'{value}'
+                )
+            lines.append(f'{self.PROMETHEUS_METRIC}_sum{{phase="{phase}"}} {sum(durations)}')
+            lines.append(f'{self.PROMETHEUS_METRIC}_count{{phase="{phase}"}} {len(durations)}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,117 @@
+"""
+Allocation of the Wireguard tunnel interfaces.
+
+Each Wireguard connection is brought up on its own interface, so that
+several tunnels can be up at the same time.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from dataclasses import dataclass
+from typing import Dict, Hashable, Optional
+
+INTERFACE_NAME_PREFIX = "proton"
+# Same values as wg-quick, which also uses them for its fwmark and routing table.
+FWMARK_BASE = 51820
+ROUTE_TABLE_BASE = 51820
+ROUTING_RULE_PRIORITY_BASE = 20000
+
+
+@dataclass(frozen=True)
+class TunnelSlot:
+    """
+    Interface of a tunnel, and the fwmark and routing table used to route
+    designated traffic through it.
+    """
+    index: int
+
+    @classmethod
+    def from_interface_name(cls, interface_name: Optional[str]) -> Optional["TunnelSlot"]:
+        """Returns the slot of the tunnel interface, or None if it's not one."""
+        if not interface_name or not interface_name.startswith(INTERFACE_NAME_PREFIX):
+            return None
+        index = interface_name[len(INTERFACE_NAME_PREFIX):]
+        return cls(int(index)) if index.isdigit() else None
+
+    @property
+    def interface_name(self) -> str:
+        """Name of the tunnel interface."""
+        return f"{INTERFACE_NAME_PREFIX}{self.index}"
+
+    @property
+    def fwmark(self) -> int:
+        """Packets with this fwmark are routed through the tunnel."""
+        return FWMARK_BASE + self.index
+
+    @property
+    def route_table(self) -> int:
+        """Routing table with the routes through the tunnel."""
+        return ROUTE_TABLE_BASE + self.index
+
+    @property
+    def routing_rule_priority(self) -> int:
+        """Priority of the routing rule looking up the tunnel routing table."""
+        return ROUTING_RULE_PRIORITY_BASE + self.index
+
+
+class InterfaceAllocator:
+    """
+    Allocates the lowest tunnel slot not in use by another connection,
+    starting from proton0.
+
+    Slots are reserved by their owner (a connection) until released.
+    """
+
+    def __init__(self):
+        self._owners: Dict[int, Hashable] = {}
+
+    def allocate(self, owner: Hashable) -> TunnelSlot:
+        """Returns the slot reserved by the owner, reserving the lowest free one if needed."""
+        slot = self.get_slot(owner)
+        if slot:
+            return slot
+
+        index = 0
+        while index in self._owners:
+            index += 1
+        return self.reserve(TunnelSlot(index), owner)
+
+    def reserve(self, slot: TunnelSlot, owner: Hashable) -> TunnelSlot:
+        """
+        Reserves the slot for the owner, e.g. when taking over the tunnel of
+        another connection. Any other slot reserved by the owner is released.
+        """
+        self.release(owner)
+        self._owners[slot.index] = owner
+        return slot
+
+    def release(self, owner: Hashable):
+        """Releases the slot reserved by the owner, if any."""
+        slot = self.get_slot(owner)
+        if slot:
+            del self._owners[slot.index]
+
+    def get_slot(self, owner: Hashable) -> Optional[TunnelSlot]:
+        """Returns the slot reserved by the owner, if any."""
+        for index, slot_owner in self._owners.items():
+            if slot_owner is owner:
+                return TunnelSlot(index)
+        return None
+
+    def __len__(self) -> int:
+        return len(self._owners)
@@ -0,0 +1,162 @@
+"""
+Adaptive Wireguard persistent keepalive.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from typing import Callable, Optional, Tuple
+
+from proton.vpn import logging
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.telemetry import TunnelStats
+
+logger = logging.getLogger(__name__)
+
+
+class KeepaliveController:  # pylint: disable=too-many-instance-attributes
+    """
+    Adapts the Wireguard persistent keepalive interval to the NAT binding
+    timeout of the network, so that the binding never expires.
+
+    Persistent keepalive is disabled until the binding is known to expire,
+    so that idle devices are not woken up for nothing. A binding is deemed
+    expired when, after an idle period, the packets sent by the client are
+    not answered until Wireguard gives up on the session and completes a
+    new handshake, even though the session keys were not due for renewal.
+    A stall without a new handshake is no evidence of that. The NAT timeout
+    can also be passed to reset() when it was learned before on the same
+    network. Keepalives are then sent a safety margin before it.
+
+    Traffic received after an idle period, without anything being sent
+    first, proves that the binding survived it. A learned NAT timeout which
+    is shorter than the idle period is then forgotten.
+
+    The callback is called with the new interval in seconds (0 meaning
+    disabled) each time it changes.
+    """
+    MIN_IDLE_PERIOD_IN_SECS = 20
+    SAFETY_FACTOR = 0.8
+    MIN_INTERVAL_IN_SECS = 10
+    MAX_INTERVAL_IN_SECS = 300
+    # Wireguard renews the session keys when sending after this long anyway.
+    REKEY_AFTER_TIME_IN_SECS = 120
+    # Wireguard only starts a new handshake once sent packets were not answered
+    # for 15 s, so shorter stalls are not followed by one.
+    MIN_STALL_IN_SECS = 10
+
+    def __init__(
+            self, on_interval_changed: Callable[[int], None],
+            min_idle_period_in_secs: float = MIN_IDLE_PERIOD_IN_SECS
+    ):
+        self._on_interval_changed = on_interval_changed
+        self.min_idle_period_in_secs = min_idle_period_in_secs
+        self._last_stats: Optional[TunnelStats] = None
+        self._last_activity: Optional[float] = None
+        # Time and idle period after which the client resumed sending, while
+        # nothing has been received yet.
+        self._resumption: Optional[Tuple[float, float]] = None
+        self._max_nat_timeout: Optional[float] = None
+        self.interval = 0
+
+    @property
+    def nat_timeout(self) -> Optional[float]:
+        """Upper bound of the NAT binding timeout, if a binding expired."""
+        return self._max_nat_timeout
+
+    def reset(self, nat_timeout: Optional[float] = None):
+        """
+        Forgets the previous samples. To be called when the tunnel is (re)established.
+
+        :param nat_timeout: NAT binding timeout previously learned on the same network.
+        """
+        self._last_stats = None
+        self._last_activity = None
+        self._resumption = None
+        self._max_nat_timeout = nat_timeout
+        self.interval = self._get_interval()
+
+    def __call__(self, stats: TunnelStats):
+        """Checks the new telemetry sample."""
+        last_stats = self._last_stats
+        self._last_stats = stats
+        if last_stats is None:
+            self._last_activity = stats.timestamp
+            return
+
+        is_receiving = stats.counters.rx_bytes > last_stats.counters.rx_bytes
+        is_sending = stats.counters.tx_bytes > last_stats.counters.tx_bytes
+        # Packets were sent or received since the previous sample, at the earliest.
+        idle_period = last_stats.timestamp - self._last_activity
+
+        if is_receiving and self._resumption:
+            self._check_resumption(stats)
+        elif is_receiving and not is_sending:
+            if idle_period >= self.min_idle_period_in_secs:
+                self._on_binding_survived(idle_period)
+        elif is_sending and not is_receiving and not self._resumption:
+            if idle_period >= self.min_idle_period_in_secs and not self._is_rekey_due(
+                    last_stats, stats.timestamp
+            ):
+                self._resumption = (last_stats.timestamp, idle_period)
+
+        if is_receiving or is_sending:
+            self._last_activity = stats.timestamp
+
+    def _is_rekey_due(self, last_stats: TunnelStats, now: float) -> bool:
+        if last_stats.handshake_age is None:
+            # Without the handshake time, a new handshake proves nothing.
+            return True
+        handshake_age = last_stats.handshake_age + now - last_stats.timestamp
+        return handshake_age >= self.REKEY_AFTER_TIME_IN_SECS
+
+    def _check_resumption(self, stats: TunnelStats):
+        resumed_at, idle_period = self._resumption
+        self._resumption = None
+        stall = stats.timestamp - resumed_at
+        has_new_handshake = stats.handshake_age is not None and stats.handshake_age <= stall
+        if stall >= self.MIN_STALL_IN_SECS and has_new_handshake:
+            self._on_binding_expired(idle_period)
+
+    def _on_binding_expired(self, idle_period: float):
+        logger.info("NAT binding expired after less than %.0f s of inactivity.", idle_period)
+        if self._max_nat_timeout is None or idle_period < self._max_nat_timeout:
+            self._max_nat_timeout = idle_period
+            self._update_interval()
+
+    def _on_binding_survived(self, idle_period: float):
+        if self._max_nat_timeout is not None and self._max_nat_timeout <= idle_period:
+            # The NAT timeout learned before does not hold anymore.
+            logger.info("NAT binding survived %.0f s of inactivity.", idle_period)
+            self._max_nat_timeout = None
+            self._update_interval()
+
+    def _get_interval(self) -> int:
+        if self._max_nat_timeout is None:
+            return 0
+        return int(min(
+            self.MAX_INTERVAL_IN_SECS,
+            max(self.MIN_INTERVAL_IN_SECS, self._max_nat_timeout * self.SAFETY_FACTOR)
+        ))
+
+    def _update_interval(self):
+        interval = self._get_interval()
+        if interval == self.interval:
+            return
+        logger.info("Setting Wireguard persistent keepalive to %s s.", interval)
+        self.interval = interval
+        self._on_interval_changed(interval)
@@ -0,0 +1,120 @@
+"""
+Wireguard tunnel liveness monitor.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from typing import Callable, Optional
+
+from proton.vpn import logging
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.telemetry import TunnelStats
+
+logger = logging.getLogger(__name__)
+
+
+class LivenessMonitor:
+    """
+    Detects dead tunnels from the tunnel telemetry, much sooner than
+    NM or the local agent connection would.
+
+    The tunnel stalls when packets are sent and nothing is received back.
+    A stalled tunnel is considered dead when either:
+     - nothing was received for longer than the rx stall timeout since the
+       stall started.
+     - the latest handshake with the server is older than the handshake
+       timeout, and no new handshake completed within the handshake grace
+       period since the stall started. Wireguard renews the session every
+       2 minutes while there is traffic, and drops it after 3 minutes
+       without a new handshake.
+
+    Idle tunnels are never considered dead, since Wireguard does not
+    handshake nor send anything when there is no traffic. The stall is
+    measured from the moment traffic resumed, so that the idle period
+    before it is not mistaken for a stall.
+
+    The callback is called once per stall, with the reason. The monitor is
+    rearmed as soon as traffic is received again.
+    """
+    HANDSHAKE_TIMEOUT_IN_SECS = 150
+    # Wireguard retries the handshake every 5 seconds.
+    HANDSHAKE_GRACE_IN_SECS = 10
+    RX_STALL_TIMEOUT_IN_SECS = 15
+
+    def __init__(
+            self, on_dead_tunnel: Callable[[str], None],
+            handshake_timeout_in_secs: float = HANDSHAKE_TIMEOUT_IN_SECS,
+            rx_stall_timeout_in_secs: float = RX_STALL_TIMEOUT_IN_SECS,
+            handshake_grace_in_secs: float = HANDSHAKE_GRACE_IN_SECS
+    ):
+        self._on_dead_tunnel = on_dead_tunnel
+        self.handshake_timeout_in_secs = handshake_timeout_in_secs
+        self.rx_stall_timeout_in_secs = rx_stall_timeout_in_secs
+        self.handshake_grace_in_secs = handshake_grace_in_secs
+        self._last_stats: Optional[TunnelStats] = None
+        # Time of the first sample where packets were sent since something was received.
+        self._stalled_since: Optional[float] = None
+        self._is_dead = False
+
+    @property
+    def is_dead(self) -> bool:
+        """Returns whether the tunnel is currently considered dead."""
+        return self._is_dead
+
+    def reset(self):
+        """Forgets the previous samples. To be called when the tunnel is (re)established."""
+        self._last_stats = None
+        self._stalled_since = None
+        self._is_dead = False
+
+    def __call__(self, stats: TunnelStats):
+        """Checks the new telemetry sample."""
+        last_stats = self._last_stats
+        self._last_stats = stats
+        if last_stats is None:
+            return
+
+        if stats.counters.rx_bytes > last_stats.counters.rx_bytes:
+            self._stalled_since = None
+            self._is_dead = False
+            return
+
+        if self._stalled_since is None:
+            if stats.counters.tx_bytes <= last_stats.counters.tx_bytes:
+                # The tunnel is idle.
+                return
+            self._stalled_since = stats.timestamp
+
+        reason = self._get_dead_tunnel_reason(stats, stats.timestamp - self._stalled_since)
+        if reason and not self._is_dead:
+            self._is_dead = True
+            logger.warning("Wireguard tunnel seems to be dead: %s.", reason)
+            self._on_dead_tunnel(reason)
+
+    def _get_dead_tunnel_reason(self, stats: TunnelStats, stalled_for: float) -> Optional[str]:
+        if (
+            stats.handshake_age is not None
+            and stats.handshake_age > self.handshake_timeout_in_secs
+            and stalled_for > self.handshake_grace_in_secs
+        ):
+            return f"no handshake for {stats.handshake_age:.0f} s"
+
+        if stalled_for > self.rx_stall_timeout_in_secs:
+            return f"nothing received for {stalled_for:.0f} s"
+
+        return None
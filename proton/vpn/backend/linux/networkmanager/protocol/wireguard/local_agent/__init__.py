@@ -1,6 +1,10 @@
 """
 Local Agent module.
 
+The local agent implementation is only selected the first time one of its
+names is accessed, since importing the external local agent is slow and
+it's not needed until a connection is established.
+
 
 Copyright (c) 2024 Proton AG
 
@@ -19,27 +23,56 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
 """
+import importlib
+from types import ModuleType
+
 from proton.vpn import logging
 
 logger = logging.getLogger(__name__)
 
-
-try:
-    from .external_local_agent import (
-        AgentConnector, AgentConnection, Status,
-        State, Reason, ReasonCode, AgentFeatures,
-        LocalAgentError, ExpiredCertificateError, ErrorMessage
-    )
-except ModuleNotFoundError:
-    from .fallback_local_agent import (
-        AgentConnector, AgentConnection, Status,
-        State, Reason, ReasonCode, AgentFeatures,
-        LocalAgentError, ExpiredCertificateError, ErrorMessage
-    )
-    logger.info("Fallback local agent was loaded.")
-
 __all__ = [
     "AgentConnector", "AgentConnection", "Status",
     "State", "Reason", "ReasonCode", "AgentFeatures",
     "LocalAgentError", "ExpiredCertificateError", "ErrorMessage"
 ]
+
+
+def _load_implementation() -> ModuleType:
+    """Returns the external local agent implementation, or the fallback
+    one when the external local agent is not installed."""
+    try:
+        return importlib.import_module(".external_local_agent", __name__)
+    except ModuleNotFoundError:
+        implementation = importlib.import_module(".fallback_local_agent", __name__)
+        logger.info("Fallback local agent was loaded.")
+        return implementation
+
+
+def new_status(state, reason_code=None):
+    """
+    Builds a local agent status, e.g. to notify subscribers about the agent
+    connection going down. The status classes of the fallback implementation
+    are used whichever implementation is loaded, which is only imported on
+    the first call.
+    """
+    fallback_local_agent = importlib.import_module(".fallback_local_agent", __name__)
+    return fallback_local_agent.Status(
+        state=state,
+        reason=fallback_local_agent.Reason(code=reason_code) if reason_code else None
+    )
+
+
+def __getattr__(name: str):
+    if name not in __all__:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    implementation = _load_implementation()
+    # Cache all names so that this function is not called again.
+    globals().update({
+        exported_name: getattr(implementation, exported_name) for exported_name in __all__
+    })
+    return globals()[name]
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,193 @@
+"""
+Dispatches local agent messages to subscribers without blocking the reader.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum, auto
+from typing import Any, Awaitable, Callable, Deque, List, Optional, Tuple
+
+from proton.vpn import logging
+
+logger = logging.getLogger(__name__)
+
+Subscriber = Callable[[Any], Awaitable]
+
+
+class OverflowPolicy(Enum):
+    """What to do with a new message when a subscriber queue is full."""
+    DROP_OLDEST = auto()  # The oldest pending message is discarded.
+    COALESCE = auto()  # The newest pending message is replaced by the new one.
+    BLOCK = auto()  # The publisher waits until there is room in the queue.
+
+
+@dataclass
+class SubscriberMetrics:  # pylint: disable=too-many-instance-attributes
+    """Delivery metrics for a subscriber."""
+    delivered: int = 0
+    dropped: int = 0
+    coalesced: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    last_latency: Optional[float] = None
+    max_latency: float = 0
+    total_latency: float = 0
+
+    @property
+    def mean_latency(self) -> Optional[float]:
+        """Mean time, in seconds, from a message being published until
+        the subscriber finished handling it."""
+        if not self.delivered:
+            return None
+        return self.total_latency / self.delivered
+
+
+class _SubscriberQueue:
+    """
+    Bounded queue of messages pending to be delivered to a subscriber.
+
+    A worker task is started whenever there are pending messages, and
+    finishes as soon as the queue has been drained.
+    """
+
+    def __init__(self, subscriber: Subscriber, max_size: int, overflow_policy: OverflowPolicy):
+        self.subscriber = subscriber
+        self.metrics = SubscriberMetrics()
+        self._max_size = max_size
+        self._overflow_policy = overflow_policy
+        self._pending: Deque[Tuple[float, Any]] = deque()
+        self._worker: Optional[asyncio.Task] = None
+        self._space_available: Optional[asyncio.Event] = None
+
+    async def put(self, message: Any):
+        """Queues the message, applying the overflow policy if the queue is full."""
+        if len(self._pending) >= self._max_size:
+            if self._overflow_policy is OverflowPolicy.BLOCK:
+                await self._wait_for_space()
+            elif self._overflow_policy is OverflowPolicy.DROP_OLDEST:
+                self._pending.popleft()
+                self.metrics.dropped += 1
+            else:
+                self._pending.pop()
+                self.metrics.coalesced += 1
+
+        self._pending.append((time.monotonic(), message))
+        self._update_queue_depth()
+
+        if not self._worker or self._worker.done():
+            self._worker = asyncio.create_task(self._deliver_pending_messages())
+
+    async def join(self):
+        """Waits until all pending messages have been delivered."""
+        while self._worker:
+            worker = self._worker
+            try:
+                await asyncio.shield(worker)
+            except asyncio.CancelledError:
+                # Only the cancellation of the delivery is expected here.
+                if not worker.cancelled():
+                    raise
+
+    def cancel(self):
+        """Cancels the delivery of pending messages."""
+        self._pending.clear()
+        self._update_queue_depth()
+        if self._worker:
+            # A worker cancelled before it started never runs its clean-up.
+            self._worker.cancel()
+            self._worker = None
+
+    async def _wait_for_space(self):
+        if not self._space_available:
+            self._space_available = asyncio.Event()
+        while len(self._pending) >= self._max_size:
+            self._space_available.clear()
+            await self._space_available.wait()
+
+    async def _deliver_pending_messages(self):
+        try:
+            while self._pending:
+                published_at, message = self._pending.popleft()
+                self._update_queue_depth()
+                if self._space_available:
+                    self._space_available.set()
+
+                try:
+                    await self.subscriber(message)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Local agent message subscriber failed.")
+
+                self._record_delivery(time.monotonic() - published_at)
+        finally:
+            if self._worker is asyncio.current_task():
+                self._worker = None
+
+    def _update_queue_depth(self):
+        self.metrics.queue_depth = len(self._pending)
+        self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, len(self._pending))
+
+    def _record_delivery(self, latency: float):
+        self.metrics.delivered += 1
+        self.metrics.last_latency = latency
+        self.metrics.max_latency = max(self.metrics.max_latency, latency)
+        self.metrics.total_latency += latency
+
+
+class SubscriberDispatcher:
+    """
+    Delivers messages to each subscriber through its own bounded queue and
+    worker task, so that publishing a message never waits for subscribers
+    to handle it, unless the BLOCK overflow policy is used.
+
+    Messages are delivered to each subscriber in the order they were published.
+    """
+    MAX_QUEUE_SIZE = 16
+
+    def __init__(
+            self, subscribers: Optional[List[Subscriber]] = None,
+            max_queue_size: int = MAX_QUEUE_SIZE,
+            overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST
+    ):
+        self._queues = [
+            _SubscriberQueue(subscriber, max_queue_size, overflow_policy)
+            for subscriber in subscribers or []
+        ]
+
+    async def publish(self, message: Any):
+        """Queues the message for delivery to all subscribers."""
+        for queue in self._queues:
+            await queue.put(message)
+
+    async def join(self):
+        """Waits until all published messages have been delivered."""
+        for queue in self._queues:
+            await queue.join()
+
+    def cancel(self):
+        """Cancels the delivery of all pending messages."""
+        for queue in self._queues:
+            queue.cancel()
+
+    @property
+    def metrics(self) -> List[Tuple[Subscriber, SubscriberMetrics]]:
+        """Returns the delivery metrics of each subscriber."""
+        return [(queue.subscriber, queue.metrics) for queue in self._queues]
@@ -29,6 +29,9 @@ from proton.vpn.session.exceptions import VPNCertificateExpiredError
 
 class AgentConnector:  # pylint: disable=too-few-public-methods
     """AgentConnector that wraps Proton external local agent implementation."""
+    # Its connection cannot be bound to a tunnel interface.
+    supports_interface_binding = False
+
     async def connect(self, vpn_server_domain: str, credentials) -> AgentConnection:
         """Connect to the local agent server."""
         try:
@@ -42,6 +45,12 @@ class AgentConnector:  # pylint: disable=too-few-public-methods
             certificate
         )
 
+    def invalidate_credentials_cache(self):
+        """The external local agent implementation does not cache credentials."""
+
+    def prepare(self, credentials):
+        """The external local agent implementation loads credentials on connection."""
+
 
 __all__ = [
     "AgentConnector", "AgentConnection", "Status", "State", "Reason", "ReasonCode",
@@ -22,19 +22,24 @@ along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
 import asyncio
+import errno
+import hashlib
 import os
-import ssl
 import socket
+import ssl
+import time
 from dataclasses import dataclass
 from enum import Enum, auto
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Optional
+from typing import Callable, Dict, Optional, Tuple
 
 from proton.vpn.session.exceptions import VPNCertificateExpiredError
 
 from proton.vpn import logging
 
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.network import bind_to_interface
+
 logger = logging.getLogger(__name__)
 
 
@@ -112,73 +117,325 @@ class AgentConnection:  # pylint: disable=too-few-public-methods
         """Dummy method to match the real AgentConnection API."""
 
 
-class AgentConnector:  # pylint: disable=too-few-public-methods
-    """Temporary Local Agent implementation."""
+class SSLContextCache:
+    """
+    Caches the TLS context built from the agent credentials, so that it can be
+    reused until the credentials change or expire.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._fingerprint = None
+        self._expiration_time = None
+        self._context = None
+
+    def get(self, fingerprint: str) -> Optional[ssl.SSLContext]:
+        """Returns the cached context if it was built from the certificate with
+        the given fingerprint and the certificate did not expire yet."""
+        if fingerprint != self._fingerprint or self._clock() >= self._expiration_time:
+            return None
+        return self._context
+
+    def set(self, fingerprint: str, context: ssl.SSLContext, expiration_time: float):
+        """Caches the context built from the certificate with the given fingerprint."""
+        self._fingerprint = fingerprint
+        self._expiration_time = expiration_time
+        self._context = context
+
+    def invalidate(self):
+        """Removes the cached context."""
+        self._fingerprint = None
+        self._expiration_time = None
+        self._context = None
+
+
+class AgentConnector:
+    """
+    Temporary Local Agent implementation.
+
+    The local agent address is the same on every VPN server, so with several
+    tunnels up the connection is bound to the interface of the tunnel of the
+    server it's meant for.
+    """
 
     _VPN_SERVER_PORT = 65432
     _VPN_SERVER_IP = "10.2.0.1"
     _TIMEOUT_IN_SECS = 10
+    # With TLS 1.3, session tickets are sent by the server after the handshake.
+    # They are waited for at most a few times the handshake duration, since
+    # servers not issuing tickets would otherwise delay every connection.
+    _SESSION_TICKET_TIMEOUT_IN_SECS = 1
+    _SESSION_TICKET_MIN_TIMEOUT_IN_SECS = 0.05
+    _SESSION_TICKET_TIMEOUT_IN_HANDSHAKES = 2
+    supports_interface_binding = True
+
+    def __init__(
+            self, ca_pem: Optional[str] = None,
+            ssl_context_cache: Optional[SSLContextCache] = None,
+            server_address: Optional[Tuple[str, int]] = None,
+            interface: Optional[str] = None
+    ):
+        self._ca_pem = ca_pem or PROTON_VPN_ROOT_CERT
+        self._ssl_context_cache = ssl_context_cache or SSLContextCache()
+        self._server_address = server_address or (self._VPN_SERVER_IP, self._VPN_SERVER_PORT)
+        # Interface the connection is bound to, if any.
+        self.interface = interface
+        # TLS sessions per server domain, used to resume the previous TLS session
+        # on reconnection. Sessions are only valid for the context that created them.
+        self._tls_sessions: Dict[str, ssl.SSLSession] = {}
+        self.session_hits = 0
+        self.session_misses = 0
+
+    def invalidate_credentials_cache(self):
+        """Discards the TLS context and sessions built from the previous credentials."""
+        self._ssl_context_cache.invalidate()
+        self._tls_sessions.clear()
+
+    def prepare(self, credentials):
+        """
+        Loads the credentials in advance, so that the next connection does
+        not have to wait for them to be loaded.
+        """
+        try:
+            self._get_ssl_context(credentials.certificate_pem, credentials)
+        except (VPNCertificateExpiredError, OSError, ssl.SSLError):
+            logger.warning("Unable to prepare agent credentials.", exc_info=True)
 
     async def connect(self, vpn_server_domain: str, credentials):
         """
         Establishes a TLS to the local agent instance running on the VPN server
         the user is currently connected to.
         """
-        loop = asyncio.get_running_loop()
         try:
-            return await loop.run_in_executor(
-                None, self._connect_sync, vpn_server_domain, credentials
+            certificate_pem = credentials.certificate_pem
+        except VPNCertificateExpiredError as exc:
+            raise ExpiredCertificateError("Certificate expired") from exc
+
+        try:
+            context = self._get_ssl_context(certificate_pem, credentials)
+            # Establish TLS to local agent instance running on the VPN server.
+            return await asyncio.wait_for(
+                self._establish_tls_connection(
+                    server_hostname=vpn_server_domain, context=context
+                ),
+                self._TIMEOUT_IN_SECS
             )
-        except (OSError, ssl.SSLError) as exc:
+        except (OSError, ssl.SSLError, asyncio.TimeoutError) as exc:
             raise LocalAgentError(
                 f"Local agent connection to {vpn_server_domain} failed."
             ) from exc
 
-    def _connect_sync(self, vpn_server_domain: str, credentials):
-        with TemporaryDirectory() as temp_dir:
-            temp_dir = Path(temp_dir)
+    def _get_ssl_context(self, certificate_pem: str, credentials) -> ssl.SSLContext:
+        fingerprint = hashlib.sha256(ssl.PEM_cert_to_DER_cert(certificate_pem)).hexdigest()
+        context = self._ssl_context_cache.get(fingerprint)
+        if context:
+            return context
 
-            # Write certificate to disk.
-            cert_path = temp_dir / "cert.pem"
-            try:
-                with open(cert_path, "w", encoding="utf-8") as file:
-                    file.write(credentials.certificate_pem)
-            except VPNCertificateExpiredError as exc:
-                raise ExpiredCertificateError("Certificate expired") from exc
-
-            # Write encrypted private key to disk.
-            key_password = os.urandom(32)
-            key = credentials.get_ed25519_sk_pem(key_password)
-            key_path = temp_dir / "key.pem"
-            with open(key_path, "wb") as file:
-                file.write(key.encode("ascii"))
-
-            # Write Proton VPN root cert to disk.
-            ca_path = temp_dir / "ca.pem"
-            with open(ca_path, "w", encoding="utf-8") as file:
-                file.write(PROTON_VPN_ROOT_CERT)
+        try:
+            context = create_ssl_context_in_memory(self._ca_pem, certificate_pem, credentials)
+        except ssl.SSLError:
+            raise
+        except OSError:
+            logger.warning(
+                "Unable to load agent credentials in memory, falling back to temporary files.",
+                exc_info=True
+            )
+            context = create_ssl_context_from_temp_files(
+                self._ca_pem, certificate_pem, credentials
+            )
 
-            # Establish TLS to local agent instance running on the VPN server.
-            return self._establish_tls_connection(
-                server_hostname=vpn_server_domain,
-                cert_path=cert_path,
-                key_path=key_path,
-                key_password=key_password,
-                ca_path=ca_path
+        self._ssl_context_cache.set(
+            fingerprint, context, time.time() + credentials.certificate_validity_remaining
+        )
+        self._tls_sessions.clear()
+        return context
+
+    async def _establish_tls_connection(self, server_hostname: str, context: ssl.SSLContext):
+        """
+        Performs the TLS handshake over an asyncio stream.
+
+        The TLS protocol is driven manually with an ``ssl.SSLObject``, since
+        asyncio does not allow offering a TLS session for resumption.
+        """
+        if self.interface:
+            reader, writer = await asyncio.open_connection(sock=await self._connect_socket())
+        else:
+            reader, writer = await asyncio.open_connection(*self._server_address)
+        try:
+            tls = _TLSStream(
+                context, server_hostname, self._tls_sessions.get(server_hostname),
+                reader, writer
+            )
+            start = time.monotonic()
+            await tls.do_handshake()
+            handshake_duration = time.monotonic() - start
+
+            if tls.ssl_object.session_reused:
+                self.session_hits += 1
+            else:
+                self.session_misses += 1
+                await self._wait_for_session_ticket(tls, handshake_duration)
+
+            if tls.ssl_object.session:
+                self._tls_sessions[server_hostname] = tls.ssl_object.session
+        finally:
+            writer.close()
+
+    async def _connect_socket(self) -> socket.socket:
+        """Returns a socket connected to the local agent through the bound interface."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setblocking(False)
+            bind_to_interface(sock, self.interface)
+            await asyncio.get_running_loop().sock_connect(sock, self._server_address)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    async def _wait_for_session_ticket(self, tls: _TLSStream, handshake_duration: float):
+        """
+        Waits for the session ticket the server sends after a TLS 1.3 handshake.
+        Waiting stops as soon as the first records after the handshake were
+        received, or after a few times the handshake duration.
+
+        With TLS 1.3, the server verifies the client certificate after the client
+        already considers the handshake done. The connection being closed before
+        the session ticket is received means the client certificate was rejected.
+
+        :raises OSError: if the connection was closed or the server sent an alert.
+        """
+        if tls.ssl_object.version() != "TLSv1.3":
+            return
+
+        try:
+            await asyncio.wait_for(
+                tls.read_session_ticket(),
+                min(self._SESSION_TICKET_TIMEOUT_IN_SECS, max(
+                    self._SESSION_TICKET_MIN_TIMEOUT_IN_SECS,
+                    self._SESSION_TICKET_TIMEOUT_IN_HANDSHAKES * handshake_duration
+                ))
             )
+        except asyncio.TimeoutError:
+            logger.debug("TLS session ticket not received.")
+
+
+class _TLSStream:
+    """Drives a TLS client connection through an asyncio stream."""
+    _READ_BUFFER_SIZE = 16 * 1024
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, context: ssl.SSLContext, server_hostname: str,
+            session: Optional[ssl.SSLSession],
+            reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        self._incoming = ssl.MemoryBIO()
+        self._outgoing = ssl.MemoryBIO()
+        self.ssl_object = context.wrap_bio(
+            self._incoming, self._outgoing, server_hostname=server_hostname, session=session
+        )
+        self._reader = reader
+        self._writer = writer
+
+    async def do_handshake(self):
+        """Performs the TLS handshake."""
+        while True:
+            try:
+                self.ssl_object.do_handshake()
+                break
+            except ssl.SSLWantReadError:
+                await self._exchange_records()
+        await self._flush()
+
+    async def read_session_ticket(self):
+        """
+        Reads the records the server sends right after the handshake. It returns
+        once a session ticket or application data is received, or after the
+        first records received did not contain any session ticket.
+        """
+        received_records = False
+        while True:
+            try:
+                self.ssl_object.read(self._READ_BUFFER_SIZE)
+                # Application data or the connection being closed: no ticket is coming.
+                return
+            except ssl.SSLWantReadError:
+                # Session tickets are processed when reading from the TLS object.
+                if self.ssl_object.session.has_ticket or received_records:
+                    return
+                await self._exchange_records()
+                received_records = True
+
+    async def _flush(self):
+        data = self._outgoing.read()
+        if data:
+            self._writer.write(data)
+            await self._writer.drain()
+
+    async def _exchange_records(self):
+        await self._flush()
+        data = await self._reader.read(self._READ_BUFFER_SIZE)
+        if not data:
+            raise ConnectionResetError("Connection closed by the local agent server.")
+        self._incoming.write(data)
+
+
+def create_ssl_context_in_memory(ca_pem: str, certificate_pem: str, credentials) -> ssl.SSLContext:
+    """
+    Creates the TLS context to connect to the local agent without writing
+    the credentials to disk.
+
+    ``ssl.SSLContext.load_cert_chain`` only accepts file paths, so the
+    certificate and the private key are loaded from an anonymous file living
+    in memory.
+
+    :raises OSError: if the anonymous file could not be created.
+    """
+    if not hasattr(os, "memfd_create"):
+        raise OSError(errno.ENOSYS, "Anonymous in-memory files are not supported.")
+
+    context = ssl.create_default_context(cadata=ca_pem)
+    file_descriptor = os.memfd_create("agent-credentials", os.MFD_CLOEXEC)
+    try:
+        with open(file_descriptor, "w", encoding="ascii", closefd=False) as file:
+            file.write(certificate_pem)
+            file.write("\n")
+            file.write(credentials.get_ed25519_sk_pem())
+        context.load_cert_chain(certfile=f"/proc/self/fd/{file_descriptor}")
+    finally:
+        os.close(file_descriptor)
+
+    return context
+
+
+def create_ssl_context_from_temp_files(
+        ca_pem: str, certificate_pem: str, credentials
+) -> ssl.SSLContext:
+    """
+    Creates the TLS context to connect to the local agent, writing the
+    credentials to a temporary directory.
+
+    This is only used when anonymous in-memory files are not supported.
+    """
+    with TemporaryDirectory() as temp_dir:
+        temp_dir = Path(temp_dir)
+
+        # Write certificate to disk.
+        cert_path = temp_dir / "cert.pem"
+        with open(cert_path, "w", encoding="utf-8") as file:
+            file.write(certificate_pem)
+
+        # Write encrypted private key to disk.
+        key_password = os.urandom(32)
+        key = credentials.get_ed25519_sk_pem(key_password)
+        key_path = temp_dir / "key.pem"
+        with open(key_path, "wb") as file:
+            file.write(key.encode("ascii"))
+
+        context = ssl.create_default_context(cadata=ca_pem)
+        context.load_cert_chain(certfile=cert_path, keyfile=key_path, password=key_password)
 
-    def _establish_tls_connection(
-            self, server_hostname: str, cert_path: str,
-            key_path: str, key_password: bytes, ca_path: str
-    ):  # pylint: disable=too-many-arguments
-        with socket.create_connection(
-                (self._VPN_SERVER_IP, self._VPN_SERVER_PORT), timeout=self._TIMEOUT_IN_SECS
-        ) as sock:
-            context = ssl.create_default_context()
-            context.load_verify_locations(cafile=ca_path)
-            context.load_cert_chain(certfile=cert_path, keyfile=key_path, password=key_password)
-            with context.wrap_socket(sock, server_hostname=server_hostname):
-                pass
+    return context
 
 
 PROTON_VPN_ROOT_CERT = """-----BEGIN CERTIFICATE-----
@@ -0,0 +1,145 @@
+"""
+Schedules local agent feature requests.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard import local_agent
+
+from proton.vpn import logging
+
+logger = logging.getLogger(__name__)
+
+FEATURE_NAMES = (
+    "netshield_level", "randomized_nat", "split_tcp", "port_forwarding", "jail", "bouncing"
+)
+
+
+def _to_dict(features: Optional[local_agent.AgentFeatures]) -> Dict[str, Any]:
+    """Returns the features which are set, by name."""
+    if features is None:
+        return {}
+    values = {name: getattr(features, name, None) for name in FEATURE_NAMES}
+    return {name: value for name, value in values.items() if value is not None}
+
+
+def _to_features(values: Dict[str, Any]) -> Optional[local_agent.AgentFeatures]:
+    return local_agent.AgentFeatures(**values) if values else None
+
+
+def merge_features(
+        features: Optional[local_agent.AgentFeatures],
+        update: Optional[local_agent.AgentFeatures]
+) -> Optional[local_agent.AgentFeatures]:
+    """Returns the features with the ones set on the update overriding them."""
+    return _to_features({**_to_dict(features), **_to_dict(update)})
+
+
+class FeatureRequestScheduler:
+    """
+    Coalesces the feature requests made within the debounce window and
+    only sends the features that differ from the ones already confirmed by
+    the server or already requested to it. Features left unset (None) in
+    the request sent are not changed on the server.
+
+    Features are considered confirmed once they are reported back in a
+    local agent status message.
+    """
+    DEBOUNCE_WINDOW_IN_SECS = 0.2
+
+    def __init__(
+            self, send: Callable[[local_agent.AgentFeatures], Awaitable],
+            debounce_window_in_secs: float = DEBOUNCE_WINDOW_IN_SECS
+    ):
+        self._send = send
+        self._debounce_window_in_secs = debounce_window_in_secs
+        self._requested: Dict[str, Any] = {}
+        self._in_flight: Dict[str, Any] = {}
+        self._confirmed: Dict[str, Any] = {}
+        self._timer: Optional[asyncio.Task] = None
+
+    @property
+    def confirmed(self) -> Optional[local_agent.AgentFeatures]:
+        """Features confirmed by the server."""
+        return _to_features(self._confirmed)
+
+    @property
+    def pending(self) -> Optional[local_agent.AgentFeatures]:
+        """Features requested, or about to be, which were not confirmed yet."""
+        return _to_features({
+            name: value for name, value in {**self._in_flight, **self._requested}.items()
+            if self._confirmed.get(name) != value
+        })
+
+    def schedule(self, features: local_agent.AgentFeatures):
+        """Schedules the features to be requested once the debounce window elapses."""
+        self._requested.update(_to_dict(features))
+        self._cancel_timer()
+        self._timer = asyncio.create_task(self._flush_after_debounce_window())
+
+    async def flush(self):
+        """Requests the scheduled features right away."""
+        self._cancel_timer()
+        changes = {
+            name: value for name, value in self._requested.items()
+            if {**self._confirmed, **self._in_flight}.get(name) != value
+        }
+        self._requested = {}
+        if not changes:
+            logger.debug("Skipping feature request since features did not change.")
+            return
+
+        self._in_flight.update(changes)
+        try:
+            await self._send(local_agent.AgentFeatures(**changes))
+        except BaseException:
+            for name in changes:
+                self._in_flight.pop(name, None)
+            raise
+
+    def confirm(self, features: Optional[local_agent.AgentFeatures]):
+        """Records the features reported by the server."""
+        confirmed = _to_dict(features)
+        self._confirmed.update(confirmed)
+        for name in confirmed:
+            self._in_flight.pop(name, None)
+
+    def reset(self):
+        """Forgets all features. To be called whenever a new agent session starts."""
+        self._cancel_timer()
+        self._requested = {}
+        self._in_flight = {}
+        self._confirmed = {}
+
+    def _cancel_timer(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    async def _flush_after_debounce_window(self):
+        await asyncio.sleep(self._debounce_window_in_secs)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Agent features request failed.")
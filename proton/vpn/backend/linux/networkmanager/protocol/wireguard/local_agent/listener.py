@@ -16,15 +16,18 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
 """
+from __future__ import annotations
+
 import asyncio
+import contextlib
+import random
 from typing import Optional, List, Awaitable
 
-import proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent\
-    .fallback_local_agent as fallback_local_agent  # pylint: disable=R0402
-
-from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent \
-    import AgentConnection, Status, State, AgentConnector, AgentFeatures, \
-    ErrorMessage, ExpiredCertificateError, ReasonCode
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard import local_agent
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.dispatcher \
+    import OverflowPolicy, SubscriberDispatcher
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.feature_scheduler \
+    import FeatureRequestScheduler, merge_features
 
 from proton.vpn import logging
 
@@ -32,95 +35,213 @@ logger = logging.getLogger(__name__)
 
 
 class AgentListener:
-    """Listens for local agent messages."""
+    """
+    Listens for local agent messages.
+
+    When the agent connection fails or drops, the listener reconnects with a
+    jittered exponential backoff. Subscribers are only notified about the
+    agent connection going down after the retry budget is exhausted.
+
+    Messages are delivered to subscribers through a SubscriberDispatcher,
+    so that slow subscribers do not delay reading from the agent connection.
+
+    Feature requests are debounced and only the features that changed are
+    sent, through a FeatureRequestScheduler.
 
-    def __init__(
+    When a timeline is set, the time spent on the phases of the first agent
+    connection is recorded on it. The timeline is expected to have the
+    ``measure(phase)`` context manager and the ``mark(phase)`` method.
+    """
+    PHASE_AGENT_CONNECT = "agent_connect"
+    PHASE_FEATURES_REQUEST = "features_request"
+    PHASE_FIRST_STATUS = "first_status"
+    RETRY_BUDGET = 3
+    BACKOFF_BASE_IN_SECS = 0.5
+    BACKOFF_MAX_IN_SECS = 8
+
+    def __init__(  # pylint: disable=too-many-arguments
             self, subscribers: Optional[List[Awaitable]] = None,
-            connector: Optional[AgentConnector] = None
+            connector: Optional[local_agent.AgentConnector] = None,
+            retry_budget: int = RETRY_BUDGET,
+            backoff_base_in_secs: float = BACKOFF_BASE_IN_SECS,
+            backoff_max_in_secs: float = BACKOFF_MAX_IN_SECS,
+            max_queue_size: int = SubscriberDispatcher.MAX_QUEUE_SIZE,
+            overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+            feature_debounce_window_in_secs: float =
+            FeatureRequestScheduler.DEBOUNCE_WINDOW_IN_SECS
     ):
-        self._subscribers = subscribers or []
-        self._connector = connector or AgentConnector()
+        self._dispatcher = SubscriberDispatcher(subscribers, max_queue_size, overflow_policy)
+        self._feature_scheduler = FeatureRequestScheduler(
+            self._send_features, feature_debounce_window_in_secs
+        )
+        self._connector = connector or local_agent.AgentConnector()
+        self._retry_budget = retry_budget
+        self._backoff_base_in_secs = backoff_base_in_secs
+        self._backoff_max_in_secs = backoff_max_in_secs
         self._connection = None
+        self._features = None
         self._background_task = None
+        self.timeline = None
 
     @property
     def is_running(self):
         """Returns whether the listener is running."""
         return bool(self._background_task)
 
+    @property
+    def subscriber_metrics(self):
+        """Returns the message delivery metrics of each subscriber."""
+        return self._dispatcher.metrics
+
+    @property
+    def pending_features(self) -> Optional[local_agent.AgentFeatures]:
+        """Returns the features requested which were not confirmed yet by the server."""
+        return self._feature_scheduler.pending
+
+    @property
+    def confirmed_features(self) -> Optional[local_agent.AgentFeatures]:
+        """Returns the features confirmed by the server."""
+        return self._feature_scheduler.confirmed
+
     @property
     def background_task(self):
         """Returns the background task that listens for local agent messages."""
         return self._background_task
 
-    def start(self, domain: str, credentials: str, features: AgentFeatures):
+    def start(self, domain: str, credentials: str, features: local_agent.AgentFeatures):
         """Start listening for local agent messages in the background."""
         if self._background_task:
             logger.warning("Agent listener was already started")
             return
 
         logger.info("Starting agent listener...")
+        self._features = features
+        self._feature_scheduler.reset()
         self._background_task = asyncio.create_task(
-            self._run_in_background(domain, credentials, features)
+            self._run_in_background(domain, credentials)
         )
         self._background_task.add_done_callback(self._on_background_task_stopped)
 
-    async def _run_in_background(self, domain, credentials, features: AgentFeatures):
+    async def _run_in_background(self, domain, credentials):
         """Run the listener in the background."""
+        failed_attempts = 0
         try:
-            logger.info("Establishing agent connection...")
-            self._connection = await self._connector.connect(domain, credentials)
-            logger.info("Agent connection established.")
-
-            if not self._connection:
-                # The fallback local agent implementation does not return a connection object.
-                # This branch should be removed after removing the fallback implementation.
-                await self._notify_subscribers(fallback_local_agent.Status(state=State.CONNECTED))
-                return
+            while True:
+                try:
+                    await self._connect_and_listen(domain, credentials)
+                    return
+                except local_agent.ExpiredCertificateError:
+                    raise
+                except (OSError, asyncio.TimeoutError, local_agent.LocalAgentError):
+                    # asyncio.TimeoutError is only an OSError since Python 3.11.
+                    # A failure after the connection was established starts a new streak.
+                    failed_attempts = 1 if self._connection else failed_attempts + 1
+                    if failed_attempts > self._retry_budget:
+                        raise
+                    logger.warning(
+                        "Agent connection failed (attempt %s of %s).",
+                        failed_attempts, self._retry_budget, exc_info=True
+                    )
+                finally:
+                    self._close_connection()
 
-            if features:
-                logger.info("Requesting agent features...")
-                await self._connection.request_features(features)
-                logger.info("Listening on agent connection...")
-
-            await self.listen(self._connection)
+                await asyncio.sleep(self._get_backoff_delay(failed_attempts))
 
         except asyncio.CancelledError:
             logger.info("Agent listener was successfully stopped.")
-        except ExpiredCertificateError:
+        except local_agent.ExpiredCertificateError:
             logger.warning("Expired certificate upon establishing agent connection.")
-            message = fallback_local_agent.Status(
-                state=State.DISCONNECTED,
-                reason=fallback_local_agent.Reason(code=ReasonCode.CERTIFICATE_EXPIRED)
+            message = local_agent.new_status(
+                local_agent.State.DISCONNECTED, local_agent.ReasonCode.CERTIFICATE_EXPIRED
             )
             await self._notify_subscribers(message)
-        except TimeoutError:
+        except (TimeoutError, asyncio.TimeoutError):
             logger.warning("Agent connection timed out.")
-            message = fallback_local_agent.Status(state=State.DISCONNECTED)
+            message = local_agent.new_status(local_agent.State.DISCONNECTED)
             await self._notify_subscribers(message)
         except Exception:
             logger.error("Agent listener was unexpectedly closed.")
-            message = fallback_local_agent.Status(state=State.DISCONNECTED)
+            message = local_agent.new_status(local_agent.State.DISCONNECTED)
             await self._notify_subscribers(message)
             raise
         finally:
-            if self._connection:
-                self._connection.close()
-                self._connection = None
+            self._close_connection()
+
+    async def _connect_and_listen(self, domain, credentials):
+        logger.info("Establishing agent connection...")
+        with self._measure(self.PHASE_AGENT_CONNECT):
+            self._connection = await self._connector.connect(domain, credentials)
+        logger.info("Agent connection established.")
+
+        if not self._connection:
+            # The fallback local agent implementation does not return a connection object.
+            # This branch should be removed after removing the fallback implementation.
+            await self._notify_subscribers(local_agent.new_status(local_agent.State.CONNECTED))
+            return
+
+        if self._features:
+            # A new agent session starts on each connection, so on reconnection
+            # all the features last requested are applied again.
+            logger.info("Requesting agent features...")
+            self._feature_scheduler.reset()
+            self._feature_scheduler.schedule(self._features)
+            with self._measure(self.PHASE_FEATURES_REQUEST):
+                await self._feature_scheduler.flush()
+            logger.info("Listening on agent connection...")
+
+        await self.listen(self._connection)
+
+    def _measure(self, phase: str):
+        if not self.timeline:
+            return contextlib.nullcontext()
+        return self.timeline.measure(phase)
+
+    def _get_backoff_delay(self, failed_attempts: int) -> float:
+        """Returns the exponential backoff delay, half of which is randomized."""
+        delay = min(
+            self._backoff_max_in_secs,
+            self._backoff_base_in_secs * 2 ** (failed_attempts - 1)
+        )
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _close_connection(self):
+        if self._connection:
+            self._connection.close()
+            self._connection = None
 
-    async def listen(self, connection: AgentConnection):
+    async def listen(self, connection: local_agent.AgentConnection):
         """Listens for local agent messages."""
         while True:
             try:
                 message = await connection.read()
-            except ErrorMessage:
+            except local_agent.ErrorMessage:
                 logger.warning("Unhandled agent error message.", exc_info=True)
                 continue
+            if self.timeline:
+                self.timeline.mark(self.PHASE_FIRST_STATUS)
+            self._feature_scheduler.confirm(getattr(message, "features", None))
             await self._notify_subscribers(message)
 
-    async def request_features(self, features: AgentFeatures):
-        """Requests the features to be set on the current VPN connection."""
-        if features:
+    async def request_features(self, features: local_agent.AgentFeatures):
+        """
+        Requests the features to be set on the current VPN connection.
+
+        Requests made in quick succession are coalesced, and only the
+        features that changed are sent. If the agent connection is currently
+        being reestablished, the features will be requested once it is.
+        """
+        if not features:
+            return
+
+        self._features = merge_features(self._features, features)
+        self._feature_scheduler.schedule(features)
+
+    async def flush_feature_requests(self):
+        """Requests the features scheduled to be requested right away."""
+        await self._feature_scheduler.flush()
+
+    async def _send_features(self, features: local_agent.AgentFeatures):
+        if self._connection:
             await self._connection.request_features(features)
 
     def _on_background_task_stopped(self, background_task: asyncio.Task):
@@ -131,13 +252,27 @@ class AgentListener:
         except asyncio.CancelledError:
             logger.info("Agent listener was successfully stopped.")
 
+    def prepare(self, credentials):
+        """Loads the credentials for the next agent connection in advance."""
+        self._connector.prepare(credentials)
+
+    def invalidate_credentials_cache(self):
+        """Discards any state the connector built from the previous credentials."""
+        self._connector.invalidate_credentials_cache()
+
     def stop(self):
         """Stop listening to the local agent connection."""
+        self._feature_scheduler.reset()
         if self._background_task:
             self._background_task.cancel()
             self._background_task = None
+        # Statuses still queued belong to the connection being stopped.
+        self._dispatcher.cancel()
+
+    async def wait_for_subscribers(self):
+        """Waits until subscribers were notified of all messages read so far."""
+        await self._dispatcher.join()
 
-    async def _notify_subscribers(self, message: Status):
+    async def _notify_subscribers(self, message: local_agent.Status):
         """Notify all subscribers of a new message."""
-        for subscriber in self._subscribers:
-            await subscriber(message)
+        await self._dispatcher.publish(message)
@@ -0,0 +1,273 @@
+"""
+Path MTU discovery towards the Wireguard server.
+
+The largest packet size that goes through the path to the server is found by
+binary search, sending probes with the Don't Fragment flag set. The tunnel
+MTU is then set so that encapsulated packets are never fragmented.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import errno
+import os
+import socket
+import struct
+from typing import Awaitable, Callable, Optional, Tuple
+
+from proton.vpn import logging
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.network import \
+    bind_to_interface, get_default_interface, get_network_id
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Socket options from linux/in.h, which are not exposed by the socket module.
+IP_MTU_DISCOVER = 10
+IP_PMTUDISC_PROBE = 3  # Set the DF flag, ignoring the path MTU cached by the kernel.
+IP_MTU = 14
+
+# IPv4 and UDP/ICMP headers.
+PROBE_HEADERS_SIZE = 28
+# IPv4, UDP and Wireguard data message headers added to each tunnel packet.
+WIREGUARD_OVERHEAD = 60
+# Smallest path MTU accepted as a discovery result. Lost probes can make the
+# search drift towards the IPv4 minimum of 576, which would needlessly
+# fragment the tunnel traffic, so smaller paths are left to NM.
+MIN_PATH_MTU = 1280
+# Maximum size of an IPv4 packet.
+MAX_PATH_MTU = 65535
+DEFAULT_PATH_MTU = 1500
+
+_ICMP_ECHO_REQUEST = 8
+_ICMP_HEADER = struct.Struct("!BBHHH")
+
+# Probes whether a packet of the given size, headers included, reaches the
+# host, sending it through the interface if one is given.
+PathMtuProbe = Callable[[str, int, Optional[str]], Awaitable[bool]]
+
+
+def _create_probe_socket(
+        sock_type: int, proto: int, address: Tuple[str, int], interface: Optional[str]
+) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, sock_type, proto)
+    try:
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+        if interface:
+            bind_to_interface(sock, interface)
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def get_route_mtu(host: str, interface: Optional[str] = None) -> int:
+    """
+    Returns the MTU of the route to the host, through the interface if one is
+    given, which bounds the path MTU.
+    """
+    with _create_probe_socket(socket.SOCK_DGRAM, 0, (host, 9), interface) as sock:
+        return sock.getsockopt(socket.IPPROTO_IP, IP_MTU)
+
+
+async def _send_probe(sock: socket.socket, payload: bytes, timeout: float) -> bool:
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.sock_sendall(sock, payload)
+        await asyncio.wait_for(loop.sock_recv(sock, len(payload) + 1), timeout)
+    except asyncio.TimeoutError:
+        return False
+    except OSError as exc:
+        # The packet is larger than the MTU of the local interface.
+        if exc.errno == errno.EMSGSIZE:
+            return False
+        raise
+    return True
+
+
+async def probe_icmp_echo(
+        host: str, size: int, timeout: float, interface: Optional[str] = None
+) -> bool:
+    """
+    Sends an ICMP echo request of the given size, with the DF flag set, and
+    waits for the reply. Unprivileged ICMP sockets are used, which requires
+    the net.ipv4.ping_group_range sysctl to include the user group.
+
+    :raises OSError: if ICMP sockets are not allowed or the host is unreachable.
+    """
+    address = (host, 0)
+    with _create_probe_socket(socket.SOCK_DGRAM, socket.IPPROTO_ICMP, address, interface) as sock:
+        # The kernel sets the identifier and the checksum of the echo request.
+        header = _ICMP_HEADER.pack(_ICMP_ECHO_REQUEST, 0, 0, 0, 1)
+        data = os.urandom(max(0, size - PROBE_HEADERS_SIZE))
+        return await _send_probe(sock, header + data, timeout)
+
+
+async def probe_udp_echo(
+        host: str, port: int, size: int, timeout: float, interface: Optional[str] = None
+) -> bool:
+    """
+    Sends a UDP datagram of the given size, with the DF flag set, to a UDP
+    echo service and waits for it to be echoed back.
+
+    :raises OSError: if the host is unreachable.
+    """
+    with _create_probe_socket(socket.SOCK_DGRAM, 0, (host, port), interface) as sock:
+        data = os.urandom(max(0, size - PROBE_HEADERS_SIZE))
+        return await _send_probe(sock, data, timeout)
+
+
+class PathMtuDiscovery:
+    """
+    Discovers the path MTU towards a host.
+
+    Results are cached per network and host, so that following connections
+    from the same network skip the discovery. Failures are cached for a
+    shorter time, so that connections to a host not answering the probes
+    are not delayed by the probe timeouts each time.
+
+    The probes are sent through the interface of the default route, so that
+    they do not go through the tunnel of the current connection when
+    switching servers.
+
+    The discovery runs before the connection is set up, so it's given up
+    after MAX_DISCOVERY_TIME_IN_SECS.
+    """
+    TIMEOUT_IN_SECS = 0.5
+    ATTEMPTS = 2
+    MAX_DISCOVERY_TIME_IN_SECS = 3
+    CACHE_TTL_IN_SECS = 24 * 60 * 60
+    FAILURE_CACHE_TTL_IN_SECS = 10 * 60
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, probe: Optional[PathMtuProbe] = None,
+            timeout: float = TIMEOUT_IN_SECS,
+            max_discovery_time: float = MAX_DISCOVERY_TIME_IN_SECS,
+            cache: Optional[TTLCache] = None,
+            failure_cache: Optional[TTLCache] = None,
+            network_id_getter: Callable[[], Optional[str]] = get_network_id,
+            route_mtu_getter: Callable[[str, Optional[str]], int] = get_route_mtu,
+            interface_getter: Callable[[], Optional[str]] = get_default_interface
+    ):
+        self._timeout = timeout
+        self._max_discovery_time = max_discovery_time
+        self._probe = probe or (
+            lambda host, size, interface: probe_icmp_echo(host, size, self._timeout, interface)
+        )
+        self._cache = cache if cache is not None else TTLCache(self.CACHE_TTL_IN_SECS)
+        self._failure_cache = (
+            failure_cache if failure_cache is not None
+            else TTLCache(self.FAILURE_CACHE_TTL_IN_SECS)
+        )
+        self._get_network_id = network_id_getter
+        self._get_route_mtu = route_mtu_getter
+        self._get_interface = interface_getter
+
+    async def discover(self, host: str) -> Optional[int]:
+        """
+        Returns the path MTU towards the host, or None if it could not be
+        discovered, e.g. because the host does not answer the probes.
+        """
+        network_id = self._get_network_id()
+        cache_key = (network_id, host)
+        cached_mtu = self._cache.get(cache_key)
+        if cached_mtu:
+            logger.info("Using cached path MTU %s for %s.", cached_mtu, host)
+            return cached_mtu
+        if self._failure_cache.get(cache_key):
+            logger.info("Path MTU discovery to %s failed recently, skipping it.", host)
+            return None
+
+        try:
+            mtu = await asyncio.wait_for(
+                self.search(host, self._get_interface()), self._max_discovery_time
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Path MTU discovery to %s took too long.", host)
+            mtu = None
+        except OSError:
+            logger.warning("Unable to probe the path MTU to %s.", host, exc_info=True)
+            mtu = None
+        else:
+            if mtu is None:
+                logger.warning("Path MTU probes to %s were not answered.", host)
+
+        if mtu is None:
+            if network_id is not None:
+                self._failure_cache.set(cache_key, True)
+            return None
+
+        logger.info("Path MTU to %s is %s.", host, mtu)
+        if network_id is not None:
+            self._cache.set(cache_key, mtu)
+        return mtu
+
+    async def search(self, host: str, interface: Optional[str] = None) -> Optional[int]:
+        """
+        Binary searches the largest packet size which reaches the host, between
+        MIN_PATH_MTU and the MTU of the route to the host.
+
+        :param interface: interface to send the probes through.
+
+        :returns: the path MTU, or None if not even MIN_PATH_MTU sized probes
+            were answered.
+        :raises OSError: if the host could not be probed.
+        """
+        try:
+            upper_bound = min(self._get_route_mtu(host, interface), MAX_PATH_MTU)
+        except OSError:
+            logger.debug("Unable to get route MTU to %s.", host, exc_info=True)
+            upper_bound = DEFAULT_PATH_MTU
+        if upper_bound < MIN_PATH_MTU:
+            logger.debug("Route MTU to %s is below %s.", host, MIN_PATH_MTU)
+            return None
+
+        # The route MTU is usually the path MTU, so it's probed first.
+        if await self._probe_with_retries(host, upper_bound, interface):
+            return upper_bound
+        if not await self._probe_with_retries(host, MIN_PATH_MTU, interface):
+            return None
+
+        lower_bound = MIN_PATH_MTU
+        while upper_bound - lower_bound > 1:
+            size = (lower_bound + upper_bound) // 2
+            if await self._probe_with_retries(host, size, interface):
+                lower_bound = size
+            else:
+                upper_bound = size
+        return lower_bound
+
+    async def _probe_with_retries(self, host: str, size: int, interface: Optional[str]) -> bool:
+        # Probes can be lost for other reasons than their size.
+        for _ in range(self.ATTEMPTS):
+            if await self._probe(host, size, interface):
+                return True
+        return False
+
+    def invalidate(self):
+        """Removes all cached path MTUs and failures."""
+        self._cache.invalidate()
+        self._failure_cache.invalidate()
+
+
+def get_tunnel_mtu(path_mtu: int) -> int:
+    """Returns the largest tunnel MTU for which encapsulated packets fit the path MTU."""
+    return path_mtu - WIREGUARD_OVERHEAD
@@ -0,0 +1,89 @@
+"""
+Helpers to identify the physical network the device is currently connected to.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import socket
+from typing import Optional, Tuple
+
+from proton.vpn import logging
+
+logger = logging.getLogger(__name__)
+
+IPV4_ROUTES_PATH = "/proc/net/route"
+_DEFAULT_DESTINATION = "00000000"
+_METRIC_FIELD = 6
+
+
+def _get_default_route(routes_path: str) -> Optional[Tuple[str, str]]:
+    """
+    Returns the interface and gateway of the IPv4 default route, if any.
+    When there are several, e.g. over Wi-Fi and Ethernet, the one with the
+    lowest metric is used, as the kernel does.
+    """
+    default_route = None
+    lowest_metric = None
+    try:
+        with open(routes_path, "r", encoding="utf-8") as file:
+            next(file)  # Skip header.
+            for line in file:
+                fields = line.split()
+                if len(fields) <= _METRIC_FIELD or fields[1] != _DEFAULT_DESTINATION:
+                    continue
+                metric = int(fields[_METRIC_FIELD])
+                if lowest_metric is None or metric < lowest_metric:
+                    default_route, lowest_metric = (fields[0], fields[2]), metric
+    except (OSError, StopIteration, ValueError):
+        logger.warning("Unable to read IPv4 routes from %s.", routes_path, exc_info=True)
+        return None
+
+    return default_route
+
+
+def get_network_id(routes_path: str = IPV4_ROUTES_PATH) -> Optional[str]:
+    """
+    Returns an identifier for the network the device is currently connected to,
+    based on the interface and gateway of the IPv4 default route.
+
+    None is returned if there is no default route. Note that the routes set up
+    by the VPN connection are ignored, since Wireguard default routes are
+    added to a separate routing table.
+    """
+    default_route = _get_default_route(routes_path)
+    return "/".join(default_route) if default_route else None
+
+
+def get_default_interface(routes_path: str = IPV4_ROUTES_PATH) -> Optional[str]:
+    """
+    Returns the interface of the IPv4 default route, i.e. the physical
+    interface the Wireguard traffic goes through, or None if there is none.
+    """
+    default_route = _get_default_route(routes_path)
+    return default_route[0] if default_route else None
+
+
+def bind_to_interface(sock: socket.socket, interface: str):
+    """
+    Makes the socket send and receive packets only through the interface,
+    whatever the routing rules are, e.g. to reach a host outside the VPN
+    tunnels. Unprivileged processes can do it since Linux 5.7.
+
+    :raises OSError: if the socket could not be bound to the interface.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, interface.encode())
@@ -0,0 +1,164 @@
+"""
+Wireguard server latency prober.
+
+Measures the handshake round trip time and loss to a set of candidate
+Wireguard servers, so that the fastest one can be selected.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import math
+import statistics
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, List, Optional
+
+from proton.vpn import logging
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.endpoint import probe_endpoint
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.handshake import \
+    build_handshake_initiation
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.network import \
+    get_default_interface, get_network_id
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ServerProbeResult:
+    """Outcome of probing a server."""
+    server: Any
+    attempts: int
+    round_trip_times: List[float] = field(default_factory=list)
+
+    @property
+    def rtt(self) -> Optional[float]:
+        """Median handshake round trip time in seconds, or None if the server never answered."""
+        if not self.round_trip_times:
+            return None
+        return statistics.median(self.round_trip_times)
+
+    @property
+    def loss(self) -> float:
+        """Ratio of handshake initiations that were not answered."""
+        return 1 - len(self.round_trip_times) / self.attempts
+
+    def sort_key(self):
+        """Key used to rank results: less loss first, then lower round trip time."""
+        return self.loss, self.rtt if self.rtt is not None else math.inf
+
+
+class ServerProber:
+    """
+    Probes candidate Wireguard servers concurrently.
+
+    The candidate servers are expected to have the ``server_ip``,
+    ``wireguard_ports`` and ``x25519pk`` attributes. Probe results are cached
+    per network and server, so that the fastest server can be selected without
+    having to probe them again. The probes are sent through the interface of
+    the default route, so that they do not go through the current tunnel.
+
+    Server selection is left to the caller: a Wireguard connection is created
+    for a server that was already chosen, so it is up to the app to probe the
+    candidate servers ahead of time, e.g. while disconnected, and to create the
+    connection for the one returned by get_fastest_server().
+    """
+    MAX_CONCURRENT_PROBES = 16
+    ATTEMPTS = 3
+    TIMEOUT_IN_SECS = 1
+    # Wireguard servers ignore handshake initiations from the same peer when
+    # they are received less than 20 ms apart.
+    INTERVAL_BETWEEN_ATTEMPTS_IN_SECS = 0.05
+    CACHE_TTL_IN_SECS = 5 * 60
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, max_concurrent_probes: int = MAX_CONCURRENT_PROBES,
+            attempts: int = ATTEMPTS, timeout: float = TIMEOUT_IN_SECS,
+            cache: Optional[TTLCache] = None,
+            network_id_getter: Callable[[], Optional[str]] = get_network_id,
+            interface_getter: Callable[[], Optional[str]] = get_default_interface
+    ):
+        self._max_concurrent_probes = max_concurrent_probes
+        self._attempts = attempts
+        self._timeout = timeout
+        self._cache = cache if cache is not None else TTLCache(self.CACHE_TTL_IN_SECS)
+        self._get_network_id = network_id_getter
+        self._get_interface = interface_getter
+
+    async def probe(self, servers: List[Any], private_key: str) -> List[ServerProbeResult]:
+        """
+        Probes all servers, with at most ``max_concurrent_probes`` of them
+        being probed at the same time.
+
+        :param servers: candidate servers.
+        :param private_key: client Wireguard private key used in the handshake initiations.
+        :returns: the probe results, ranked from best to worst.
+        """
+        semaphore = asyncio.Semaphore(self._max_concurrent_probes)
+        network_id = self._get_network_id()
+        interface = self._get_interface()
+
+        async def probe_server(server) -> ServerProbeResult:
+            async with semaphore:
+                result = await self._probe_server(server, private_key, interface)
+            self._cache.set((network_id, server.server_ip), result)
+            return result
+
+        results = await asyncio.gather(*(probe_server(server) for server in servers))
+        return sorted(results, key=ServerProbeResult.sort_key)
+
+    async def _probe_server(
+            self, server, private_key: str, interface: Optional[str]
+    ) -> ServerProbeResult:
+        result = ServerProbeResult(server=server, attempts=self._attempts)
+        port = server.wireguard_ports.udp[0]
+        for attempt in range(self._attempts):
+            if attempt:
+                await asyncio.sleep(self.INTERVAL_BETWEEN_ATTEMPTS_IN_SECS)
+            try:
+                message = build_handshake_initiation(private_key, server.x25519pk)
+                result.round_trip_times.append(
+                    await probe_endpoint(
+                        server.server_ip, port, message, self._timeout, interface
+                    )
+                )
+            except (asyncio.TimeoutError, OSError) as exc:
+                logger.debug("Probe to %s:%s failed: %r", server.server_ip, port, exc)
+
+        return result
+
+    def get_cached_results(self, servers: List[Any]) -> List[ServerProbeResult]:
+        """Returns the cached probe results for the servers, ranked from best to worst."""
+        network_id = self._get_network_id()
+        results = []
+        for server in servers:
+            result = self._cache.get((network_id, server.server_ip))
+            if result:
+                results.append(replace(result, server=server))
+        return sorted(results, key=ServerProbeResult.sort_key)
+
+    def get_fastest_server(self, servers: List[Any]) -> Optional[Any]:
+        """
+        Returns the server with the best cached probe result, or None if
+        none of the servers was probed recently from the current network.
+        """
+        results = self.get_cached_results(servers)
+        if not results or results[0].rtt is None:
+            return None
+        return results[0].server
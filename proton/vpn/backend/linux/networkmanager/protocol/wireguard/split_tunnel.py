@@ -0,0 +1,163 @@
+"""
+Split tunneling route engine.
+
+Computes the minimal set of IPv4 networks to route through the tunnel, given
+the networks to include and to exclude. Networks are handled as sorted,
+disjoint intervals of addresses, so that computing the set is O(n log n) on
+the number of networks given, and the result is compacted into the fewest
+CIDR blocks covering exactly the same addresses.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import socket
+import struct
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, List, Tuple
+
+# Inclusive ranges of IPv4 addresses, as integers.
+Interval = Tuple[int, int]
+
+ALL_ADDRESSES = "0.0.0.0/0"
+_ADDRESS_BITS = 32
+_ADDRESS = struct.Struct("!I")
+
+
+@dataclass(frozen=True)
+class SplitTunneling:
+    """
+    Networks to route through the tunnel (all of them when none are given),
+    except for the excluded ones. Networks are given in CIDR notation.
+    """
+    include: Tuple[str, ...] = ()
+    exclude: Tuple[str, ...] = ()
+
+    def __post_init__(self):
+        # Lists are accepted for convenience, but stored as tuples to be hashable.
+        object.__setattr__(self, "include", tuple(self.include))
+        object.__setattr__(self, "exclude", tuple(self.exclude))
+
+
+def parse_network(network: str) -> Interval:
+    """
+    Returns the interval of addresses of an IPv4 network in CIDR notation.
+    Addresses without a prefix length are single-address networks.
+
+    Networks are parsed with inet_pton rather than the ipaddress module,
+    which is an order of magnitude slower on large inputs.
+
+    :raises ValueError: if the network is not a valid IPv4 network.
+    """
+    address, _, prefix_length = network.strip().partition("/")
+    try:
+        start = _ADDRESS.unpack(socket.inet_pton(socket.AF_INET, address))[0]
+        prefix_length = int(prefix_length) if prefix_length else _ADDRESS_BITS
+    except (OSError, ValueError) as exc:
+        raise ValueError(f"Invalid IPv4 network: {network!r}") from exc
+    if not 0 <= prefix_length <= _ADDRESS_BITS:
+        raise ValueError(f"Invalid IPv4 network: {network!r}")
+
+    host_bits = _ADDRESS_BITS - prefix_length
+    start = start >> host_bits << host_bits
+    return start, start + (1 << host_bits) - 1
+
+
+def to_intervals(networks: Iterable[str]) -> List[Interval]:
+    """
+    Returns the sorted, disjoint intervals covering the networks given.
+
+    :raises ValueError: if a network is not a valid IPv4 network.
+    """
+    return merge([parse_network(network) for network in networks])
+
+
+def merge(intervals: List[Interval]) -> List[Interval]:
+    """Returns the union of the intervals, as sorted, disjoint intervals."""
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract(intervals: List[Interval], excluded: List[Interval]) -> List[Interval]:
+    """Returns the intervals minus the excluded ones. Both must be sorted and disjoint."""
+    result: List[Interval] = []
+    excluded_index = 0
+    for start, end in intervals:
+        # Skip the excluded intervals which end before this one starts.
+        while excluded_index < len(excluded) and excluded[excluded_index][1] < start:
+            excluded_index += 1
+
+        index = excluded_index
+        while index < len(excluded) and excluded[index][0] <= end:
+            excluded_start, excluded_end = excluded[index]
+            if excluded_start > start:
+                result.append((start, excluded_start - 1))
+            start = max(start, excluded_end + 1)
+            if start > end:
+                break
+            index += 1
+
+        if start <= end:
+            result.append((start, end))
+    return result
+
+
+def to_networks(intervals: List[Interval]) -> List[str]:
+    """Returns the fewest CIDR blocks covering exactly the intervals given."""
+    networks = []
+    for start, end in intervals:
+        while start <= end:
+            # Largest block aligned on the start address which does not go past the end.
+            host_bits = min(
+                (start & -start).bit_length() - 1 if start else _ADDRESS_BITS,
+                (end - start + 1).bit_length() - 1
+            )
+            address = socket.inet_ntop(socket.AF_INET, _ADDRESS.pack(start))
+            networks.append(f"{address}/{_ADDRESS_BITS - host_bits}")
+            start += 1 << host_bits
+    return networks
+
+
+@lru_cache(maxsize=16)
+def compute_allowed_ips(
+        split_tunneling: SplitTunneling,
+        always_include: Tuple[str, ...] = (),
+        always_exclude: Tuple[str, ...] = ()
+) -> Tuple[str, ...]:
+    """
+    Returns the networks to route through the tunnel, in CIDR notation.
+
+    The networks to always include (e.g. the VPN DNS server) take precedence
+    over the excluded ones, and the networks to always exclude (e.g. the VPN
+    server itself) take precedence over everything else.
+
+    :raises ValueError: if any of the networks is not a valid IPv4 network.
+    """
+    intervals = subtract(
+        to_intervals(split_tunneling.include or (ALL_ADDRESSES,)),
+        to_intervals(split_tunneling.exclude)
+    )
+    intervals = merge(intervals + to_intervals(always_include))
+    intervals = subtract(intervals, to_intervals(always_exclude))
+    return tuple(to_networks(intervals))
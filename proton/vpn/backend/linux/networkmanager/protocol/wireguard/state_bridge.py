@@ -0,0 +1,136 @@
+"""
+Bridge for connection state changes, from the GLib thread to the asyncio loop.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional
+
+from proton.vpn import logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StateTransition:
+    """Connection state change, together with the time it was queued at."""
+    state: Any
+    reason: Any
+    queued_at: float
+
+
+@dataclass
+class BridgeMetrics:
+    """Metrics of the state transitions that went through the bridge."""
+    batches: int = 0
+    received: int = 0
+    collapsed: int = 0
+    handled: int = 0
+    max_batch_size: int = 0
+    last_latency: Optional[float] = None
+    max_latency: float = 0
+    total_latency: float = 0
+
+    @property
+    def mean_latency(self) -> Optional[float]:
+        """Mean time, in seconds, from a transition being queued until it was drained."""
+        if not self.received:
+            return None
+        return self.total_latency / self.received
+
+
+def collapse(
+        transitions: List[StateTransition],
+        supersedes: Callable[[StateTransition, StateTransition], bool]
+) -> List[StateTransition]:
+    """Returns the transitions, in order, which are not superseded by a later one."""
+    kept: List[StateTransition] = []
+    for transition in reversed(transitions):
+        if not any(supersedes(transition, later) for later in kept):
+            kept.append(transition)
+    kept.reverse()
+    return kept
+
+
+class StateChangeBridge:
+    """
+    Queues connection state transitions from any thread, and drains them in
+    batches on the asyncio loop.
+
+    The loop is only woken up when the first transition is queued after
+    the previous batch was drained, no matter how many transitions are
+    queued before the batch is drained.
+
+    Transitions superseded by a later transition in the same batch are
+    collapsed, so that the handler is not called with them.
+    """
+
+    def __init__(
+            self, loop: asyncio.AbstractEventLoop,
+            handler: Callable[[StateTransition], None],
+            supersedes: Callable[[StateTransition, StateTransition], bool] = None,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        self._loop = loop
+        self._handler = handler
+        self._supersedes = supersedes or (lambda earlier, later: False)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pending: List[StateTransition] = []
+        self.metrics = BridgeMetrics()
+
+    def put(self, state: Any, reason: Any):
+        """Queues a state transition. This method is thread-safe."""
+        transition = StateTransition(state=state, reason=reason, queued_at=self._clock())
+        with self._lock:
+            self._pending.append(transition)
+            is_first = len(self._pending) == 1
+        if is_first:
+            self._loop.call_soon_threadsafe(self.drain)
+
+    def drain(self):
+        """Handles all the transitions queued so far. To be called on the asyncio loop."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        self._record(batch)
+        transitions = collapse(batch, self._supersedes)
+        self.metrics.collapsed += len(batch) - len(transitions)
+        for transition in transitions:
+            self.metrics.handled += 1
+            try:
+                self._handler(transition)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Unable to handle connection state transition.")
+
+    def _record(self, batch: List[StateTransition]):
+        now = self._clock()
+        self.metrics.batches += 1
+        self.metrics.received += len(batch)
+        self.metrics.max_batch_size = max(self.metrics.max_batch_size, len(batch))
+        for transition in batch:
+            latency = now - transition.queued_at
+            self.metrics.last_latency = latency
+            self.metrics.max_latency = max(self.metrics.max_latency, latency)
+            self.metrics.total_latency += latency
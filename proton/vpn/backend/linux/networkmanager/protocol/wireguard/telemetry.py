@@ -0,0 +1,375 @@
+"""
+Wireguard tunnel telemetry.
+
+Polls the traffic counters of the Wireguard interface and the time of the
+latest handshake with the server, and publishes the throughput and the
+handshake age to subscribers. Polling slows down while the tunnel is idle.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Deque, Iterator, List, Optional, Tuple
+
+from proton.vpn import logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class InterfaceCounters:
+    """Traffic counters of a network interface."""
+    rx_bytes: int
+    tx_bytes: int
+    rx_packets: int
+    tx_packets: int
+
+
+@dataclass
+class TunnelStats:  # pylint: disable=too-many-instance-attributes
+    """Sample of the tunnel telemetry."""
+    timestamp: float
+    counters: InterfaceCounters
+    rx_rate: Optional[float] = None
+    tx_rate: Optional[float] = None
+    last_handshake: Optional[float] = None
+    handshake_age: Optional[float] = None
+
+
+class SysfsStatsReader:  # pylint: disable=too-few-public-methods
+    """Reads the interface counters from sysfs."""
+    SYSFS_NET_ROOT = "/sys/class/net"
+
+    def __init__(self, root: str = SYSFS_NET_ROOT):
+        self._root = Path(root)
+
+    def read(self, interface: str) -> InterfaceCounters:
+        """
+        Returns the current counters of the interface.
+
+        :raises OSError: if the interface does not exist.
+        """
+        statistics = self._root / interface / "statistics"
+        return InterfaceCounters(**{
+            counter: int((statistics / counter).read_text())
+            for counter in ("rx_bytes", "tx_bytes", "rx_packets", "tx_packets")
+        })
+
+
+# Generic netlink and Wireguard constants, from linux/netlink.h,
+# linux/genetlink.h and linux/wireguard.h.
+_NETLINK_GENERIC = 16
+_NLMSG_ERROR = 2
+_NLMSG_DONE = 3
+_NLM_F_REQUEST = 0x1
+_NLM_F_DUMP = 0x300
+_NLA_TYPE_MASK = 0x3fff
+_GENL_ID_CTRL = 0x10
+_CTRL_CMD_GETFAMILY = 3
+_CTRL_ATTR_FAMILY_ID = 1
+_CTRL_ATTR_FAMILY_NAME = 2
+_WG_GENL_NAME = b"wireguard"
+_WG_GENL_VERSION = 1
+_WG_CMD_GET_DEVICE = 0
+_WGDEVICE_A_IFNAME = 2
+_WGDEVICE_A_PEERS = 8
+_WGPEER_A_LAST_HANDSHAKE_TIME = 6
+
+_NLMSGHDR = struct.Struct("=IHHII")
+_GENLMSGHDR = struct.Struct("=BBH")
+_NLATTR = struct.Struct("=HH")
+
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def _attribute(attribute_type: int, payload: bytes) -> bytes:
+    header = _NLATTR.pack(_NLATTR.size + len(payload), attribute_type)
+    return (header + payload).ljust(_align(_NLATTR.size + len(payload)), b"\0")
+
+
+def _iter_attributes(data: bytes) -> Iterator[Tuple[int, bytes]]:
+    offset = 0
+    while offset + _NLATTR.size <= len(data):
+        length, attribute_type = _NLATTR.unpack_from(data, offset)
+        if length < _NLATTR.size:
+            return
+        yield attribute_type & _NLA_TYPE_MASK, data[offset + _NLATTR.size:offset + length]
+        offset += _align(length)
+
+
+def _iter_messages(data: bytes) -> Iterator[Tuple[int, bytes]]:
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, message_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+        if length < _NLMSGHDR.size:
+            return
+        yield message_type, data[offset + _NLMSGHDR.size:offset + length]
+        offset += _align(length)
+
+
+def parse_last_handshake(payload: bytes) -> Optional[float]:
+    """
+    Returns the latest handshake time, as seconds since the epoch, of the
+    peers in the payload of a WG_CMD_GET_DEVICE reply, or None if there was
+    no handshake yet.
+    """
+    last_handshake = None
+    for attribute_type, value in _iter_attributes(payload[_GENLMSGHDR.size:]):
+        if attribute_type != _WGDEVICE_A_PEERS:
+            continue
+        for _, peer in _iter_attributes(value):
+            for peer_attribute_type, peer_value in _iter_attributes(peer):
+                if peer_attribute_type == _WGPEER_A_LAST_HANDSHAKE_TIME:
+                    seconds, nanoseconds = struct.unpack("=qq", peer_value)
+                    if seconds or nanoseconds:
+                        handshake = seconds + nanoseconds / 10**9
+                        last_handshake = max(last_handshake or 0, handshake)
+    return last_handshake
+
+
+class WireguardNetlinkReader:
+    """
+    Reads the latest peer handshake time from the Wireguard kernel module,
+    through generic netlink.
+
+    Reading the Wireguard device requires the CAP_NET_ADMIN capability. When
+    the process does not have it, the handshake time is not available.
+
+    The netlink socket is kept open between reads until close() is called.
+    Reads block until the kernel replies, for TIMEOUT_IN_SECS at most.
+    """
+    TIMEOUT_IN_SECS = 1
+
+    def __init__(self):
+        self._family_id = None
+        self._is_available = True
+        self._sequence = 0
+        self._socket: Optional[socket.socket] = None
+        # Reads may run on executor threads while the socket is closed.
+        self._lock = threading.Lock()
+
+    def read_last_handshake(self, interface: str) -> Optional[float]:
+        """Returns the latest handshake time as seconds since the epoch, if known."""
+        if not self._is_available:
+            return None
+        with self._lock:
+            try:
+                sock = self._get_socket()
+                if self._family_id is None:
+                    self._family_id = self._resolve_family_id(sock)
+                replies = self._request(
+                    sock, self._family_id, _NLM_F_REQUEST | _NLM_F_DUMP, _WG_CMD_GET_DEVICE,
+                    _attribute(_WGDEVICE_A_IFNAME, interface.encode() + b"\0")
+                )
+            except PermissionError:
+                logger.info("Wireguard handshake time is not available without CAP_NET_ADMIN.")
+                self._is_available = False
+                self._close_socket()
+                return None
+            except OSError:
+                logger.debug("Unable to read Wireguard device %s.", interface, exc_info=True)
+                # A late reply must not be taken for the reply to the next request.
+                self._close_socket()
+                return None
+
+        handshakes = [parse_last_handshake(reply) for reply in replies]
+        return max((handshake for handshake in handshakes if handshake), default=None)
+
+    def close(self):
+        """Closes the netlink socket. The next read opens a new one."""
+        with self._lock:
+            self._close_socket()
+
+    def _get_socket(self) -> socket.socket:
+        if not self._socket:
+            self._socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, _NETLINK_GENERIC)
+            self._socket.settimeout(self.TIMEOUT_IN_SECS)
+        return self._socket
+
+    def _close_socket(self):
+        if self._socket:
+            self._socket.close()
+            self._socket = None
+
+    def _resolve_family_id(self, sock: socket.socket) -> int:
+        replies = self._request(
+            sock, _GENL_ID_CTRL, _NLM_F_REQUEST, _CTRL_CMD_GETFAMILY,
+            _attribute(_CTRL_ATTR_FAMILY_NAME, _WG_GENL_NAME + b"\0")
+        )
+        for reply in replies:
+            for attribute_type, value in _iter_attributes(reply[_GENLMSGHDR.size:]):
+                if attribute_type == _CTRL_ATTR_FAMILY_ID:
+                    return struct.unpack("=H", value[:2])[0]
+        raise OSError("Wireguard generic netlink family not found.")
+
+    def _request(  # pylint: disable=too-many-arguments
+            self, sock: socket.socket, family_id: int, flags: int, command: int, attributes: bytes
+    ) -> List[bytes]:
+        self._sequence += 1
+        payload = _GENLMSGHDR.pack(command, _WG_GENL_VERSION, 0) + attributes
+        sock.send(
+            _NLMSGHDR.pack(_NLMSGHDR.size + len(payload), family_id, flags, self._sequence, 0)
+            + payload
+        )
+
+        replies = []
+        while True:
+            for message_type, message in _iter_messages(sock.recv(65536)):
+                if message_type == _NLMSG_DONE:
+                    return replies
+                if message_type == _NLMSG_ERROR:
+                    error = -struct.unpack_from("=i", message)[0]
+                    if error:
+                        raise OSError(error, os.strerror(error))
+                    return replies
+                replies.append(message)
+            if not flags & _NLM_F_DUMP:
+                return replies
+
+
+class TunnelTelemetry:
+    """
+    Polls the Wireguard interface and publishes the rolling throughput and
+    the handshake age to subscribers.
+
+    Subscribers are called with a TunnelStats instance after each poll.
+    While the counters do not change, the poll interval doubles up to
+    MAX_POLL_INTERVAL_IN_SECS, and it's reset as soon as there is traffic.
+    """
+    POLL_INTERVAL_IN_SECS = 1
+    MAX_POLL_INTERVAL_IN_SECS = 8
+    WINDOW_SIZE = 5
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, stats_reader: Optional[SysfsStatsReader] = None,
+            handshake_reader: Optional[WireguardNetlinkReader] = None,
+            poll_interval_in_secs: float = POLL_INTERVAL_IN_SECS,
+            max_poll_interval_in_secs: float = MAX_POLL_INTERVAL_IN_SECS,
+            window_size: int = WINDOW_SIZE,
+            clock: Callable[[], float] = time.monotonic,
+            wall_clock: Callable[[], float] = time.time
+    ):
+        self._stats_reader = stats_reader or SysfsStatsReader()
+        self._handshake_reader = handshake_reader or WireguardNetlinkReader()
+        self._poll_interval_in_secs = poll_interval_in_secs
+        self._max_poll_interval_in_secs = max_poll_interval_in_secs
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._samples: Deque[Tuple[float, InterfaceCounters]] = deque(maxlen=window_size)
+        self._subscribers: List[Callable[[TunnelStats], None]] = []
+        self._interface = None
+        self._task = None
+        self.latest: Optional[TunnelStats] = None
+
+    @property
+    def is_running(self) -> bool:
+        """Returns whether the interface is being polled."""
+        return bool(self._task)
+
+    def subscribe(self, subscriber: Callable[[TunnelStats], None]):
+        """Subscribes to the tunnel stats."""
+        if subscriber not in self._subscribers:
+            self._subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber: Callable[[TunnelStats], None]):
+        """Unsubscribes from the tunnel stats."""
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+
+    def start(self, interface: str):
+        """Starts polling the interface."""
+        self.stop()
+        self._interface = interface
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """Stops polling the interface."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._samples.clear()
+        self.latest = None
+
+    def poll(self) -> TunnelStats:
+        """
+        Reads a new sample.
+
+        :raises OSError: if the interface counters could not be read.
+        """
+        return self._add_sample(*self._read())
+
+    def _read(self) -> Tuple[float, InterfaceCounters, Optional[float]]:
+        now = self._clock()
+        counters = self._stats_reader.read(self._interface)
+        return now, counters, self._handshake_reader.read_last_handshake(self._interface)
+
+    def _add_sample(
+            self, now: float, counters: InterfaceCounters, last_handshake: Optional[float]
+    ) -> TunnelStats:
+        self._samples.append((now, counters))
+        stats = TunnelStats(timestamp=now, counters=counters)
+
+        oldest_timestamp, oldest_counters = self._samples[0]
+        if now > oldest_timestamp:
+            elapsed = now - oldest_timestamp
+            stats.rx_rate = (counters.rx_bytes - oldest_counters.rx_bytes) / elapsed
+            stats.tx_rate = (counters.tx_bytes - oldest_counters.tx_bytes) / elapsed
+
+        stats.last_handshake = last_handshake
+        if stats.last_handshake:
+            stats.handshake_age = max(0.0, self._wall_clock() - stats.last_handshake)
+
+        self.latest = stats
+        return stats
+
+    def _get_next_poll_interval(self, interval: float) -> float:
+        is_idle = len(self._samples) > 1 and self._samples[-1][1] == self._samples[-2][1]
+        if not is_idle:
+            return self._poll_interval_in_secs
+        return min(interval * 2, self._max_poll_interval_in_secs)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        interval = self._poll_interval_in_secs
+        try:
+            while True:
+                try:
+                    # Reading sysfs and netlink blocks, so it's done off the loop thread.
+                    stats = self._add_sample(*await loop.run_in_executor(None, self._read))
+                except OSError:
+                    logger.debug("Unable to read %s stats.", self._interface, exc_info=True)
+                else:
+                    for subscriber in list(self._subscribers):
+                        try:
+                            subscriber(stats)
+                        except Exception:  # pylint: disable=broad-except
+                            logger.exception("Tunnel telemetry subscriber failed.")
+                interval = self._get_next_poll_interval(interval)
+                await asyncio.sleep(interval)
+        finally:
+            self._handshake_reader.close()
@@ -0,0 +1,63 @@
+"""
+Time-based cache used to remember the outcome of network probes.
+
+
+Copyright (c) 2024 Proton AG
+
+This file is part of Proton VPN.
+
+Proton VPN is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Proton VPN is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with ProtonVPN.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """Dictionary-like cache whose entries expire after a fixed amount of time."""
+
+    def __init__(self, ttl_in_secs: float, clock: Callable[[], float] = time.monotonic):
+        self._ttl_in_secs = ttl_in_secs
+        self._clock = clock
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """Returns the value cached for the key, if it did not expire yet."""
+        entry = self._entries.get(key)
+        if not entry:
+            return default
+
+        expiration_time, value = entry
+        if self._clock() >= expiration_time:
+            del self._entries[key]
+            return default
+
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """Caches the value for the key."""
+        self._entries[key] = (self._clock() + self._ttl_in_secs, value)
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """Removes the entry for the key or, if no key is given, all entries."""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def __contains__(self, key: Hashable) -> bool:
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def __len__(self) -> int:
+        return len(self._entries)
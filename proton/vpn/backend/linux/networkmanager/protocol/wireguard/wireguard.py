@@ -25,6 +25,8 @@ import uuid
 import logging
 from getpass import getuser
 from concurrent.futures import Future
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
 
 import gi
 
@@ -36,15 +38,41 @@ from proton.vpn.connection import events, states
 from proton.vpn.connection.events import EventContext
 from proton.vpn.connection.interfaces import Settings, Features
 from proton.vpn.backend.linux.networkmanager.core import LinuxNetworkManager
-from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent \
-    import Status, State, ReasonCode, AgentFeatures
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.agent_state_cache import \
+    AgentStateCache, CachedAgentState
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.endpoint import EndpointSelector
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.interfaces import \
+    InterfaceAllocator, TunnelSlot
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.mtu import \
+    PathMtuDiscovery, get_tunnel_mtu
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.handshake import \
+    build_handshake_initiation
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard import instrumentation
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.instrumentation import \
+    ConnectionInstrumentation, ConnectionTimeline
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.telemetry import TunnelTelemetry
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.liveness import LivenessMonitor
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.keepalive import \
+    KeepaliveController
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.network import get_network_id
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.ttl_cache import TTLCache
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.split_tunnel import \
+    SplitTunneling, compute_allowed_ips
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.state_bridge import \
+    StateChangeBridge, StateTransition
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard import local_agent
 from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.listener \
     import AgentListener
 
 logger = logging.getLogger(__name__)
 
 
-class Wireguard(LinuxNetworkManager):
+@lru_cache(maxsize=None)
+def _get_current_user() -> str:
+    return getuser()
+
+
+class Wireguard(LinuxNetworkManager):  # pylint: disable=too-many-instance-attributes
     """Creates a Wireguard connection."""
     SIGNAL_NAME = "state-changed"
     ADDRESS = "10.2.0.2"
@@ -53,34 +81,507 @@ class Wireguard(LinuxNetworkManager):
     DNS_SEARCH = "~"
     ALLOWED_IP = "0.0.0.0/0"
     DNS_PRIORITY = -1500
+    # Interface of the first tunnel. Other tunnels get the next free protonN interface.
     VIRTUAL_DEVICE_NAME = "proton0"
+    ACTIVATION_TIMEOUT_IN_SECS = 30
     protocol = "wireguard"
     ui_protocol = "WireGuard (experimental)"
     connection = None
 
-    def __init__(self, *args, **kwargs):
+    # Pre-verified connection profiles containing only the server-independent
+    # settings, keyed by the value returned by _get_connection_template_key().
+    _connection_templates: Dict[Tuple, NM.SimpleConnection] = {}
+
+    # Shared across connections so that the port cache outlives them.
+    _endpoint_selector = EndpointSelector()
+    _path_mtu_discovery = PathMtuDiscovery()
+
+    # Tunnel interfaces of the connections in this process.
+    _interface_allocator = InterfaceAllocator()
+
+    # NAT binding timeouts learned by the keepalive controller, per network.
+    _nat_timeouts = TTLCache(24 * 60 * 60)
+
+    # Timings of the most recent connection attempts.
+    instrumentation = ConnectionInstrumentation()
+
+    # Last local agent state of each connection, to restore it on startup.
+    agent_state_cache = AgentStateCache()
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, *args, split_tunneling: Optional[SplitTunneling] = None,
+            address: Optional[str] = None, dns_ip: Optional[str] = None,
+            dedicated: bool = False, in_memory: bool = False, **kwargs
+    ):
+        """
+        :param split_tunneling: networks to route through the tunnel.
+        :param address: tunnel address, defaults to ADDRESS.
+        :param dns_ip: VPN DNS server, defaults to DNS_IP.
+        :param dedicated: whether the tunnel only carries designated traffic,
+            i.e. packets marked with the tunnel fwmark, instead of being the
+            default route. Dedicated tunnels do not set the system DNS servers.
+            They require a local agent implementation able to bind its
+            connection to the tunnel interface.
+        :param in_memory: whether the profile is only kept in memory by NM,
+            instead of being written to disk with the private key.
+        """
         super().__init__(*args, **kwargs)
+        self._split_tunneling = split_tunneling
+        self.address = address or self.ADDRESS
+        self.dns_ip = dns_ip or self.DNS_IP
+        self.dedicated = dedicated
+        self.in_memory = in_memory
         self._connection_settings = None
+        self._endpoint_port = None
+        self._tunnel_mtu: Optional[int] = None
+        self._slot = TunnelSlot(0)
+        self._activated = asyncio.Event()
+        self._timeline: Optional[ConnectionTimeline] = None
+        # Server, profile and slot the profile was built for by prepare().
+        self._prepared_profile_key: Optional[Tuple] = None
+        # Polls the tunnel interface while the connection is activated.
+        self.telemetry = TunnelTelemetry()
+        self.liveness_monitor = LivenessMonitor(self._on_dead_tunnel)
+        self.telemetry.subscribe(self.liveness_monitor)
+        self.keepalive_controller = KeepaliveController(self._on_keepalive_interval_changed)
+        self.telemetry.subscribe(self.keepalive_controller)
+        self._network_id: Optional[str] = None
+        # Brings NM state changes from the GLib thread to the asyncio loop.
+        self.state_bridge = StateChangeBridge(
+            self._asyncio_loop, self._on_state_transition, self._supersedes
+        )
+        self._agent_connector = local_agent.AgentConnector()
+        if dedicated and not self._agent_connector.supports_interface_binding:
+            raise ValueError(
+                "Dedicated tunnels are not supported by the local agent implementation."
+            )
         self._agent_listener = AgentListener(
-            subscribers=[self._on_local_agent_status]
+            subscribers=[self._on_local_agent_status], connector=self._agent_connector
         )
+        self._agent_status: Optional[local_agent.Status] = None
+        self._is_agent_status_verified = False
+        self._cached_agent_state_key = None
+        self._restored_agent_state: Optional[CachedAgentState] = None
 
-    def setup(self) -> Future:
-        """Methods that creates and applies any necessary changes to the connection."""
+    async def start(self):
+        """
+        Allocates the tunnel interface and selects the Wireguard server port
+        and MTU before starting the connection, unless the profile was already
+        built for this server by prepare().
+        """
+        self._timeline = self.instrumentation.new_timeline()
+        self._agent_listener.timeline = self._timeline
+        self._slot = self._interface_allocator.allocate(self)
+        if not self._is_profile_prepared():
+            await self._probe_server()
+        try:
+            await super().start()
+        except Exception:
+            self._interface_allocator.release(self)
+            raise
+
+    @property
+    def agent_status(self) -> Optional[local_agent.Status]:
+        """Last local agent status, which is the cached one until it is
+        verified when the connection was restored on startup."""
+        return self._agent_status
+
+    @property
+    def is_agent_status_verified(self) -> bool:
+        """Whether the last local agent status was received from the local agent,
+        as opposed to being restored from the cache."""
+        return self._is_agent_status_verified
+
+    @property
+    def agent_features(self) -> Optional[local_agent.AgentFeatures]:
+        """Features confirmed by the local agent, or the cached ones until
+        they are confirmed when the connection was restored on startup."""
+        confirmed_features = self._agent_listener.confirmed_features
+        if confirmed_features is None and self._restored_agent_state:
+            return self._restored_agent_state.to_features()
+        return confirmed_features
+
+    @property
+    def tunnel(self) -> TunnelSlot:
+        """Interface of the tunnel, and the fwmark routing designated traffic through it."""
+        return self._slot
+
+    @property
+    def _interface_name(self) -> str:
+        return self._slot.interface_name
+
+    @property
+    def timeline(self) -> Optional[ConnectionTimeline]:
+        """Timings of the last connection attempt."""
+        return self._timeline
+
+    async def prepare(self):
+        """
+        Prepares everything that can be done in advance without affecting the
+        current VPN connection: allocates the tunnel interface, selects the
+        server port and MTU, builds the connection profile and loads the local
+        agent credentials.
+        """
+        self._slot = self._interface_allocator.allocate(self)
+        await self._probe_server()
         self._generate_connection()
         self._modify_connection()
-        return self.nm_client.add_connection_async(self.connection)
+        self._prepared_profile_key = self._get_prepared_profile_key()
+        self._agent_listener.prepare(self._vpncredentials.pubkey_credentials)
+
+    def _get_prepared_profile_key(self) -> Tuple:
+        return self._vpnserver.server_ip, self._unique_id, self._slot
+
+    def _is_profile_prepared(self) -> bool:
+        return (
+            self.connection is not None
+            and self._prepared_profile_key == self._get_prepared_profile_key()
+        )
+
+    async def switch_from(self, previous: "Wireguard"):
+        """
+        Switches from the previous connection to this one, making the new
+        connection before breaking the previous one.
+
+        The new profile takes over the previous one and is reapplied on its
+        device, so that the tunnel stays up while it is moved to the new peer.
+        If that is not possible, this connection is brought up on a second
+        interface before the previous one is torn down.
+        """
+        if not self.connection:
+            await self.prepare()
+
+        previous.stop_local_agent_listener()
+        previous.telemetry.stop()
+        try:
+            await self._take_over(previous)
+        except Exception:  # pylint: disable=broad-except
+            logger.warning(
+                "Unable to switch connection in place, using a second interface.",
+                exc_info=True
+            )
+            await self._start_alongside(previous)
+
+    async def _take_over(self, previous: "Wireguard"):
+        # pylint: disable=protected-access
+        self._slot = self._interface_allocator.reserve(previous._slot, self)
+        # The profile is rebuilt for the tunnel taken over, so that its
+        # interface, routing table and fwmark are the ones of the tunnel.
+        self._generate_connection()
+        self._unique_id = previous._unique_id
+        self._modify_connection()
+
+        def hand_over(active_connection: NM.ActiveConnection):
+            active_connection.disconnect_by_func(previous._on_state_changed)
+            active_connection.connect("state-changed", self._on_state_changed)
+
+        await asyncio.wrap_future(self._update_and_reapply_async(on_reapplied=hand_over))
+        # The device stays activated, so the agent listener has to be started here.
+        await self._start_local_agent_listener()
+        self._start_telemetry()
+
+    def _update_and_reapply_async(
+            self, on_reapplied: Optional[Callable[[NM.ActiveConnection], None]] = None,
+            patch: Optional[Callable[[NM.Connection], None]] = None
+    ) -> Future:
+        """
+        Updates the active profile with the current connection settings and
+        reapplies them on its device, which stays up in the meantime.
+
+        Reapplying cannot change the MTU of the device, so the MTU of the
+        active profile is kept.
+
+        :param on_reapplied: optional callback called from the GLib loop thread
+            with the active connection, once the settings were reapplied.
+        :param patch: optional callable modifying the given settings in place.
+            When passed, only the patched settings of the active profile are
+            updated, which also works when the profile was not built by this
+            instance, e.g. when the connection was restored on start-up.
+        """
+        future = Future()
+
+        def on_device_reapplied(
+                device: NM.Device, result, active_connection: NM.ActiveConnection
+        ):
+            try:
+                device.reapply_finish(result)
+                if on_reapplied:
+                    on_reapplied(active_connection)
+                future.set_result(None)
+            except Exception as exc:  # pylint: disable=broad-except
+                future.set_exception(exc)
+
+        def on_updated(remote_connection: NM.RemoteConnection, result, user_data):
+            active_connection, connection = user_data
+            try:
+                remote_connection.update2_finish(result)
+                device = active_connection.get_devices()[0]
+                device.reapply_async(
+                    connection, 0, 0, None, on_device_reapplied, active_connection
+                )
+            except Exception as exc:  # pylint: disable=broad-except
+                future.set_exception(exc)
+
+        def update_and_reapply():
+            try:
+                active_connection = self._find_active_connection(self._unique_id)
+                remote_connection = active_connection.get_connection()
+                if patch:
+                    connection = NM.SimpleConnection.new_from_dbus(
+                        remote_connection.to_dbus(NM.ConnectionSerializationFlags.ALL)
+                    )
+                    patch(connection)
+                else:
+                    connection = self.connection
+                    self._keep_tunnel_mtu(remote_connection)
+                remote_connection.update2(
+                    connection.to_dbus(NM.ConnectionSerializationFlags.ALL),
+                    NM.SettingsUpdate2Flags.IN_MEMORY if self.in_memory
+                    else NM.SettingsUpdate2Flags.NONE,
+                    None, None, on_updated, (active_connection, connection)
+                )
+            except Exception as exc:  # pylint: disable=broad-except
+                future.set_exception(exc)
+
+        self.nm_client._run_on_glib_loop_thread(update_and_reapply)  # pylint: disable=W0212
+        return future
+
+    def _keep_tunnel_mtu(self, remote_connection: NM.RemoteConnection):
+        active_mtu = remote_connection.get_setting_by_name(
+            NM.SETTING_WIREGUARD_SETTING_NAME
+        ).get_mtu()
+        self._tunnel_mtu = active_mtu or None
+        self.connection.get_setting_by_name(NM.SETTING_WIREGUARD_SETTING_NAME).set_property(
+            NM.SETTING_WIREGUARD_MTU, active_mtu
+        )
+
+    async def _start_alongside(self, previous: "Wireguard"):
+        # pylint: disable=protected-access
+        # The previous connection keeps its interface until it's stopped,
+        # so that this connection is brought up on another one.
+        self._interface_allocator.reserve(previous._slot, previous)
+        slot = self._interface_allocator.allocate(self)
+        if slot != self._slot or not self._is_profile_prepared():
+            # The failed take-over rebuilt the profile for the previous tunnel,
+            # so it's rebuilt for this one with the server probes already done.
+            self._slot = slot
+            self._generate_connection()
+            self._modify_connection()
+            self._prepared_profile_key = self._get_prepared_profile_key()
+        self._activated.clear()
+        await self.start()
+        await asyncio.wait_for(self._activated.wait(), self.ACTIVATION_TIMEOUT_IN_SECS)
+
+        # The previous connection is not notified about being torn down, since
+        # this connection replaces it.
+        await asyncio.wrap_future(previous._release_active_connection_async())
+        await previous.stop()
+        self._interface_allocator.release(previous)
+
+    def _release_active_connection_async(self) -> Future:
+        """Stops listening for state changes of the active connection."""
+        future = Future()
+
+        def release():
+            try:
+                active_connection = self._find_active_connection(self._unique_id)
+                active_connection.disconnect_by_func(self._on_state_changed)
+                future.set_result(None)
+            except Exception as exc:  # pylint: disable=broad-except
+                future.set_exception(exc)
+
+        self.nm_client._run_on_glib_loop_thread(release)  # pylint: disable=W0212
+        return future
+
+    def _find_active_connection(self, connection_uuid: str) -> NM.ActiveConnection:
+        """Has to be called from the GLib loop thread."""
+        nm_client = self.nm_client._nm_client  # pylint: disable=protected-access
+        for active_connection in nm_client.get_active_connections():
+            if active_connection.get_uuid() == connection_uuid:
+                return active_connection
+        raise RuntimeError(f"Connection {connection_uuid} is not active.")
+
+    async def _probe_server(self):
+        self._network_id = get_network_id()
+        self.keepalive_controller.reset(self._nat_timeouts.get(self._network_id))
+        self._endpoint_port, self._tunnel_mtu = await asyncio.gather(
+            self._select_endpoint_port(), self._discover_tunnel_mtu()
+        )
+
+    async def _select_endpoint_port(self) -> int:
+        ports = self._vpnserver.wireguard_ports.udp
+        private_key = self._vpncredentials.pubkey_credentials.wg_private_key
+        try:
+            return await self._endpoint_selector.select_port(
+                self._vpnserver.server_ip, ports,
+                lambda: build_handshake_initiation(private_key, self._vpnserver.x25519pk)
+            )
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Wireguard port selection failed.")
+            return ports[0]
+
+    async def _discover_tunnel_mtu(self) -> Optional[int]:
+        """
+        Returns the largest tunnel MTU avoiding fragmentation on the path to
+        the server, or None to leave the MTU chosen by NetworkManager.
+        """
+        try:
+            path_mtu = await self._path_mtu_discovery.discover(self._vpnserver.server_ip)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Path MTU discovery failed.")
+            return None
+        return get_tunnel_mtu(path_mtu) if path_mtu else None
+
+    def setup(self) -> Future:
+        """Methods that creates and applies any necessary changes to the connection."""
+        if not self._timeline:
+            self._build_profile()
+            return self._add_connection_async()
+
+        timeline = self._timeline
+        with timeline.measure(instrumentation.SETUP):
+            self._build_profile()
+        timeline.connection_id = self._unique_id
+
+        timeline.start(instrumentation.ADD_CONNECTION)
+        future = self._add_connection_async()
+
+        def on_connection_added(future: Future):
+            if not future.exception():
+                timeline.finish(instrumentation.ADD_CONNECTION)
+                timeline.start(instrumentation.ACTIVATION)
+
+        future.add_done_callback(on_connection_added)
+        return future
+
+    def _build_profile(self):
+        """Builds the profile, unless the one built by prepare() can be used."""
+        if not self._is_profile_prepared():
+            self._generate_connection()
+            self._modify_connection()
+        # The prepared profile is only used once, later starts probe again.
+        self._prepared_profile_key = None
+
+    def _add_connection_async(self) -> Future:
+        """
+        Adds the profile to NM. In-memory profiles are added with
+        add_connection2, so that NM does not write them to disk.
+        """
+        if not self.in_memory:
+            return self.nm_client.add_connection_async(self.connection)
+
+        future = Future()
+
+        def on_connection_added(nm_client: NM.Client, result, *_):
+            try:
+                remote_connection, _out_result = nm_client.add_connection2_finish(result)
+                future.set_result(remote_connection)
+            except Exception as exc:  # pylint: disable=broad-except
+                future.set_exception(exc)
+
+        def add_connection():
+            try:
+                self.nm_client._nm_client.add_connection2(  # pylint: disable=W0212
+                    self.connection.to_dbus(NM.ConnectionSerializationFlags.ALL),
+                    NM.SettingsAddConnection2Flags.IN_MEMORY
+                    | NM.SettingsAddConnection2Flags.BLOCK_AUTOCONNECT,
+                    None, False, None, on_connection_added
+                )
+            except Exception as exc:  # pylint: disable=broad-except
+                future.set_exception(exc)
+
+        self.nm_client._run_on_glib_loop_thread(add_connection)  # pylint: disable=W0212
+        return future
 
     def _generate_connection(self):
         self._unique_id = str(uuid.uuid4())
-        self._connection_settings = NM.SettingConnection.new()
+        self.connection = NM.SimpleConnection.new_clone(self._get_connection_template())
+        self._connection_settings = self.connection.get_setting_connection()
+
+    def _get_connection_template(self) -> NM.SimpleConnection:
+        """
+        Returns the cached connection template for the current settings,
+        building it on the first call.
+        """
+        key = self._get_connection_template_key()
+        template = self._connection_templates.get(key)
+        if not template:
+            template = self._build_connection_template()
+            self._connection_templates[key] = template
+        return template
+
+    def _get_connection_template_key(self) -> Tuple:
+        """Returns the server-independent settings the template is built from."""
+        return (
+            self._interface_name,
+            self.address,
+            self.dns_ip,
+            self.dedicated,
+            _get_current_user(),
+            tuple(self._settings.dns_custom_ips or ())
+        )
+
+    def _build_connection_template(self) -> NM.SimpleConnection:
+        """
+        Builds and verifies a connection profile with all the settings that do
+        not depend on the server. The connection ID, UUID and the Wireguard
+        peer are patched in by _modify_connection() on each connection.
+        """
         self.connection = NM.SimpleConnection.new()
+        self._connection_settings = NM.SettingConnection.new()
+
+        self._set_custom_connection_id()
+        self._set_uuid()
+        self._set_interface_name()
+        self._set_connection_type()
+        self._set_connection_user_owned()
+        self.connection.add_setting(self._connection_settings)
+
+        self._set_route()
+        self._set_dns()
+        self.connection.add_setting(NM.SettingWireGuard.new())
+        if self.dedicated:
+            self._set_policy_routing()
+
+        self.connection.verify()
+        return self.connection
 
     async def update_credentials(self, credentials):
-        """Notifies the vpn server that the wireguard certificate needs a refresh."""
+        """
+        Notifies the vpn server that the wireguard certificate needs a refresh.
+
+        If the Wireguard private key changed, the new one is applied on the
+        active connection without restarting it, before the local agent
+        connection is reestablished with the new certificate.
+        """
+        previous_private_key = self._vpncredentials.pubkey_credentials.wg_private_key
         await super().update_credentials(credentials)
+        if self._vpncredentials.pubkey_credentials.wg_private_key != previous_private_key:
+            await self._rotate_private_key()
+        self._agent_listener.invalidate_credentials_cache()
         await self._start_local_agent_listener()
 
+    async def _rotate_private_key(self):
+        """
+        Applies the new Wireguard private key on the active connection. Only
+        the private key of the active profile is changed, since the profile is
+        not built when the connection was restored on start-up.
+        """
+        if self.connection:
+            self._set_private_key()
+
+        logger.info("Applying new Wireguard private key...")
+        try:
+            await asyncio.wrap_future(
+                self._update_and_reapply_async(patch=self._set_private_key)
+            )
+        except Exception:  # pylint: disable=broad-except
+            # The agent connection will fail with the new certificate, which
+            # leads to the connection being restarted.
+            logger.exception("Unable to apply the new Wireguard private key.")
+        else:
+            logger.info("New Wireguard private key applied.")
+
     @property
     def are_feature_updates_applied_when_active(self) -> bool:
         """
@@ -98,17 +599,8 @@ class Wireguard(LinuxNetworkManager):
     def _modify_connection(self):
         self._set_custom_connection_id()
         self._set_uuid()
-        self._set_interface_name()
-        self._set_connection_type()
-        self._set_connection_user_owned()
-        self.connection.add_setting(self._connection_settings)
-
-        self._set_route()
-        self._set_dns()
         self._set_wireguard_properties()
 
-        self.connection.verify()
-
     def _set_custom_connection_id(self):
         self._connection_settings.set_property(NM.SETTING_CONNECTION_ID, self._get_servername())
 
@@ -117,7 +609,7 @@ class Wireguard(LinuxNetworkManager):
 
     def _set_interface_name(self):
         self._connection_settings.set_property(
-            NM.SETTING_CONNECTION_INTERFACE_NAME, self.VIRTUAL_DEVICE_NAME
+            NM.SETTING_CONNECTION_INTERFACE_NAME, self._interface_name
         )
 
     def _set_connection_type(self):
@@ -126,7 +618,7 @@ class Wireguard(LinuxNetworkManager):
     def _set_connection_user_owned(self):
         self._connection_settings.add_permission(
             "user",
-            getuser(),
+            _get_current_user(),
             None
         )
 
@@ -136,7 +628,7 @@ class Wireguard(LinuxNetworkManager):
 
         ipv4_config.set_property(NM.SETTING_IP_CONFIG_METHOD, "manual")
         ipv4_config.add_address(
-            NM.IPAddress.new(socket.AF_INET, self.ADDRESS, self.ADDRESS_PREFIX)
+            NM.IPAddress.new(socket.AF_INET, self.address, self.ADDRESS_PREFIX)
         )
 
         ipv6_config.set_property(NM.SETTING_IP_CONFIG_METHOD, "disabled")
@@ -148,6 +640,12 @@ class Wireguard(LinuxNetworkManager):
         ipv4_config = self.connection.get_setting_ip4_config()
         ipv6_config = self.connection.get_setting_ip6_config()
 
+        if self.dedicated:
+            # Dedicated tunnels do not carry the system DNS queries.
+            ipv4_config.set_property(NM.SETTING_IP_CONFIG_IGNORE_AUTO_DNS, True)
+            ipv6_config.set_property(NM.SETTING_IP_CONFIG_IGNORE_AUTO_DNS, True)
+            return
+
         ipv4_config.set_property(NM.SETTING_IP_CONFIG_DNS_PRIORITY, self.DNS_PRIORITY)
         ipv6_config.set_property(NM.SETTING_IP_CONFIG_DNS_PRIORITY, self.DNS_PRIORITY)
 
@@ -157,42 +655,85 @@ class Wireguard(LinuxNetworkManager):
         if self._settings.dns_custom_ips:
             ipv4_config.set_property(NM.SETTING_IP_CONFIG_DNS, self._settings.dns_custom_ips)
         else:
-            ipv4_config.add_dns(self.DNS_IP)
+            ipv4_config.add_dns(self.dns_ip)
             ipv4_config.add_dns_search(self.DNS_SEARCH)
 
         self.connection.add_setting(ipv4_config)
         self.connection.add_setting(ipv6_config)
 
+    def _set_policy_routing(self):
+        """
+        Routes the packets marked with the tunnel fwmark through the tunnel
+        routing table, which holds the routes to the allowed IPs, instead of
+        making the tunnel the default route.
+        """
+        ipv4_config = self.connection.get_setting_ip4_config()
+        ipv4_config.set_property(NM.SETTING_IP_CONFIG_ROUTE_TABLE, self._slot.route_table)
+
+        rule = NM.IPRoutingRule.new(socket.AF_INET)
+        rule.set_priority(self._slot.routing_rule_priority)
+        rule.set_fwmark(self._slot.fwmark, 0xffffffff)
+        rule.set_table(self._slot.route_table)
+        ipv4_config.add_routing_rule(rule)
+
+        # Otherwise NM routes all the traffic through the tunnel, with its own rules.
+        self.connection.get_setting_by_name(NM.SETTING_WIREGUARD_SETTING_NAME).set_property(
+            NM.SETTING_WIREGUARD_IP4_AUTO_DEFAULT_ROUTE, NM.Ternary.FALSE
+        )
+
     def _set_wireguard_properties(self):
         peer = NM.WireGuardPeer.new()
-        peer.append_allowed_ip(self.ALLOWED_IP, False)
-        peer.set_endpoint(
-            f"{self._vpnserver.server_ip}:{self._vpnserver.wireguard_ports.udp[0]}",
-            False
-        )
+        for allowed_ip in self._get_allowed_ips():
+            peer.append_allowed_ip(allowed_ip, False)
+        port = self._endpoint_port or self._vpnserver.wireguard_ports.udp[0]
+        peer.set_endpoint(f"{self._vpnserver.server_ip}:{port}", False)
         peer.set_public_key(self._vpnserver.x25519pk, False)
+        peer.set_persistent_keepalive(self.keepalive_controller.interval)
 
         # Ensures that the configurations are valid
         # https://lazka.github.io/pgi-docs/index.html#NM-1.0/classes/WireGuardPeer.html#NM.WireGuardPeer.is_valid
         peer.is_valid(True, True)
 
-        wireguard_config = NM.SettingWireGuard.new()
+        wireguard_config = self.connection.get_setting_by_name(
+            NM.SETTING_WIREGUARD_SETTING_NAME
+        )
         wireguard_config.append_peer(peer)
-        wireguard_config.set_property(
+        # 0 lets NetworkManager choose the MTU.
+        wireguard_config.set_property(NM.SETTING_WIREGUARD_MTU, self._tunnel_mtu or 0)
+        self._set_private_key()
+
+    def _get_allowed_ips(self) -> Tuple[str, ...]:
+        """
+        Returns the networks routed through the tunnel. NM adds a route for
+        each of them, so with split tunneling they are compacted into as few
+        networks as possible.
+        """
+        if not self._split_tunneling:
+            return (self.ALLOWED_IP,)
+
+        # The VPN server is excluded so that the tunnel traffic itself is not
+        # routed through the tunnel, and the DNS servers set on the tunnel are
+        # always reached through it, so that DNS queries do not leak.
+        always_include = tuple(self._settings.dns_custom_ips or (self.dns_ip,))
+        return compute_allowed_ips(
+            self._split_tunneling, always_include, (self._vpnserver.server_ip,)
+        )
+
+    def _set_private_key(self, connection: Optional[NM.Connection] = None):
+        connection = connection or self.connection
+        connection.get_setting_by_name(NM.SETTING_WIREGUARD_SETTING_NAME).set_property(
             NM.SETTING_WIREGUARD_PRIVATE_KEY,
             self._vpncredentials.pubkey_credentials.wg_private_key
         )
 
-        self.connection.add_setting(wireguard_config)
-
-    def _get_agent_features(self, features: Features) -> AgentFeatures:
+    def _get_agent_features(self, features: Features) -> local_agent.AgentFeatures:
         if features is None:
             # The free tier does not pass connection features since
             # our servers do not allow setting connection features on the free
             # tier, not even the defaults.
             return None
 
-        return AgentFeatures(
+        return local_agent.AgentFeatures(
             netshield_level=features.netshield,
             randomized_nat=not features.moderate_nat if features.moderate_nat is not None else None,
             split_tcp=features.vpn_accelerator,
@@ -202,10 +743,23 @@ class Wireguard(LinuxNetworkManager):
         )
 
     async def _start_local_agent_listener(self):
+        self._restart_local_agent_listener()
+
+    def _restart_local_agent_listener(self):
         if self._agent_listener.is_running:
             logger.info("Closing existing agent connection...")
             self._agent_listener.stop()
 
+        if self._agent_connector.supports_interface_binding:
+            # The local agent has the same address on every server, so the
+            # connection is bound to the tunnel when it's not the default route
+            # or other tunnels are up. Binding requires CAP_NET_RAW before
+            # Linux 5.7, so the connection is not bound otherwise.
+            self._agent_connector.interface = (
+                self._interface_name
+                if self.dedicated or len(self._interface_allocator) > 1 else None
+            )
+
         logger.info("Waiting for agent status from %s...", self._vpnserver.domain)
         self._agent_listener.start(
             self._vpnserver.domain,
@@ -213,16 +767,22 @@ class Wireguard(LinuxNetworkManager):
             self._get_agent_features(self._settings.features)
         )
 
-    async def _on_local_agent_status(self, status: Status):
+    async def _on_local_agent_status(self, status: local_agent.Status):
         """The local agent listener calls this method whenever a new status is
         read from the local agent connection."""
         logger.info("Agent status received: %s", status)
-        if status.state == State.CONNECTED:
+        self._cache_agent_status(status)
+        self._handle_agent_status(status)
+
+    def _handle_agent_status(self, status: local_agent.Status):
+        if status.state == local_agent.State.CONNECTED:
+            if self._timeline:
+                self._timeline.mark(instrumentation.CONNECTED)
             self._notify_subscribers(events.Connected(EventContext(connection=self)))
-        elif status.state == State.HARD_JAILED:
+        elif status.state == local_agent.State.HARD_JAILED:
             self._handle_hard_jailed_state(status)
-        elif status.state == State.DISCONNECTED:
-            if status.reason and status.reason.code == ReasonCode.CERTIFICATE_EXPIRED:
+        elif status.state == local_agent.State.DISCONNECTED:
+            if status.reason and status.reason.code == local_agent.ReasonCode.CERTIFICATE_EXPIRED:
                 self._notify_subscribers(
                     events.ExpiredCertificate(EventContext(connection=self))
                 )
@@ -235,8 +795,8 @@ class Wireguard(LinuxNetworkManager):
                 events.UnexpectedError(EventContext(connection=self))
             )
 
-    def _handle_hard_jailed_state(self, status: Status):
-        if status.reason.code == ReasonCode.CERTIFICATE_EXPIRED:
+    def _handle_hard_jailed_state(self, status: local_agent.Status):
+        if status.reason.code == local_agent.ReasonCode.CERTIFICATE_EXPIRED:
             self._notify_subscribers(
                 events.ExpiredCertificate(EventContext(connection=self))
             )
@@ -249,25 +809,105 @@ class Wireguard(LinuxNetworkManager):
                 events.UnexpectedError(EventContext(connection=self))
             )
 
-    def _has_reached_max_amount_of_concurrent_vpn_connections(self, code: ReasonCode) -> bool:
+    def _has_reached_max_amount_of_concurrent_vpn_connections(
+            self, code: local_agent.ReasonCode
+    ) -> bool:
         """Check if a user has reached the maximum number of concurrent VPN sessions/connections
         permitted for the current tier."""
         return code in (
-            ReasonCode.MAX_SESSIONS_UNKNOWN,
-            ReasonCode.MAX_SESSIONS_FREE,
-            ReasonCode.MAX_SESSIONS_BASIC,
-            ReasonCode.MAX_SESSIONS_PLUS,
-            ReasonCode.MAX_SESSIONS_VISIONARY,
-            ReasonCode.MAX_SESSIONS_PRO
+            local_agent.ReasonCode.MAX_SESSIONS_UNKNOWN,
+            local_agent.ReasonCode.MAX_SESSIONS_FREE,
+            local_agent.ReasonCode.MAX_SESSIONS_BASIC,
+            local_agent.ReasonCode.MAX_SESSIONS_PLUS,
+            local_agent.ReasonCode.MAX_SESSIONS_VISIONARY,
+            local_agent.ReasonCode.MAX_SESSIONS_PRO
         )
 
-    def _async_start_local_agent_listener(self):
-        """This schedules a local agent listener in asyncio."""
-        future = asyncio.run_coroutine_threadsafe(
-            self._start_local_agent_listener(),
-            self._asyncio_loop
+    def _cache_agent_status(self, status: local_agent.Status):
+        self._agent_status = status
+        self._is_agent_status_verified = True
+        features = self._agent_listener.confirmed_features
+        # The cache is only written when the state or the features changed.
+        cached_key = (status.state, status.reason, features)
+        if cached_key != self._cached_agent_state_key:
+            self._cached_agent_state_key = cached_key
+            self.agent_state_cache.save(
+                self._unique_id, self._vpnserver.domain, status, features
+            )
+
+    def _restore_agent_state(self):
+        """
+        Reports the local agent state cached before the app was restarted right
+        away, instead of waiting for the local agent connection to verify it.
+
+        Only a connected state is reported in advance. Errors, e.g. the
+        connection being jailed, are only reported by the live local agent
+        connection, since they may no longer apply.
+        """
+        if not self._restored_agent_state or self._agent_status:
+            return
+
+        try:
+            status = self._restored_agent_state.to_status()
+        except ValueError:
+            logger.warning("Ignoring invalid cached agent state.", exc_info=True)
+            self._restored_agent_state = None
+            return
+
+        if status.state != local_agent.State.CONNECTED:
+            logger.info("Not restoring cached agent status: %s", status)
+            return
+
+        logger.info("Restoring cached agent status: %s", status)
+        self._agent_status = status
+        self._handle_agent_status(status)
+
+    def _start_telemetry(self):
+        self.liveness_monitor.reset()
+        self.keepalive_controller.reset(self.keepalive_controller.nat_timeout)
+        self.telemetry.start(self._interface_name)
+
+    def _on_keepalive_interval_changed(self, interval: int):
+        """
+        Called by the keepalive controller when the NAT binding timeout was
+        learned. The peer keepalive is updated on the active connection, whose
+        profile is not built when the connection was restored on start-up.
+        """
+        if self._network_id is not None:
+            self._nat_timeouts.set(self._network_id, self.keepalive_controller.nat_timeout)
+
+        def set_persistent_keepalive(connection: NM.Connection):
+            wireguard_config = connection.get_setting_by_name(NM.SETTING_WIREGUARD_SETTING_NAME)
+            peer = wireguard_config.get_peer(0).new_clone(True)
+            peer.set_persistent_keepalive(interval)
+            wireguard_config.set_peer(peer, 0)
+            # The settings read back from NM do not include the secrets.
+            self._set_private_key(connection)
+
+        if self.connection:
+            set_persistent_keepalive(self.connection)
+
+        future = asyncio.wrap_future(
+            self._update_and_reapply_async(patch=set_persistent_keepalive)
         )
-        future.add_done_callback(lambda f: f.result())
+        future.add_done_callback(self._on_keepalive_reapplied)
+
+    @staticmethod
+    def _on_keepalive_reapplied(future: asyncio.Future):
+        if future.exception():
+            logger.warning(
+                "Unable to update the Wireguard persistent keepalive.",
+                exc_info=future.exception()
+            )
+
+    def _on_dead_tunnel(self, reason: str):
+        """Called by the liveness monitor as soon as the tunnel seems to be dead."""
+        logger.warning("Dead tunnel detected (%s), notifying connection timeout.", reason)
+        self._notify_subscribers_threadsafe(events.Timeout(EventContext(connection=self)))
+
+    def stop_local_agent_listener(self):
+        """Stops listening to the local agent of this connection."""
+        self._agent_listener.stop()
 
     async def _request_connection_features(self, features: Features):
         agent_features = self._get_agent_features(features)
@@ -299,15 +939,46 @@ class Wireguard(LinuxNetworkManager):
         )
 
         if state is NM.ActiveConnectionState.ACTIVATED:
-            self._async_start_local_agent_listener()
+            if self._timeline:
+                self._timeline.finish(instrumentation.ACTIVATION)
+            self.state_bridge.put(state, reason)
         elif state == NM.ActiveConnectionState.DEACTIVATED:
-            self._agent_listener.stop()
-            self._notify_subscribers_threadsafe(
-                events.Disconnected(EventContext(connection=self, error=reason))
-            )
+            self.state_bridge.put(state, reason)
         else:
             logger.debug("Ignoring VPN state change: %s", state.value_name)
 
+    def _on_state_transition(self, transition: StateTransition):
+        """Handles the state transitions drained by the state bridge, on the asyncio loop."""
+        if transition.state is NM.ActiveConnectionState.ACTIVATED:
+            self._activated.set()
+            self._start_telemetry()
+            self._restore_agent_state()
+            self._restart_local_agent_listener()
+        elif transition.state == NM.ActiveConnectionState.DEACTIVATED:
+            self._agent_listener.stop()
+            self.telemetry.stop()
+            self._agent_status = None
+            self._is_agent_status_verified = False
+            self._cached_agent_state_key = None
+            self._restored_agent_state = None
+            self.agent_state_cache.remove(self._unique_id)
+            self._interface_allocator.release(self)
+            self._notify_subscribers(
+                events.Disconnected(EventContext(connection=self, error=transition.reason))
+            )
+
+    @staticmethod
+    def _supersedes(earlier: StateTransition, later: StateTransition) -> bool:
+        """
+        A transition is superseded by a later one to the same state, and an
+        activation by a later deactivation, since there is no point in starting
+        the local agent listener and the telemetry just to stop them right away.
+        """
+        return later.state == earlier.state or (
+            earlier.state is NM.ActiveConnectionState.ACTIVATED
+            and later.state == NM.ActiveConnectionState.DEACTIVATED
+        )
+
     def _initialize_persisted_connection(
             self, connection_id: str
     ) -> states.State:
@@ -315,9 +986,32 @@ class Wireguard(LinuxNetworkManager):
         state = super()._initialize_persisted_connection(connection_id)
 
         if isinstance(state, states.Connected):
-            self._async_start_local_agent_listener()
+            self._slot = self._interface_allocator.reserve(self._get_persisted_slot(), self)
+            self._restored_agent_state = self.agent_state_cache.load(
+                connection_id, self._vpnserver.domain
+            )
+            self.state_bridge.put(
+                NM.ActiveConnectionState.ACTIVATED, NM.ActiveConnectionStateReason.NONE
+            )
         return state
 
+    def _get_persisted_slot(self) -> TunnelSlot:
+        """Returns the tunnel slot of the interface of the restored connection."""
+        # NM is read from this thread, as the base class does to restore the connection.
+        try:
+            interface_name = self._find_active_connection(
+                self._unique_id
+            ).get_connection().get_interface_name()
+        except Exception:  # pylint: disable=broad-except
+            logger.warning("Unable to get the restored connection interface.", exc_info=True)
+            interface_name = None
+
+        slot = TunnelSlot.from_interface_name(interface_name)
+        if not slot:
+            logger.warning("Unexpected restored connection interface: %s", interface_name)
+            return self._slot
+        return slot
+
     @classmethod
     def _get_priority(cls):
         return 1
@@ -1,5 +1,5 @@
 %define unmangled_name proton-vpn-network-manager-wireguard
-%define version 0.4.7
+%define version 0.4.32
 %define release 1
 
 Prefix: %{_prefix}
@@ -21,12 +21,14 @@ BuildRequires: python3-proton-vpn-logger
 BuildRequires: python3-proton-vpn-api-core >= 0.33.0
 BuildRequires: python3-proton-vpn-network-manager >= 0.6.3
 BuildRequires: python3-proton-vpn-killswitch-network-manager-wireguard
+BuildRequires: python3-cryptography
 BuildRequires: python3-setuptools
 
 Requires: python3-proton-vpn-logger
 Requires: python3-proton-vpn-api-core >= 0.33.0
 Requires: python3-proton-vpn-network-manager >= 0.6.3
 Requires: python3-proton-vpn-killswitch-network-manager-wireguard
+Requires: python3-cryptography
 Requires: python3-setuptools
 
 %{?python_disable_dependency_generator}
@@ -51,6 +53,81 @@ python3 setup.py install --single-version-externally-managed -O1 --root=$RPM_BUI
 %defattr(-,root,root)
 
 %changelog
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.32
+- Add the option to keep Wireguard profiles in memory only
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.31
+- Support multiple concurrent Wireguard tunnels
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.30
+- Adapt the Wireguard persistent keepalive to the observed NAT timeout
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.29
+- Discover the path MTU to set the Wireguard MTU per server
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.28
+- Add split tunneling with compacted allowed IPs
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.27
+- Restore the cached local agent state of persisted connections on startup
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.26
+- Bridge NM state changes to the asyncio loop in batches
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.25
+- Defer importing the backend module and selecting the local agent implementation until first use
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.24
+- Add a stand-in local agent server for end-to-end and load tests
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.23
+- Add a benchmark suite with committed baselines for the backend hot paths
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.22
+- Detect dead Wireguard tunnels from handshake staleness and rx stalls
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.21
+- Publish Wireguard tunnel throughput and handshake age telemetry
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.20
+- Record the timings of each phase of Wireguard connection attempts
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.19
+- Apply rotated Wireguard private keys in place, without restarting the connection
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.18
+- Switch Wireguard servers making the new connection before breaking the previous one
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.17
+- Debounce agent feature requests and only send the features that changed
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.16
+- Deliver local agent messages to subscribers through bounded per-subscriber queues
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.15
+- Reconnect to the local agent with backoff before notifying a disconnection
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.14
+- Connect to the fallback local agent without an executor thread
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.13
+- Resume the local agent TLS session on reconnection
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.12
+- Reuse the local agent TLS context until credentials change
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.11
+- Load local agent TLS credentials in memory
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.10
+- Add Wireguard server latency prober
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.9
+- Race all Wireguard server ports and connect to the fastest one
+
+* Sat Oct 17 2026 Proton AG <opensource@proton.me> 0.4.8
+- Reuse a pre-verified connection template on each connection
+
 * Mon Sep 02 2024 Josep Llaneras <josep.llaneras@proton.ch> 0.4.7
 - Deprecate this package
 
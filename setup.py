@@ -3,7 +3,7 @@ from setuptools import setup, find_namespace_packages
 
 setup(
     name="proton-vpn-network-manager-wireguard",
-    version="0.4.7",
+    version="0.4.32",
     description="Proton VPN Wireguard NM connector for linux",
     author="Proton AG",
     author_email="opensource@proton.me",
@@ -12,10 +12,10 @@ setup(
     include_package_data=True,
     install_requires=[
         "proton-vpn-api-core", "proton-vpn-logger", "proton-vpn-network-manager",
-        "proton-vpn-killswitch-network-manager-wireguard"
+        "proton-vpn-killswitch-network-manager-wireguard", "cryptography"
     ],
     extras_require={
-        "development": ["wheel", "pytest", "pytest-cov", "pytest-asyncio", "flake8", "pylint", "pygobject-stubs"]
+        "development": ["wheel", "pytest", "pytest-cov", "pytest-asyncio", "pytest-benchmark", "flake8", "pylint", "pygobject-stubs"]
     },
     python_requires=">=3.8",
     license="GPLv3",
@@ -0,0 +1,118 @@
+import asyncio
+import json
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard import Wireguard
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.agent_state_cache import \
+    AgentStateCache
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.interfaces import \
+    InterfaceAllocator
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.mtu import PathMtuDiscovery
+
+SERVER_PUBLIC_KEY = "b8RgyHBpUjFi+ERdjQ0YfbCquAHvfKipZWW0zqrAzKs="
+CLIENT_PRIVATE_KEY = "8tXqsp7btfleug3oq+v4Sv9ABLwvmvt0DYyp+S6ENMU="
+
+
+def build_wireguard(nm_client=None, **kwargs) -> Wireguard:
+    """
+    Builds a Wireguard connection backed by a mocked NM client.
+    It has to be called from the asyncio loop.
+    """
+    server = Mock()
+    server.server_ip = "127.0.0.1"
+    server.domain = "node-ch-01.protonvpn.net"
+    server.x25519pk = SERVER_PUBLIC_KEY
+    server.wireguard_ports.udp = [51820]
+
+    credentials = Mock()
+    credentials.pubkey_credentials.wg_private_key = CLIENT_PRIVATE_KEY
+
+    settings = Mock()
+    settings.dns_custom_ips = []
+    settings.features = None
+
+    return Wireguard(
+        server=server, credentials=credentials, settings=settings,
+        nm_client=nm_client or Mock(), **kwargs
+    )
+
+
+def create_wireguard(**kwargs) -> Wireguard:
+    """Creates a Wireguard connection backed by a mocked NM client."""
+    async def create():
+        # The NM backend expects to be instantiated from the asyncio loop.
+        return build_wireguard(**kwargs)
+
+    return asyncio.run(create())
+
+
+@pytest.fixture(autouse=True)
+def agent_state_cache(tmp_path, monkeypatch):
+    """Keeps the agent state cached by the benchmarks out of the user cache directory."""
+    cache = AgentStateCache(directory=tmp_path / "agent_state")
+    monkeypatch.setattr(Wireguard, "agent_state_cache", cache)
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def path_mtu_discovery(monkeypatch):
+    """Answers path MTU probes right away, so that the benchmarks do not depend on ICMP."""
+    async def probe(host, size, interface):
+        return True
+
+    discovery = PathMtuDiscovery(probe=probe, route_mtu_getter=lambda host, interface: 1500)
+    monkeypatch.setattr(Wireguard, "_path_mtu_discovery", discovery)
+    return discovery
+
+
+@pytest.fixture(autouse=True)
+def interface_allocator(monkeypatch):
+    """Frees the tunnel interfaces allocated by previous benchmarks."""
+    allocator = InterfaceAllocator()
+    monkeypatch.setattr(Wireguard, "_interface_allocator", allocator)
+    return allocator
+
+
+@pytest.fixture
+def wireguard():
+    return create_wireguard()
+
+
+@pytest.fixture
+def wireguard_builder():
+    return build_wireguard
+
+
+def pytest_collection_modifyitems(items):
+    """Marks the benchmarks, so that they are only run when requested."""
+    benchmark_dir = Path(__file__).parent
+    for item in items:
+        if benchmark_dir in Path(item.fspath).parents:
+            item.add_marker(pytest.mark.performance)
+
+
+BASELINES = json.loads((Path(__file__).parent / "baselines.json").read_text())
+
+
+@pytest.fixture(autouse=True)
+def check_baseline(request):
+    """
+    Fails benchmarks whose mean time regressed above the committed baseline
+    by more than the regression threshold.
+    """
+    yield
+    benchmark = request.node.funcargs.get("benchmark")
+    baseline = BASELINES["mean_in_secs"].get(request.node.name)
+    if not benchmark or not benchmark.stats or baseline is None:
+        # Benchmarks are disabled, or the test has no baseline.
+        return
+
+    ceiling = baseline * (1 + BASELINES["regression_threshold"])
+    mean = benchmark.stats.stats.mean
+    assert mean <= ceiling, (
+        f"{request.node.name} took {mean:.6f} s on average, "
+        f"above the {baseline:.6f} s baseline by more than the regression threshold."
+    )
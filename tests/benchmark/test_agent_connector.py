@@ -0,0 +1,61 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.fallback_local_agent \
+    import AgentConnector
+
+SERVER_DOMAIN = "node-ch-01.protonvpn.net"
+
+
+@contextmanager
+def serve_in_background(stand_in_tls_server):
+    """Runs the stand-in TLS server on its own asyncio loop, in a background thread."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    server = stand_in_tls_server()
+    try:
+        yield asyncio.run_coroutine_threadsafe(server.__aenter__(), loop).result()
+    finally:
+        asyncio.run_coroutine_threadsafe(server.__aexit__(None, None, None), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def test_connect_with_full_handshake(benchmark, stand_in_tls_server, test_ca, agent_credentials):
+    with serve_in_background(stand_in_tls_server) as server_address:
+        connector = AgentConnector(ca_pem=test_ca.certificate_pem, server_address=server_address)
+
+        connects = 0
+
+        def connect():
+            nonlocal connects
+            connects += 1
+            connector._tls_sessions.clear()
+            asyncio.run(connector.connect(SERVER_DOMAIN, agent_credentials))
+
+        benchmark.pedantic(connect, rounds=20, warmup_rounds=1)
+
+    # Benchmarks can be disabled, in which case connect() is only called once.
+    assert connector.session_hits == 0
+    assert connector.session_misses == connects
+
+
+def test_connect_with_resumed_session(benchmark, stand_in_tls_server, test_ca, agent_credentials):
+    with serve_in_background(stand_in_tls_server) as server_address:
+        connector = AgentConnector(ca_pem=test_ca.certificate_pem, server_address=server_address)
+
+        connects = 0
+
+        def connect():
+            nonlocal connects
+            connects += 1
+            asyncio.run(connector.connect(SERVER_DOMAIN, agent_credentials))
+
+        benchmark.pedantic(connect, rounds=20, warmup_rounds=1)
+
+    # Only the first connection does a full handshake.
+    assert connector.session_misses == 1
+    assert connector.session_hits == connects - 1
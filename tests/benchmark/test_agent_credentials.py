@@ -0,0 +1,20 @@
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.fallback_local_agent \
+    import create_ssl_context_in_memory, create_ssl_context_from_temp_files
+
+
+def test_create_ssl_context_in_memory(benchmark, test_ca, agent_credentials):
+    context = benchmark(
+        create_ssl_context_in_memory,
+        test_ca.certificate_pem, agent_credentials.certificate_pem, agent_credentials
+    )
+
+    assert context.get_ca_certs()
+
+
+def test_create_ssl_context_from_temp_files(benchmark, test_ca, agent_credentials):
+    context = benchmark(
+        create_ssl_context_from_temp_files,
+        test_ca.certificate_pem, agent_credentials.certificate_pem, agent_credentials
+    )
+
+    assert context.get_ca_certs()
@@ -0,0 +1,85 @@
+import asyncio
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent import \
+    Status, State
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.dispatcher import \
+    OverflowPolicy
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.listener import \
+    AgentListener
+from stand_in_agent import Scenarios, StandInAgentConnector
+
+STATUS_COUNT = 100_000
+LOAD_STATUS_COUNT = 10_000
+
+
+class FakeAgentConnection:
+    """Agent connection yielding the same status message a number of times."""
+
+    def __init__(self, status_count: int):
+        self._remaining = status_count
+        self._status = Status(state=State.CONNECTED)
+
+    async def read(self):
+        if not self._remaining:
+            raise asyncio.CancelledError()
+        self._remaining -= 1
+        # Reading from a real connection suspends until data is received.
+        await asyncio.sleep(0)
+        return self._status
+
+
+async def _listen(status_count: int) -> int:
+    received = 0
+
+    async def subscriber(_):
+        nonlocal received
+        received += 1
+
+    listener = AgentListener(subscribers=[subscriber], overflow_policy=OverflowPolicy.BLOCK)
+    try:
+        await listener.listen(FakeAgentConnection(status_count))
+    except asyncio.CancelledError:
+        pass
+    await listener.wait_for_subscribers()
+    return received
+
+
+def test_listen_throughput(benchmark):
+    received = benchmark.pedantic(lambda: asyncio.run(_listen(STATUS_COUNT)), rounds=3)
+
+    assert received == STATUS_COUNT
+
+
+async def _listen_to_stand_in_agent(server_factory, ca_pem, credentials, status_count) -> int:
+    received = 0
+    done = asyncio.Event()
+
+    async def subscriber(_):
+        nonlocal received
+        received += 1
+        if received == status_count:
+            done.set()
+
+    async with server_factory(Scenarios.load(status_count)) as server:
+        listener = AgentListener(
+            subscribers=[subscriber], overflow_policy=OverflowPolicy.BLOCK,
+            connector=StandInAgentConnector(server.address, ca_pem)
+        )
+        listener.start("node-ch-01.protonvpn.net", credentials, features=None)
+        try:
+            await asyncio.wait_for(done.wait(), timeout=30)
+        finally:
+            listener.stop()
+    return received
+
+
+def test_stand_in_agent_load(benchmark, stand_in_agent_server, test_ca, agent_credentials):
+    received = benchmark.pedantic(
+        lambda: asyncio.run(_listen_to_stand_in_agent(
+            stand_in_agent_server, test_ca.certificate_pem, agent_credentials,
+            LOAD_STATUS_COUNT
+        )),
+        rounds=3
+    )
+
+    assert received == LOAD_STATUS_COUNT
@@ -0,0 +1,40 @@
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard import Wireguard
+
+
+def _build_connection(wireguard):
+    wireguard._generate_connection()
+    wireguard._modify_connection()
+    return wireguard.connection
+
+
+def test_cold_connection_setup(benchmark, wireguard):
+    def build_from_scratch():
+        Wireguard._connection_templates.clear()
+        return _build_connection(wireguard)
+
+    connection = benchmark(build_from_scratch)
+
+    assert connection.verify()
+
+
+def test_templated_connection_setup(benchmark, wireguard):
+    Wireguard._connection_templates.clear()
+    _build_connection(wireguard)
+
+    connection = benchmark(_build_connection, wireguard)
+
+    assert connection.verify()
+    assert len(Wireguard._connection_templates) == 1
+
+
+def test_modify_connection(benchmark, wireguard):
+    def generate_connection():
+        # Modifying the connection adds a peer, so a new one is needed on each round.
+        wireguard._generate_connection()
+        return (), {}
+
+    benchmark.pedantic(
+        wireguard._modify_connection, setup=generate_connection, rounds=1000
+    )
+
+    assert wireguard.connection.verify()
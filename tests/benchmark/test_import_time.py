@@ -0,0 +1,41 @@
+import subprocess
+import sys
+
+MEASURE_IMPORT = """
+import time
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start)
+"""
+
+PACKAGE = "proton.vpn.backend.linux.networkmanager.protocol.wireguard"
+
+
+def _measure_import_time(statement: str) -> float:
+    """Imports the package on a new interpreter, so that no module is cached."""
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE_IMPORT.format(statement=statement)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return float(output)
+
+
+def test_package_import_time(benchmark):
+    import_time = benchmark.pedantic(
+        _measure_import_time, args=(f"import {PACKAGE}",), rounds=5
+    )
+
+    assert import_time > 0
+
+
+def test_backend_class_import_time(benchmark):
+    """
+    Backend discovery imports the class, which loads NM through its base class.
+    Only the local agent implementation is still deferred at this point.
+    """
+    import_time = benchmark.pedantic(
+        _measure_import_time,
+        args=(f"from {PACKAGE} import Wireguard; Wireguard._validate()",), rounds=5
+    )
+
+    assert import_time > 0
@@ -0,0 +1,43 @@
+from unittest.mock import Mock
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent import \
+    Reason, ReasonCode, State, Status
+
+
+def _run(coroutine):
+    """Runs a coroutine which is not expected to suspend, without an event loop."""
+    try:
+        coroutine.send(None)
+    except StopIteration:
+        return
+    raise RuntimeError("Coroutine suspended.")
+
+
+def test_connected_status_dispatch(benchmark, wireguard):
+    wireguard._notify_subscribers = Mock()
+    status = Status(state=State.CONNECTED)
+
+    benchmark(lambda: _run(wireguard._on_local_agent_status(status)))
+
+    wireguard._notify_subscribers.assert_called()
+
+
+def test_hard_jailed_status_dispatch(benchmark, wireguard):
+    wireguard._notify_subscribers = Mock()
+    status = Status(
+        state=State.HARD_JAILED, reason=Reason(code=ReasonCode.MAX_SESSIONS_PLUS)
+    )
+
+    benchmark(lambda: _run(wireguard._on_local_agent_status(status)))
+
+    wireguard._notify_subscribers.assert_called()
+
+
+def test_restore_cached_agent_status(benchmark, agent_state_cache):
+    connection_id = "6b3a1d6e-4b9f-4b43-9d58-1f0c2a4f7a11"
+    domain = "node-ch-01.protonvpn.net"
+    agent_state_cache.save(connection_id, domain, Status(state=State.CONNECTED))
+
+    status = benchmark(lambda: agent_state_cache.load(connection_id, domain).to_status())
+
+    assert status.state == State.CONNECTED
@@ -0,0 +1,52 @@
+import asyncio
+from concurrent.futures import Future
+from unittest.mock import Mock
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.core import LinuxNetworkManager
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard import Wireguard, local_agent
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.interfaces import \
+    InterfaceAllocator
+
+TUNNELS = 8
+
+pytestmark = pytest.mark.skipif(
+    not local_agent.AgentConnector.supports_interface_binding,
+    reason="Dedicated tunnels are not supported by the local agent implementation."
+)
+
+
+def _add_connection_async(connection) -> Future:
+    future = Future()
+    future.set_result(connection)
+    return future
+
+
+async def _start_tunnels(wireguard_builder, nm_client):
+    tunnels = [wireguard_builder(nm_client=nm_client, dedicated=True) for _ in range(TUNNELS)]
+    for tunnel in tunnels:
+        tunnel._agent_listener = Mock(is_running=False)
+
+    await asyncio.gather(*(tunnel.start() for tunnel in tunnels))
+    return tunnels
+
+
+def test_concurrent_tunnels_setup(benchmark, wireguard_builder, monkeypatch):
+    async def start(connection):
+        # Activating the profiles is left to NM, only adding them is measured.
+        await asyncio.wrap_future(connection.setup())
+
+    monkeypatch.setattr(LinuxNetworkManager, "start", start)
+
+    def start_tunnels():
+        monkeypatch.setattr(Wireguard, "_interface_allocator", InterfaceAllocator())
+        nm_client = Mock()
+        nm_client.add_connection_async.side_effect = _add_connection_async
+        return nm_client, asyncio.run(_start_tunnels(wireguard_builder, nm_client))
+
+    nm_client, tunnels = benchmark(start_tunnels)
+
+    added_connections = [call.args[0] for call in nm_client.add_connection_async.call_args_list]
+    assert sorted(connection.get_interface_name() for connection in added_connections) == \
+        sorted(tunnel.tunnel.interface_name for tunnel in tunnels)
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import time
+from unittest.mock import Mock
+
+# Time NM is assumed to take to reapply a profile on a device.
+REAPPLY_LATENCY_IN_SECS = 0.05
+# MTU of the tunnel of the previous connection.
+ACTIVE_TUNNEL_MTU = 1380
+
+
+class MockedNMClient:
+    """NM client where the previous connection is active on a device."""
+
+    def __init__(self):
+        self.active_connection = Mock()
+        self.device = Mock()
+        self.remote_connection = self.active_connection.get_connection.return_value
+        self.active_connection.get_devices.return_value = [self.device]
+        self.remote_connection.get_setting_by_name.return_value.get_mtu.return_value = \
+            ACTIVE_TUNNEL_MTU
+        # Settings of the active profile.
+        self.profile = None
+        self.remote_connection.to_dbus.side_effect = lambda flags: self.profile.to_dbus(flags)
+        self._nm_client = Mock()
+        self._nm_client.get_active_connections.return_value = [self.active_connection]
+
+        def update2(settings, flags, args, cancellable, callback, user_data):
+            callback(self.remote_connection, Mock(), user_data)
+
+        def reapply_async(connection, version_id, flags, cancellable, callback, user_data):
+            time.sleep(REAPPLY_LATENCY_IN_SECS)
+            callback(self.device, Mock(), user_data)
+
+        self.remote_connection.update2.side_effect = update2
+        self.device.reapply_async.side_effect = reapply_async
+
+    def _run_on_glib_loop_thread(self, function):
+        threading.Thread(target=function).start()
+
+
+async def _switch_servers(wireguard_builder):
+    nm_client = MockedNMClient()
+    previous = wireguard_builder(nm_client=nm_client)
+    previous._generate_connection()
+    nm_client.active_connection.get_uuid.return_value = previous._unique_id
+
+    new = wireguard_builder(nm_client=nm_client)
+    for connection in (previous, new):
+        connection._agent_listener = Mock(is_running=False)
+    await new.prepare()
+
+    start = time.monotonic()
+    await new.switch_from(previous)
+    interruption = time.monotonic() - start
+
+    return nm_client, previous, new, interruption
+
+
+def test_in_place_server_switch(benchmark, wireguard_builder):
+    nm_client, previous, new, interruption = benchmark.pedantic(
+        lambda: asyncio.run(_switch_servers(wireguard_builder)), rounds=10
+    )
+
+    assert interruption < 1
+    nm_client.device.reapply_async.assert_called_once()
+    nm_client.active_connection.disconnect_by_func.assert_called_once_with(
+        previous._on_state_changed
+    )
+    nm_client.active_connection.connect.assert_called_once_with(
+        "state-changed", new._on_state_changed
+    )
+    assert new._unique_id == previous._unique_id
+    reapplied_connection = nm_client.device.reapply_async.call_args.args[0]
+    assert reapplied_connection.get_setting_by_name("wireguard").get_mtu() == ACTIVE_TUNNEL_MTU
+    new._agent_listener.start.assert_called_once()
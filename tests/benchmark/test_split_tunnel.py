@@ -0,0 +1,31 @@
+import ipaddress
+import random
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.split_tunnel import \
+    SplitTunneling, compute_allowed_ips
+
+PREFIX_COUNT = 10_000
+
+
+def _random_prefixes(count: int, seed: int):
+    rng = random.Random(seed)
+    return [
+        str(ipaddress.ip_network((rng.getrandbits(32), rng.randint(12, 28)), strict=False))
+        for _ in range(count)
+    ]
+
+
+def test_split_tunnel_compaction(benchmark):
+    split_tunneling = SplitTunneling(
+        include=_random_prefixes(PREFIX_COUNT, seed=1),
+        exclude=_random_prefixes(PREFIX_COUNT, seed=2)
+    )
+
+    # The results are cached, so the uncached function is benchmarked.
+    allowed_ips = benchmark(compute_allowed_ips.__wrapped__, split_tunneling)
+
+    networks = [ipaddress.ip_network(network) for network in allowed_ips]
+    benchmark.extra_info["input_prefixes"] = 2 * PREFIX_COUNT
+    benchmark.extra_info["allowed_ips"] = len(allowed_ips)
+    # Networks which could still be merged would be collapsed further.
+    assert len(list(ipaddress.collapse_addresses(networks))) == len(networks)
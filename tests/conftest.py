@@ -0,0 +1,175 @@
+import asyncio
+import datetime
+import ssl
+import tempfile
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.x509.oid import NameOID
+
+from stand_in_agent import StandInAgentServer
+
+
+@dataclass
+class TestCertificate:
+    """Certificate issued for tests, together with its private key."""
+    key: Ed25519PrivateKey
+    certificate: x509.Certificate
+
+    @property
+    def certificate_pem(self) -> str:
+        return self.certificate.public_bytes(serialization.Encoding.PEM).decode("ascii")
+
+    def get_key_pem(self, password: Optional[bytes] = None) -> str:
+        encryption = (
+            serialization.BestAvailableEncryption(password) if password
+            else serialization.NoEncryption()
+        )
+        return self.key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, encryption
+        ).decode("ascii")
+
+
+class TestCredentials:
+    """Stand-in for the VPN pubkey credentials used to connect to the local agent."""
+
+    def __init__(self, certificate: TestCertificate):
+        self._certificate = certificate
+
+    @property
+    def certificate_pem(self) -> str:
+        return self._certificate.certificate_pem
+
+    @property
+    def certificate_validity_remaining(self) -> float:
+        not_valid_after = self._certificate.certificate.not_valid_after.replace(
+            tzinfo=datetime.timezone.utc
+        )
+        return (not_valid_after - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+
+    def get_ed25519_sk_pem(self, password: Optional[bytes] = None) -> str:
+        return self._certificate.get_key_pem(password)
+
+
+def issue_certificate(
+        common_name: str, issuer: Optional[TestCertificate] = None,
+        valid_for: datetime.timedelta = datetime.timedelta(days=1),
+        dns_name: Optional[str] = None
+) -> TestCertificate:
+    """Issues a certificate signed by the issuer or, if no issuer is given, a CA certificate."""
+    key = Ed25519PrivateKey.generate()
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(issuer.certificate.subject if issuer else name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + valid_for)
+        .add_extension(x509.BasicConstraints(ca=issuer is None, path_length=None), critical=True)
+    )
+    if dns_name:
+        builder = builder.add_extension(
+            x509.SubjectAlternativeName([x509.DNSName(dns_name)]), critical=False
+        )
+    certificate = builder.sign(private_key=issuer.key if issuer else key, algorithm=None)
+    return TestCertificate(key=key, certificate=certificate)
+
+
+@pytest.fixture(scope="session")
+def test_ca() -> TestCertificate:
+    return issue_certificate("Test Root CA")
+
+
+@pytest.fixture
+def create_agent_credentials(test_ca):
+    """Returns a function issuing new client credentials signed by the test CA."""
+    def _create_agent_credentials(
+            valid_for: datetime.timedelta = datetime.timedelta(days=1)
+    ) -> TestCredentials:
+        return TestCredentials(issue_certificate("test-client", test_ca, valid_for))
+
+    return _create_agent_credentials
+
+
+@pytest.fixture
+def agent_credentials(create_agent_credentials) -> TestCredentials:
+    return create_agent_credentials()
+
+
+AGENT_SERVER_DOMAIN = "node-ch-01.protonvpn.net"
+
+
+def create_server_ssl_context(ca: TestCertificate, server: TestCertificate) -> ssl.SSLContext:
+    """Creates a TLS server context requiring client certificates issued by the CA."""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.verify_mode = ssl.CERT_REQUIRED
+    context.load_verify_locations(cadata=ca.certificate_pem)
+    with tempfile.NamedTemporaryFile("w") as file:
+        file.write(server.certificate_pem)
+        file.write(server.get_key_pem())
+        file.flush()
+        context.load_cert_chain(file.name)
+    return context
+
+
+@pytest.fixture
+def stand_in_tls_server(test_ca):
+    """
+    Returns an async context manager starting a local TLS server which
+    accepts clients with certificates issued by the test CA, and yields its address.
+    """
+    server_certificate = issue_certificate(
+        AGENT_SERVER_DOMAIN, issuer=test_ca, dns_name=AGENT_SERVER_DOMAIN
+    )
+
+    @asynccontextmanager
+    async def _stand_in_tls_server(issue_session_tickets: bool = True):
+        async def handle_client(reader, writer):
+            await reader.read()
+            writer.close()
+
+        context = create_server_ssl_context(test_ca, server_certificate)
+        if not issue_session_tickets:
+            context.num_tickets = 0
+        server = await asyncio.start_server(handle_client, "127.0.0.1", 0, ssl=context)
+        try:
+            yield server.sockets[0].getsockname()[:2]
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    return _stand_in_tls_server
+
+
+@pytest.fixture
+def stand_in_agent_server(test_ca):
+    """
+    Returns an async context manager starting a stand-in local agent server,
+    which plays the scenarios given on each client connection.
+    See stand_in_agent.py for details.
+    """
+    server_certificate = issue_certificate(
+        AGENT_SERVER_DOMAIN, issuer=test_ca, dns_name=AGENT_SERVER_DOMAIN
+    )
+
+    @asynccontextmanager
+    async def _stand_in_agent_server(*scenarios):
+        server = StandInAgentServer(
+            ssl_context=create_server_ssl_context(test_ca, server_certificate),
+            scenarios=scenarios
+        )
+        await server.start()
+        try:
+            yield server
+        finally:
+            await server.close()
+
+    return _stand_in_agent_server
@@ -0,0 +1,237 @@
+"""
+Stand-in for the local agent server running on VPN servers, to exercise the
+local agent listener end to end without a real Proton server.
+
+The stand-in server speaks a simplified protocol over TLS: messages are JSON
+objects, one per line. The server sends status messages:
+
+    {"status": {"state": "HARD_JAILED", "reason": 86111, "features": {...}}}
+
+and the client requests features with:
+
+    {"features": {"netshield_level": 2, ...}}
+
+which the server confirms by sending a status message with the features set.
+"""
+import asyncio
+import json
+import ssl
+import tempfile
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.fallback_local_agent \
+    import AgentFeatures, Reason, ReasonCode, State, Status
+
+
+@dataclass
+class StandInStatus(Status):
+    """Status message, together with the features currently set on the server."""
+    features: Optional[AgentFeatures] = None
+
+
+@dataclass
+class SendStatus:
+    """Scenario step sending a status message."""
+    state: State
+    reason: Optional[ReasonCode] = None
+
+
+@dataclass
+class Delay:
+    """Scenario step waiting before the next one."""
+    seconds: float
+
+
+@dataclass
+class Drop:
+    """Scenario step closing the connection abruptly."""
+
+
+@dataclass
+class Flood:
+    """Scenario step sending the same status message many times, to generate load."""
+    count: int
+    state: State = State.CONNECTED
+
+
+class Scenarios:
+    """Scripted scenarios the stand-in server can play on each client connection."""
+    CONNECTED = [SendStatus(State.CONNECTED)]
+    ABRUPT_DROP = [SendStatus(State.CONNECTED), Drop()]
+
+    @staticmethod
+    def hard_jailed(reason: ReasonCode) -> list:
+        """The server jails the client for the reason given."""
+        return [SendStatus(State.HARD_JAILED, reason)]
+
+    @staticmethod
+    def certificate_expired() -> list:
+        """The server reports the client certificate expired while connected."""
+        return [SendStatus(State.HARD_JAILED, ReasonCode.CERTIFICATE_EXPIRED)]
+
+    @staticmethod
+    def slow(seconds: float) -> list:
+        """The server takes a while before sending the first status."""
+        return [Delay(seconds), SendStatus(State.CONNECTED)]
+
+    @staticmethod
+    def load(count: int) -> list:
+        """The server sends the number of status messages given, as fast as it can."""
+        return [Flood(count)]
+
+
+def _encode_status(state: State, reason: Optional[ReasonCode], features: Dict[str, Any]) -> bytes:
+    status = {"state": state.name, "reason": reason.value if reason else None}
+    if features:
+        status["features"] = features
+    return json.dumps({"status": status}).encode() + b"\n"
+
+
+def _decode_status(line: bytes) -> StandInStatus:
+    status = json.loads(line)["status"]
+    features = status.get("features")
+    return StandInStatus(
+        state=State[status["state"]],
+        reason=Reason(code=ReasonCode(status["reason"])) if status["reason"] else None,
+        features=AgentFeatures(**features) if features else None
+    )
+
+
+class StandInAgentServer:
+    """
+    TLS server playing one scenario per client connection, in order. Once
+    all scenarios were played, the last one is played on new connections.
+
+    After playing its scenario, the server keeps the connection open and
+    confirms the features requested by the client.
+    """
+
+    def __init__(self, ssl_context: ssl.SSLContext, scenarios: Sequence[list]):
+        self.ssl_context = ssl_context
+        self.scenarios = scenarios
+        self.address: Optional[Tuple[str, int]] = None
+        self.connections = 0
+        self.feature_requests: List[Dict[str, Any]] = []
+        self.features: Dict[str, Any] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> Tuple[str, int]:
+        """Starts the server and returns its address."""
+        self._server = await asyncio.start_server(
+            self._handle_client, "127.0.0.1", 0, ssl=self.ssl_context
+        )
+        self.address = self._server.sockets[0].getsockname()[:2]
+        return self.address
+
+    async def close(self):
+        """Stops the server."""
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        scenario = self.scenarios[min(self.connections, len(self.scenarios) - 1)]
+        self.connections += 1
+        try:
+            for step in scenario:
+                if not await self._play(step, writer):
+                    return
+            await self._confirm_feature_requests(reader, writer)
+        except (ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    async def _play(self, step, writer: asyncio.StreamWriter) -> bool:
+        if isinstance(step, Drop):
+            writer.transport.abort()
+            return False
+        if isinstance(step, Delay):
+            await asyncio.sleep(step.seconds)
+        elif isinstance(step, SendStatus):
+            writer.write(_encode_status(step.state, step.reason, self.features))
+        elif isinstance(step, Flood):
+            message = _encode_status(step.state, None, self.features)
+            for _ in range(step.count):
+                writer.write(message)
+                await writer.drain()
+        await writer.drain()
+        return True
+
+    async def _confirm_feature_requests(
+            self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            features = json.loads(line)["features"]
+            self.feature_requests.append(features)
+            self.features.update(features)
+            writer.write(_encode_status(State.CONNECTED, None, self.features))
+            await writer.drain()
+
+
+class StandInAgentConnection:
+    """Client side of the stand-in local agent protocol."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+
+    async def read(self) -> StandInStatus:
+        """Reads the next status message."""
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionResetError("Connection closed by the stand-in agent server.")
+        return _decode_status(line)
+
+    async def request_features(self, features: AgentFeatures):
+        """Requests the features which are set."""
+        values = {name: value for name, value in asdict(features).items() if value is not None}
+        self._writer.write(json.dumps({"features": values}).encode() + b"\n")
+        await self._writer.drain()
+
+    def close(self):
+        """Closes the connection."""
+        self._writer.close()
+
+
+class StandInAgentConnector:
+    """Connects to the stand-in local agent server with the test credentials."""
+
+    def __init__(self, server_address: Tuple[str, int], ca_pem: str):
+        self._server_address = server_address
+        self._ca_pem = ca_pem
+
+    async def connect(self, vpn_server_domain: str, credentials) -> StandInAgentConnection:
+        """Connects to the stand-in server, authenticating with the credentials given."""
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.load_verify_locations(cadata=self._ca_pem)
+        # With TLS 1.3 the server rejects the client certificate after the
+        # client considers the handshake done, which would look like a
+        # connection dropped after being established.
+        context.maximum_version = ssl.TLSVersion.TLSv1_2
+        # The fallback connector already covers loading credentials in memory.
+        with _credentials_file(credentials) as path:
+            context.load_cert_chain(path)
+        reader, writer = await asyncio.open_connection(
+            *self._server_address, ssl=context, server_hostname=vpn_server_domain
+        )
+        return StandInAgentConnection(reader, writer)
+
+    def invalidate_credentials_cache(self):
+        """Credentials are loaded on each connection."""
+
+    def prepare(self, credentials):
+        """Credentials are loaded on each connection."""
+
+
+@contextmanager
+def _credentials_file(credentials):
+    with tempfile.NamedTemporaryFile("w") as file:
+        file.write(credentials.certificate_pem)
+        file.write(credentials.get_ed25519_sk_pem())
+        file.flush()
+        yield file.name
@@ -0,0 +1,64 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.handshake import \
+    HANDSHAKE_RESPONSE_LENGTH, MESSAGE_HANDSHAKE_RESPONSE
+
+HANDSHAKE_RESPONSE = bytes([MESSAGE_HANDSHAKE_RESPONSE]) + bytes(HANDSHAKE_RESPONSE_LENGTH - 1)
+
+
+class StandInWireguardServer(asyncio.DatagramProtocol):
+    """
+    Answers handshake initiations after the configured delay,
+    ignoring the configured ratio of them.
+    """
+
+    def __init__(self, delay: float = 0, loss: float = 0):
+        self.delay = delay
+        self.loss = loss
+        self.received = 0
+        self.transport = None
+        self._dropped = 0.0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        self._dropped += self.loss
+        if self._dropped >= 1:
+            self._dropped -= 1
+            return
+
+        asyncio.get_running_loop().call_later(
+            self.delay, self.transport.sendto, HANDSHAKE_RESPONSE, addr
+        )
+
+
+@pytest.fixture
+def stand_in_servers():
+    """
+    Returns an async context manager yielding a function to start local
+    Wireguard stand-in servers, which are stopped when exiting the context.
+    """
+    @asynccontextmanager
+    async def _stand_in_servers():
+        transports = []
+
+        async def start_server(delay: float = 0, loss: float = 0):
+            loop = asyncio.get_running_loop()
+            transport, server = await loop.create_datagram_endpoint(
+                lambda: StandInWireguardServer(delay, loss), local_addr=("127.0.0.1", 0)
+            )
+            transports.append(transport)
+            return transport.get_extra_info("sockname")[1], server
+
+        try:
+            yield start_server
+        finally:
+            for transport in transports:
+                transport.close()
+
+    return _stand_in_servers
@@ -0,0 +1,144 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.dispatcher import \
+    OverflowPolicy, SubscriberDispatcher
+
+
+class BlockedSubscriber:
+    """Subscriber that records messages but only handles them when released."""
+
+    def __init__(self):
+        self.messages = []
+        self.released = asyncio.Event()
+
+    async def __call__(self, message):
+        await self.released.wait()
+        self.messages.append(message)
+
+
+@pytest.mark.asyncio
+async def test_publish_delivers_messages_in_order_to_all_subscribers():
+    first_subscriber, second_subscriber = AsyncMock(), AsyncMock()
+    dispatcher = SubscriberDispatcher([first_subscriber, second_subscriber])
+
+    await dispatcher.publish(1)
+    await dispatcher.publish(2)
+    await dispatcher.join()
+
+    for subscriber in (first_subscriber, second_subscriber):
+        assert [call.args[0] for call in subscriber.call_args_list] == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_does_not_delay_other_subscribers():
+    slow_subscriber, fast_subscriber = BlockedSubscriber(), AsyncMock()
+    dispatcher = SubscriberDispatcher([slow_subscriber, fast_subscriber])
+
+    await dispatcher.publish("message")
+    await asyncio.sleep(0)
+
+    fast_subscriber.assert_called_once_with("message")
+    assert slow_subscriber.messages == []
+    slow_subscriber.released.set()
+    await dispatcher.join()
+    assert slow_subscriber.messages == ["message"]
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_policy_discards_oldest_pending_messages():
+    subscriber = BlockedSubscriber()
+    dispatcher = SubscriberDispatcher(
+        [subscriber], max_queue_size=2, overflow_policy=OverflowPolicy.DROP_OLDEST
+    )
+
+    await dispatcher.publish(0)
+    await asyncio.sleep(0)  # Let the worker pick up the first message.
+    for message in range(1, 4):
+        await dispatcher.publish(message)
+    subscriber.released.set()
+    await dispatcher.join()
+
+    # The first message was already being delivered when the queue overflowed.
+    assert subscriber.messages == [0, 2, 3]
+    (_, metrics), = dispatcher.metrics
+    assert metrics.dropped == 1
+    assert metrics.max_queue_depth == 2
+
+
+@pytest.mark.asyncio
+async def test_coalesce_policy_replaces_newest_pending_message():
+    subscriber = BlockedSubscriber()
+    dispatcher = SubscriberDispatcher(
+        [subscriber], max_queue_size=1, overflow_policy=OverflowPolicy.COALESCE
+    )
+
+    await dispatcher.publish(0)
+    await asyncio.sleep(0)  # Let the worker pick up the first message.
+    for message in range(1, 4):
+        await dispatcher.publish(message)
+    subscriber.released.set()
+    await dispatcher.join()
+
+    assert subscriber.messages == [0, 3]
+    (_, metrics), = dispatcher.metrics
+    assert metrics.coalesced == 2
+
+
+@pytest.mark.asyncio
+async def test_block_policy_waits_for_room_in_the_queue():
+    subscriber = BlockedSubscriber()
+    dispatcher = SubscriberDispatcher(
+        [subscriber], max_queue_size=1, overflow_policy=OverflowPolicy.BLOCK
+    )
+    for message in range(2):
+        await dispatcher.publish(message)
+
+    publish = asyncio.create_task(dispatcher.publish(2))
+    await asyncio.sleep(0.01)
+    assert not publish.done()
+
+    subscriber.released.set()
+    await publish
+    await dispatcher.join()
+    assert subscriber.messages == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_metrics_record_delivery_latency():
+    dispatcher = SubscriberDispatcher([AsyncMock()])
+
+    await dispatcher.publish("message")
+    await dispatcher.join()
+
+    (_, metrics), = dispatcher.metrics
+    assert metrics.delivered == 1
+    assert metrics.queue_depth == 0
+    assert metrics.mean_latency == metrics.last_latency >= 0
+
+
+@pytest.mark.asyncio
+async def test_failing_subscriber_does_not_stop_delivery():
+    subscriber = AsyncMock(side_effect=[RuntimeError("boom"), None])
+    dispatcher = SubscriberDispatcher([subscriber])
+
+    await dispatcher.publish(1)
+    await dispatcher.publish(2)
+    await dispatcher.join()
+
+    assert subscriber.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_messages_published_after_cancelling_are_delivered():
+    subscriber = AsyncMock()
+    dispatcher = SubscriberDispatcher([subscriber])
+
+    await dispatcher.publish(1)
+    dispatcher.cancel()
+    await dispatcher.publish(2)
+    await asyncio.wait_for(dispatcher.join(), timeout=1)
+
+    assert [call.args[0] for call in subscriber.call_args_list] == [2]
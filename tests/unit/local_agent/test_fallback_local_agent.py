@@ -0,0 +1,187 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent import \
+    fallback_local_agent
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.fallback_local_agent \
+    import AgentConnector, LocalAgentError, SSLContextCache
+
+
+@pytest.fixture
+def connector(test_ca):
+    connector = AgentConnector(ca_pem=test_ca.certificate_pem)
+    with patch.object(connector, "_establish_tls_connection", new_callable=AsyncMock):
+        yield connector
+
+
+async def _connect(connector, credentials):
+    await connector.connect("node.protonvpn.net", credentials)
+    return connector._establish_tls_connection.call_args.kwargs["context"]
+
+
+@pytest.mark.asyncio
+async def test_connect_loads_credentials_without_temporary_files(connector, agent_credentials):
+    with patch.object(fallback_local_agent, "TemporaryDirectory") as temporary_directory:
+        context = await _connect(connector, agent_credentials)
+
+    temporary_directory.assert_not_called()
+    assert context.get_ca_certs()
+
+
+@pytest.mark.asyncio
+async def test_connect_falls_back_to_temporary_files_when_in_memory_files_are_not_supported(
+        connector, agent_credentials
+):
+    with patch.object(fallback_local_agent.os, "memfd_create", side_effect=OSError):
+        context = await _connect(connector, agent_credentials)
+
+    assert context.get_ca_certs()
+
+
+@pytest.mark.asyncio
+async def test_connect_reuses_ssl_context_while_credentials_do_not_change(
+        connector, agent_credentials
+):
+    first_context = await _connect(connector, agent_credentials)
+    second_context = await _connect(connector, agent_credentials)
+
+    assert first_context is second_context
+
+
+@pytest.mark.asyncio
+async def test_connect_creates_new_ssl_context_when_certificate_changes(
+        connector, agent_credentials, create_agent_credentials
+):
+    first_context = await _connect(connector, agent_credentials)
+    second_context = await _connect(connector, create_agent_credentials())
+
+    assert first_context is not second_context
+
+
+@pytest.mark.asyncio
+async def test_connect_creates_new_ssl_context_after_invalidating_credentials_cache(
+        connector, agent_credentials
+):
+    first_context = await _connect(connector, agent_credentials)
+    connector.invalidate_credentials_cache()
+    second_context = await _connect(connector, agent_credentials)
+
+    assert first_context is not second_context
+
+
+def test_ssl_context_cache_expires_with_certificate():
+    now = 1000.0
+    cache = SSLContextCache(clock=lambda: now)
+    context = object()
+    cache.set("fingerprint", context, expiration_time=1060.0)
+
+    assert cache.get("fingerprint") is context
+    now = 1060.0
+    assert cache.get("fingerprint") is None
+
+
+@pytest.mark.asyncio
+async def test_connect_resumes_tls_session_on_reconnection(
+        stand_in_tls_server, test_ca, agent_credentials
+):
+    async with stand_in_tls_server() as server_address:
+        connector = AgentConnector(ca_pem=test_ca.certificate_pem, server_address=server_address)
+
+        await connector.connect("node-ch-01.protonvpn.net", agent_credentials)
+        await connector.connect("node-ch-01.protonvpn.net", agent_credentials)
+
+    assert connector.session_misses == 1
+    assert connector.session_hits == 1
+
+
+@pytest.mark.asyncio
+async def test_connect_does_not_resume_tls_session_after_credentials_change(
+        stand_in_tls_server, test_ca, agent_credentials
+):
+    async with stand_in_tls_server() as server_address:
+        connector = AgentConnector(ca_pem=test_ca.certificate_pem, server_address=server_address)
+
+        await connector.connect("node-ch-01.protonvpn.net", agent_credentials)
+        connector.invalidate_credentials_cache()
+        await connector.connect("node-ch-01.protonvpn.net", agent_credentials)
+
+    assert connector.session_misses == 2
+    assert connector.session_hits == 0
+
+
+@pytest.mark.asyncio
+async def test_connect_does_not_wait_for_session_tickets_the_server_does_not_issue(
+        stand_in_tls_server, test_ca, agent_credentials
+):
+    async with stand_in_tls_server(issue_session_tickets=False) as server_address:
+        connector = AgentConnector(ca_pem=test_ca.certificate_pem, server_address=server_address)
+
+        start = time.monotonic()
+        await connector.connect("node-ch-01.protonvpn.net", agent_credentials)
+
+    assert time.monotonic() - start < 0.5
+
+
+@pytest.mark.asyncio
+async def test_connect_is_cancelled_without_waiting_for_the_connection_timeout(
+        test_ca, agent_credentials
+):
+    async def accept_without_handshake(reader, writer):
+        await reader.read()
+
+    server = await asyncio.start_server(accept_without_handshake, "127.0.0.1", 0)
+    connector = AgentConnector(
+        ca_pem=test_ca.certificate_pem, server_address=server.sockets[0].getsockname()[:2]
+    )
+    connect = asyncio.create_task(
+        connector.connect("node-ch-01.protonvpn.net", agent_credentials)
+    )
+    await asyncio.sleep(0.1)
+
+    connect.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(connect, timeout=1)
+
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_connect_uses_ssl_context_prepared_in_advance(connector, agent_credentials):
+    connector.prepare(agent_credentials)
+
+    with patch.object(fallback_local_agent, "create_ssl_context_in_memory") as create_context:
+        await _connect(connector, agent_credentials)
+
+    create_context.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_connect_binds_the_connection_to_the_interface(
+        stand_in_tls_server, test_ca, agent_credentials
+):
+    async with stand_in_tls_server() as server_address:
+        connector = AgentConnector(
+            ca_pem=test_ca.certificate_pem, server_address=server_address, interface="lo"
+        )
+
+        await connector.connect("node-ch-01.protonvpn.net", agent_credentials)
+
+    assert connector.session_misses == 1
+
+
+@pytest.mark.asyncio
+async def test_connect_fails_when_the_interface_does_not_exist(
+        stand_in_tls_server, test_ca, agent_credentials
+):
+    async with stand_in_tls_server() as server_address:
+        connector = AgentConnector(
+            ca_pem=test_ca.certificate_pem, server_address=server_address,
+            interface="nonexistent0"
+        )
+
+        with pytest.raises(LocalAgentError):
+            await connector.connect("node-ch-01.protonvpn.net", agent_credentials)
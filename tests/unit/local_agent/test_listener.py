@@ -1,10 +1,13 @@
-from asyncio import CancelledError
-from unittest.mock import AsyncMock, Mock
+import asyncio
+from asyncio import CancelledError, Event
+from unittest.mock import AsyncMock, MagicMock, Mock
 
 import pytest
 
-from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.fallback_local_agent import Status, State
-from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.listener import AgentListener
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.fallback_local_agent \
+    import Status, State, ExpiredCertificateError, LocalAgentError, ReasonCode, AgentFeatures
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.listener \
+    import AgentListener
 
 
 @pytest.mark.asyncio
@@ -31,6 +34,7 @@ async def test_listen_notifies_status_message_to_subscribers():
         await listener.listen(agent_connection)
     except CancelledError:
         pass
+    await listener.wait_for_subscribers()
 
     # Then
     subscriber.assert_called_once_with(message)
@@ -50,3 +54,252 @@ async def test_stop_cancels_background_task():
 
     # Then
     assert background_task.cancelled
+
+
+def create_listener(subscriber, connector, retry_budget=3):
+    return AgentListener(
+        subscribers=[subscriber], connector=connector, retry_budget=retry_budget,
+        backoff_base_in_secs=0.001, backoff_max_in_secs=0.001
+    )
+
+
+@pytest.mark.asyncio
+async def test_agent_connection_is_retried_without_notifying_transient_failures():
+    # Given
+    subscriber = AsyncMock()
+    connector = AsyncMock()
+    connector.connect.side_effect = [LocalAgentError("blip"), LocalAgentError("blip"), None]
+    listener = create_listener(subscriber, connector)
+
+    # When
+    listener.start("domain", "credentials", features=None)
+    await listener.background_task
+    await listener.wait_for_subscribers()
+
+    # Then
+    assert connector.connect.call_count == 3
+    subscriber.assert_called_once_with(Status(State.CONNECTED))
+
+
+@pytest.mark.asyncio
+async def test_agent_connection_is_retried_after_a_timeout():
+    # Given
+    subscriber = AsyncMock()
+    connector = AsyncMock()
+    connector.connect.side_effect = [asyncio.TimeoutError(), None]
+    listener = create_listener(subscriber, connector)
+
+    # When
+    listener.start("domain", "credentials", features=None)
+    await listener.background_task
+    await listener.wait_for_subscribers()
+
+    # Then
+    assert connector.connect.call_count == 2
+    subscriber.assert_called_once_with(Status(State.CONNECTED))
+
+
+@pytest.mark.asyncio
+async def test_disconnection_is_notified_once_retry_budget_is_exhausted():
+    # Given
+    subscriber = AsyncMock()
+    connector = AsyncMock()
+    connector.connect.side_effect = LocalAgentError("down")
+    listener = create_listener(subscriber, connector, retry_budget=2)
+
+    # When
+    listener.start("domain", "credentials", features=None)
+    background_task = listener.background_task
+    with pytest.raises(LocalAgentError):
+        await background_task
+    await listener.wait_for_subscribers()
+
+    # Then
+    assert connector.connect.call_count == 3
+    subscriber.assert_called_once_with(Status(State.DISCONNECTED))
+
+
+@pytest.mark.asyncio
+async def test_expired_certificate_is_not_retried():
+    # Given
+    subscriber = AsyncMock()
+    connector = AsyncMock()
+    connector.connect.side_effect = ExpiredCertificateError("expired")
+    listener = create_listener(subscriber, connector)
+
+    # When
+    listener.start("domain", "credentials", features=None)
+    await listener.background_task
+    await listener.wait_for_subscribers()
+
+    # Then
+    connector.connect.assert_called_once()
+    assert subscriber.call_args[0][0].reason.code == ReasonCode.CERTIFICATE_EXPIRED
+
+
+@pytest.mark.asyncio
+async def test_last_requested_features_are_applied_again_on_reconnection():
+    # Given
+    dropped_connection = AsyncMock()
+    dropped_connection.close = Mock()
+    dropped_connection.read.side_effect = ConnectionResetError("dropped")
+    new_connection = AsyncMock()
+    new_connection.close = Mock()
+    new_connection.read.side_effect = CancelledError()
+    connector = AsyncMock()
+    connector.connect.side_effect = [dropped_connection, new_connection]
+
+    listener = create_listener(AsyncMock(), connector)
+    initial_features = AgentFeatures(netshield_level=1, split_tcp=True)
+    updated_features = AgentFeatures(netshield_level=2)
+
+    async def request_features(features):
+        # Features are updated while the first connection is still up.
+        if features == initial_features:
+            await listener.request_features(updated_features)
+
+    dropped_connection.request_features.side_effect = request_features
+
+    # When
+    listener.start("domain", "credentials", features=initial_features)
+    await listener.background_task
+
+    # Then
+    dropped_connection.request_features.assert_any_call(initial_features)
+    new_connection.request_features.assert_called_once_with(
+        AgentFeatures(netshield_level=2, split_tcp=True)
+    )
+
+
+@pytest.mark.asyncio
+async def test_stop_discards_statuses_pending_to_be_delivered():
+    # Given
+    subscriber_can_finish = Event()
+    notified_messages = []
+
+    async def slow_subscriber(message):
+        notified_messages.append(message)
+        await subscriber_can_finish.wait()
+
+    listener = AgentListener(subscribers=[slow_subscriber], connector=AsyncMock())
+    messages = [Status(State.HARD_JAILED), Status(State.CONNECTED)]
+    agent_connection = AsyncMock()
+    agent_connection.read.side_effect = messages + [CancelledError()]
+    with pytest.raises(CancelledError):
+        await listener.listen(agent_connection)
+    await asyncio.sleep(0)
+
+    # When
+    listener.stop()
+    subscriber_can_finish.set()
+    await listener.wait_for_subscribers()
+
+    # Then
+    assert notified_messages == messages[:1]
+
+
+@pytest.mark.asyncio
+async def test_listen_does_not_wait_for_slow_subscribers():
+    # Given
+    subscriber_can_finish = Event()
+
+    async def slow_subscriber(_):
+        await subscriber_can_finish.wait()
+
+    listener = AgentListener(subscribers=[slow_subscriber], connector=AsyncMock())
+    messages = [Status(State.CONNECTED), Status(State.HARD_JAILED)]
+    agent_connection = AsyncMock()
+    agent_connection.read.side_effect = messages + [CancelledError()]
+
+    # When
+    with pytest.raises(CancelledError):
+        await listener.listen(agent_connection)
+
+    # Then
+    assert agent_connection.read.call_count == 3
+    subscriber_can_finish.set()
+    await listener.wait_for_subscribers()
+    (_, metrics), = listener.subscriber_metrics
+    assert metrics.delivered == 2
+
+
+@pytest.mark.asyncio
+async def test_feature_requests_are_coalesced_and_only_send_changed_features():
+    # Given
+    connection = AsyncMock()
+    connector = AsyncMock()
+    connector.connect.return_value = connection
+    listener = AgentListener(connector=connector, feature_debounce_window_in_secs=0.01)
+    listener._connection = connection
+    listener._feature_scheduler.confirm(AgentFeatures(netshield_level=1, split_tcp=True))
+
+    # When
+    await listener.request_features(AgentFeatures(netshield_level=2, split_tcp=True))
+    await listener.request_features(AgentFeatures(netshield_level=0, split_tcp=True))
+    assert listener.pending_features == AgentFeatures(netshield_level=0)
+    await asyncio.sleep(0.05)
+
+    # Then
+    connection.request_features.assert_called_once_with(AgentFeatures(netshield_level=0))
+    assert listener.pending_features == AgentFeatures(netshield_level=0)
+
+
+@pytest.mark.asyncio
+async def test_feature_requests_are_skipped_when_features_did_not_change():
+    # Given
+    connection = AsyncMock()
+    listener = AgentListener(connector=AsyncMock())
+    listener._connection = connection
+    listener._feature_scheduler.confirm(AgentFeatures(netshield_level=1))
+
+    # When
+    await listener.request_features(AgentFeatures(netshield_level=1))
+    await listener.flush_feature_requests()
+
+    # Then
+    connection.request_features.assert_not_called()
+    assert listener.pending_features is None
+
+
+@pytest.mark.asyncio
+async def test_features_reported_by_the_server_are_confirmed():
+    # Given
+    listener = AgentListener(connector=AsyncMock())
+    listener._connection = AsyncMock()
+    status = Mock(features=AgentFeatures(netshield_level=2))
+    agent_connection = AsyncMock()
+    agent_connection.read.side_effect = [status, CancelledError()]
+
+    # When
+    await listener.request_features(AgentFeatures(netshield_level=2))
+    await listener.flush_feature_requests()
+    with pytest.raises(CancelledError):
+        await listener.listen(agent_connection)
+
+    # Then
+    assert listener.confirmed_features == AgentFeatures(netshield_level=2)
+    assert listener.pending_features is None
+
+
+@pytest.mark.asyncio
+async def test_agent_connection_phases_are_recorded_on_the_timeline():
+    # Given
+    timeline = MagicMock()
+    connection = AsyncMock()
+    connection.close = Mock()
+    connection.read.side_effect = [Status(State.CONNECTED), CancelledError()]
+    connector = AsyncMock()
+    connector.connect.return_value = connection
+    listener = create_listener(AsyncMock(), connector)
+    listener.timeline = timeline
+
+    # When
+    listener.start("domain", "credentials", features=AgentFeatures(netshield_level=1))
+    await listener.background_task
+
+    # Then
+    measured_phases = [call.args[0] for call in timeline.measure.call_args_list]
+    assert measured_phases == [
+        AgentListener.PHASE_AGENT_CONNECT, AgentListener.PHASE_FEATURES_REQUEST
+    ]
+    timeline.mark.assert_called_with(AgentListener.PHASE_FIRST_STATUS)
@@ -0,0 +1,128 @@
+import asyncio
+import datetime
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.fallback_local_agent \
+    import AgentConnector, AgentFeatures, LocalAgentError, ReasonCode, State
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.listener import \
+    AgentListener
+from stand_in_agent import Scenarios, StandInAgentConnector
+
+SERVER_DOMAIN = "node-ch-01.protonvpn.net"
+
+
+class RecordingSubscriber:
+    """Records the statuses received, signalling once the expected number was received."""
+
+    def __init__(self, expected: int):
+        self.statuses = []
+        self._expected = expected
+        self.done = asyncio.Event()
+
+    async def __call__(self, status):
+        self.statuses.append(status)
+        if len(self.statuses) >= self._expected:
+            self.done.set()
+
+
+def create_listener(server, test_ca, subscriber):
+    return AgentListener(
+        subscribers=[subscriber],
+        connector=StandInAgentConnector(server.address, test_ca.certificate_pem),
+        backoff_base_in_secs=0.01, backoff_max_in_secs=0.01
+    )
+
+
+async def listen_until_done(listener, subscriber, credentials, features=None):
+    listener.start(SERVER_DOMAIN, credentials, features)
+    try:
+        await asyncio.wait_for(subscriber.done.wait(), timeout=5)
+    finally:
+        listener.stop()
+
+
+@pytest.mark.asyncio
+async def test_requested_features_are_confirmed_by_the_server(
+        stand_in_agent_server, test_ca, agent_credentials
+):
+    subscriber = RecordingSubscriber(expected=2)
+    async with stand_in_agent_server(Scenarios.CONNECTED) as server:
+        listener = create_listener(server, test_ca, subscriber)
+        listener.start(SERVER_DOMAIN, agent_credentials, AgentFeatures(netshield_level=2))
+        try:
+            await asyncio.wait_for(subscriber.done.wait(), timeout=5)
+            assert listener.confirmed_features == AgentFeatures(netshield_level=2)
+        finally:
+            listener.stop()
+
+    assert server.feature_requests == [{"netshield_level": 2}]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("reason", list(ReasonCode))
+async def test_hard_jailed_reason_is_notified(
+        stand_in_agent_server, test_ca, agent_credentials, reason
+):
+    subscriber = RecordingSubscriber(expected=1)
+    async with stand_in_agent_server(Scenarios.hard_jailed(reason)) as server:
+        await listen_until_done(
+            create_listener(server, test_ca, subscriber), subscriber, agent_credentials
+        )
+
+    status, = subscriber.statuses
+    assert status.state == State.HARD_JAILED
+    assert status.reason.code == reason
+
+
+@pytest.mark.asyncio
+async def test_listener_reconnects_after_abrupt_drop(
+        stand_in_agent_server, test_ca, agent_credentials
+):
+    subscriber = RecordingSubscriber(expected=2)
+    async with stand_in_agent_server(Scenarios.ABRUPT_DROP, Scenarios.CONNECTED) as server:
+        await listen_until_done(
+            create_listener(server, test_ca, subscriber), subscriber, agent_credentials
+        )
+
+    assert server.connections == 2
+    assert [status.state for status in subscriber.statuses] == [State.CONNECTED] * 2
+
+
+@pytest.mark.asyncio
+async def test_disconnection_is_notified_when_certificate_expired(
+        stand_in_agent_server, test_ca, create_agent_credentials
+):
+    expired_credentials = create_agent_credentials(valid_for=datetime.timedelta(seconds=-30))
+    subscriber = RecordingSubscriber(expected=1)
+    async with stand_in_agent_server(Scenarios.CONNECTED) as server:
+        listener = create_listener(server, test_ca, subscriber)
+        listener.start(SERVER_DOMAIN, expired_credentials, features=None)
+        with pytest.raises(OSError):
+            await listener.background_task
+        await listener.wait_for_subscribers()
+
+    status, = subscriber.statuses
+    assert status.state == State.DISCONNECTED
+
+
+@pytest.mark.asyncio
+async def test_fallback_connector_connects_to_the_stand_in_server(
+        stand_in_agent_server, test_ca, agent_credentials
+):
+    async with stand_in_agent_server(Scenarios.slow(0.1)) as server:
+        connector = AgentConnector(ca_pem=test_ca.certificate_pem, server_address=server.address)
+        await connector.connect(SERVER_DOMAIN, agent_credentials)
+
+    assert server.connections == 1
+
+
+@pytest.mark.asyncio
+async def test_fallback_connector_is_rejected_with_an_expired_certificate(
+        stand_in_agent_server, test_ca, create_agent_credentials
+):
+    expired_credentials = create_agent_credentials(valid_for=datetime.timedelta(seconds=-30))
+    async with stand_in_agent_server(Scenarios.CONNECTED) as server:
+        connector = AgentConnector(ca_pem=test_ca.certificate_pem, server_address=server.address)
+        with pytest.raises(LocalAgentError):
+            await connector.connect(SERVER_DOMAIN, expired_credentials)
@@ -0,0 +1,80 @@
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.agent_state_cache import \
+    AgentStateCache
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent import \
+    AgentFeatures, ReasonCode, State
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.local_agent.fallback_local_agent \
+    import Reason, Status
+
+CONNECTION_ID = "6b3a1d6e-4b9f-4b43-9d58-1f0c2a4f7a11"
+SERVER_DOMAIN = "node-ch-01.protonvpn.net"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return AgentStateCache(directory=tmp_path / "agent_state", max_age_in_secs=60, clock=clock)
+
+
+def test_cached_state_is_restored(cache):
+    status = Status(
+        state=State.HARD_JAILED, reason=Reason(code=ReasonCode.MAX_SESSIONS_PLUS)
+    )
+    cache.save(CONNECTION_ID, SERVER_DOMAIN, status, AgentFeatures(netshield_level=2))
+
+    cached_state = cache.load(CONNECTION_ID, SERVER_DOMAIN)
+
+    restored_status = cached_state.to_status()
+    assert restored_status.state == State.HARD_JAILED
+    assert restored_status.reason.code == ReasonCode.MAX_SESSIONS_PLUS
+    assert cached_state.to_features() == AgentFeatures(netshield_level=2)
+
+
+def test_stale_state_is_not_restored(cache, clock):
+    cache.save(CONNECTION_ID, SERVER_DOMAIN, Status(state=State.CONNECTED))
+
+    clock.now += 61
+
+    assert cache.load(CONNECTION_ID, SERVER_DOMAIN) is None
+
+
+def test_state_cached_for_another_server_is_not_restored(cache):
+    cache.save(CONNECTION_ID, SERVER_DOMAIN, Status(state=State.CONNECTED))
+
+    assert cache.load(CONNECTION_ID, "node-de-01.protonvpn.net") is None
+
+
+def test_corrupted_state_is_not_restored(cache):
+    cache.save(CONNECTION_ID, SERVER_DOMAIN, Status(state=State.CONNECTED))
+    (cache.directory / f"{CONNECTION_ID}.json").write_text("{not json")
+
+    assert cache.load(CONNECTION_ID, SERVER_DOMAIN) is None
+
+
+def test_removed_state_is_not_restored(cache):
+    cache.save(CONNECTION_ID, SERVER_DOMAIN, Status(state=State.CONNECTED))
+
+    cache.remove(CONNECTION_ID)
+
+    assert cache.load(CONNECTION_ID, SERVER_DOMAIN) is None
+
+
+def test_cached_state_is_only_readable_by_the_user(cache):
+    cache.save(CONNECTION_ID, SERVER_DOMAIN, Status(state=State.CONNECTED))
+
+    mode = (cache.directory / f"{CONNECTION_ID}.json").stat().st_mode
+
+    assert mode & 0o077 == 0
@@ -0,0 +1,104 @@
+import socket
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.endpoint import EndpointSelector
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.ttl_cache import TTLCache
+
+HANDSHAKE_INITIATION = b"\x01" + bytes(147)
+
+
+def build_selector(**kwargs):
+    # The stand-in servers are reached through the loopback interface.
+    return EndpointSelector(interface_getter=lambda: "lo", **kwargs)
+
+
+@pytest.fixture
+def blocked_port():
+    """Port bound to a socket that never answers."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        yield sock.getsockname()[1]
+
+
+@pytest.mark.asyncio
+async def test_select_port_returns_fastest_port(stand_in_servers, blocked_port):
+    selector = build_selector(timeout=1, network_id_getter=lambda: "wlan0/0101A8C0")
+    async with stand_in_servers() as start_server:
+        slow_port, _ = await start_server(delay=0.2)
+        fast_port, _ = await start_server(delay=0)
+
+        port = await selector.select_port(
+            "127.0.0.1", [blocked_port, slow_port, fast_port], lambda: HANDSHAKE_INITIATION
+        )
+
+    assert port == fast_port
+
+
+@pytest.mark.asyncio
+async def test_select_port_skips_race_when_port_is_cached_for_the_network(stand_in_servers):
+    selector = build_selector(timeout=1, network_id_getter=lambda: "wlan0/0101A8C0")
+    async with stand_in_servers() as start_server:
+        first_port, first_server = await start_server()
+        second_port, second_server = await start_server(delay=0.1)
+        ports = [first_port, second_port]
+        await selector.select_port("127.0.0.1", ports, lambda: HANDSHAKE_INITIATION)
+        first_server.received = second_server.received = 0
+
+        port = await selector.select_port("127.0.0.1", ports, lambda: HANDSHAKE_INITIATION)
+
+    assert port == first_port
+    assert first_server.received == second_server.received == 0
+
+
+@pytest.mark.asyncio
+async def test_select_port_races_again_on_a_different_network(stand_in_servers):
+    network_id = "wlan0/0101A8C0"
+    selector = build_selector(timeout=1, network_id_getter=lambda: network_id)
+    async with stand_in_servers() as start_server:
+        first_port, first_server = await start_server()
+        second_port, _ = await start_server()
+        ports = [first_port, second_port]
+        await selector.select_port("127.0.0.1", ports, lambda: HANDSHAKE_INITIATION)
+        first_server.received = 0
+
+        network_id = "eth0/0100000A"
+        await selector.select_port("127.0.0.1", ports, lambda: HANDSHAKE_INITIATION)
+
+    assert first_server.received == 1
+
+
+@pytest.mark.asyncio
+async def test_select_port_defaults_to_first_port_when_no_port_answers(blocked_port):
+    cache = TTLCache(ttl_in_secs=60)
+    selector = build_selector(timeout=0.1, cache=cache, network_id_getter=lambda: "wlan0")
+
+    port = await selector.select_port(
+        "127.0.0.1", [blocked_port, blocked_port + 1], lambda: HANDSHAKE_INITIATION
+    )
+
+    assert port == blocked_port
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_select_port_skips_race_when_it_failed_recently_on_the_network(stand_in_servers):
+    network_id = "wlan0/0101A8C0"
+    selector = build_selector(timeout=0.1, network_id_getter=lambda: network_id)
+    async with stand_in_servers() as start_server:
+        # The server only answers after the race timeout.
+        first_port, first_server = await start_server(delay=0.5)
+        second_port, _ = await start_server(delay=0.5)
+        ports = [first_port, second_port]
+        await selector.select_port("127.0.0.1", ports, lambda: HANDSHAKE_INITIATION)
+        first_server.received = 0
+
+        assert await selector.select_port(
+            "127.0.0.1", ports, lambda: HANDSHAKE_INITIATION
+        ) == first_port
+        assert first_server.received == 0
+
+        network_id = "eth0/0100000A"
+        await selector.select_port("127.0.0.1", ports, lambda: HANDSHAKE_INITIATION)
+
+    assert first_server.received == 1
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.instrumentation import \
+    ConnectionInstrumentation, ConnectionTimeline
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_timeline_records_phase_durations():
+    clock = FakeClock()
+    timeline = ConnectionTimeline("connection-id", clock=clock)
+
+    clock.now = 1.0
+    with timeline.measure("setup"):
+        clock.now = 1.5
+    clock.now = 3.0
+    timeline.mark("connected")
+
+    assert timeline.phases == ["setup", "connected"]
+    assert timeline.get_duration("setup") == 0.5
+    assert timeline.get_elapsed("connected") == 3.0
+    assert timeline.to_dict()["phases"]["setup"] == {"start": 1.0, "end": 1.5, "duration": 0.5}
+
+
+def test_timeline_accounts_for_all_attempts_of_retried_phases():
+    clock = FakeClock()
+    timeline = ConnectionTimeline(clock=clock)
+
+    with pytest.raises(OSError):
+        with timeline.measure("agent_connect"):
+            clock.now = 1.0
+            raise OSError("blip")
+    assert timeline.get_duration("agent_connect") is None
+
+    with timeline.measure("agent_connect"):
+        clock.now = 2.0
+
+    assert timeline.get_duration("agent_connect") == 2.0
+
+
+def test_instrumentation_computes_percentiles_and_dumps_them():
+    clock = FakeClock()
+    instrumentation = ConnectionInstrumentation(max_timelines=100, clock=clock)
+    for duration in range(1, 101):
+        clock.now = 0.0
+        timeline = instrumentation.new_timeline()
+        timeline.start("activation")
+        clock.now = duration / 100
+        timeline.finish("activation")
+
+    assert instrumentation.get_percentiles("activation", (50, 99)) == {50: 0.5, 99: 0.99}
+    assert instrumentation.get_percentiles("connected") == {}
+    assert len(json.loads(instrumentation.to_json())) == 100
+    prometheus = instrumentation.to_prometheus().splitlines()
+    metric = ConnectionInstrumentation.PROMETHEUS_METRIC
+    assert f'{metric}{{phase="activation",quantile="0.5"}} 0.5' in prometheus
+    assert f'{metric}_count{{phase="activation"}} 100' in prometheus
+
+
+def test_instrumentation_only_keeps_the_most_recent_timelines():
+    instrumentation = ConnectionInstrumentation(max_timelines=2)
+
+    timelines = [instrumentation.new_timeline(str(i)) for i in range(3)]
+
+    assert instrumentation.timelines == timelines[1:]
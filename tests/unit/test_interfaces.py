@@ -0,0 +1,49 @@
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.interfaces import \
+    InterfaceAllocator, TunnelSlot
+
+
+def test_lowest_free_interface_is_allocated():
+    allocator = InterfaceAllocator()
+    first, second, third = object(), object(), object()
+
+    assert allocator.allocate(first).interface_name == "proton0"
+    assert allocator.allocate(second).interface_name == "proton1"
+    allocator.release(first)
+
+    assert allocator.allocate(third).interface_name == "proton0"
+
+
+def test_owner_keeps_its_interface_when_allocating_again():
+    allocator = InterfaceAllocator()
+    owner = object()
+
+    assert allocator.allocate(owner) == allocator.allocate(owner)
+    assert len(allocator) == 1
+
+
+def test_reserving_an_interface_hands_it_over():
+    allocator = InterfaceAllocator()
+    previous, new = object(), object()
+    slot = allocator.allocate(previous)
+    allocator.allocate(new)
+
+    allocator.reserve(slot, new)
+
+    assert allocator.get_slot(new) == slot
+    assert allocator.get_slot(previous) is None
+    assert len(allocator) == 1
+
+
+def test_each_tunnel_has_its_own_fwmark_and_routing_table():
+    slots = [TunnelSlot(index) for index in range(4)]
+
+    assert len({slot.fwmark for slot in slots}) == 4
+    assert len({slot.route_table for slot in slots}) == 4
+    assert len({slot.routing_rule_priority for slot in slots}) == 4
+
+
+def test_slot_is_found_from_its_interface_name():
+    assert TunnelSlot.from_interface_name("proton2") == TunnelSlot(2)
+    assert TunnelSlot.from_interface_name("proton") is None
+    assert TunnelSlot.from_interface_name("wlan0") is None
+    assert TunnelSlot.from_interface_name(None) is None
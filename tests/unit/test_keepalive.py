@@ -0,0 +1,115 @@
+from unittest.mock import Mock
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.keepalive import \
+    KeepaliveController
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.telemetry import \
+    InterfaceCounters, TunnelStats
+
+
+def sample(timestamp, rx_bytes, tx_bytes, handshake_age=None):
+    return TunnelStats(
+        timestamp=timestamp,
+        counters=InterfaceCounters(
+            rx_bytes=rx_bytes, tx_bytes=tx_bytes, rx_packets=0, tx_packets=0
+        ),
+        handshake_age=handshake_age
+    )
+
+
+def receive_after_idle(controller, idle_period):
+    """Feeds an idle period followed by traffic initiated by the server."""
+    controller(sample(0, rx_bytes=100, tx_bytes=100))
+    controller(sample(idle_period, rx_bytes=100, tx_bytes=100))
+    controller(sample(idle_period + 1, rx_bytes=200, tx_bytes=100))
+
+
+def resume_after_idle(controller, idle_period, handshake_age, stall, new_handshake=True):
+    """
+    Feeds an idle period after which the client sends packets which are
+    only answered after the stall.
+    """
+    controller(sample(0, rx_bytes=100, tx_bytes=100, handshake_age=handshake_age))
+    controller(sample(
+        idle_period, rx_bytes=100, tx_bytes=100, handshake_age=handshake_age + idle_period
+    ))
+    for second in range(1, int(stall)):
+        controller(sample(
+            idle_period + second, rx_bytes=100, tx_bytes=100 + second,
+            handshake_age=handshake_age + idle_period + second
+        ))
+    controller(sample(
+        idle_period + stall, rx_bytes=200, tx_bytes=300,
+        handshake_age=1 if new_handshake else handshake_age + idle_period + stall
+    ))
+
+
+def test_keepalive_is_disabled_until_a_binding_expires():
+    on_interval_changed = Mock()
+    controller = KeepaliveController(on_interval_changed)
+
+    receive_after_idle(controller, idle_period=120)
+
+    assert controller.interval == 0
+    on_interval_changed.assert_not_called()
+
+
+def test_stall_when_traffic_resumes_after_idle_is_not_a_binding_expiry():
+    on_interval_changed = Mock()
+    controller = KeepaliveController(on_interval_changed)
+
+    resume_after_idle(controller, idle_period=60, handshake_age=5, stall=20, new_handshake=False)
+
+    assert controller.nat_timeout is None
+    on_interval_changed.assert_not_called()
+
+
+def test_keepalive_is_enabled_before_the_nat_timeout_once_a_binding_expired():
+    on_interval_changed = Mock()
+    controller = KeepaliveController(on_interval_changed)
+
+    # Packets sent after the idle period are only answered after a new handshake.
+    resume_after_idle(controller, idle_period=60, handshake_age=5, stall=16)
+
+    assert controller.nat_timeout == 60
+    on_interval_changed.assert_called_once_with(48)
+
+
+def test_handshake_renewing_due_session_keys_is_not_a_binding_expiry():
+    on_interval_changed = Mock()
+    controller = KeepaliveController(on_interval_changed)
+
+    resume_after_idle(controller, idle_period=60, handshake_age=70, stall=16)
+
+    assert controller.nat_timeout is None
+    on_interval_changed.assert_not_called()
+
+
+def test_short_stall_followed_by_a_handshake_is_not_a_binding_expiry():
+    on_interval_changed = Mock()
+    controller = KeepaliveController(on_interval_changed)
+
+    resume_after_idle(controller, idle_period=60, handshake_age=5, stall=2)
+
+    assert controller.nat_timeout is None
+    on_interval_changed.assert_not_called()
+
+
+def test_keepalive_is_disabled_when_a_binding_outlives_the_learned_nat_timeout():
+    on_interval_changed = Mock()
+    controller = KeepaliveController(on_interval_changed)
+    controller.reset(nat_timeout=30)
+    assert controller.interval == 24
+
+    receive_after_idle(controller, idle_period=45)
+
+    on_interval_changed.assert_called_once_with(0)
+
+
+def test_short_idle_periods_are_ignored():
+    on_interval_changed = Mock()
+    controller = KeepaliveController(on_interval_changed, min_idle_period_in_secs=20)
+    controller.reset(nat_timeout=5)
+
+    receive_after_idle(controller, idle_period=10)
+
+    on_interval_changed.assert_not_called()
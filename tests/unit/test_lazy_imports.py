@@ -0,0 +1,71 @@
+import subprocess
+import sys
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard import local_agent
+
+PACKAGE = "proton.vpn.backend.linux.networkmanager.protocol.wireguard"
+
+# Modules which are slow to import and are only needed once a connection is built.
+DEFERRED_MODULES = (
+    "gi.repository.NM",
+    "proton.vpn.local_agent",
+    f"{PACKAGE}.wireguard",
+    f"{PACKAGE}.local_agent.external_local_agent",
+    f"{PACKAGE}.local_agent.fallback_local_agent",
+)
+
+IMPORT_PACKAGES = f"""
+import sys
+import {PACKAGE}
+import {PACKAGE}.local_agent
+print(",".join(module for module in {DEFERRED_MODULES!r} if module in sys.modules))
+"""
+
+LOCAL_AGENT_IMPLEMENTATIONS = (
+    "proton.vpn.local_agent",
+    f"{PACKAGE}.local_agent.external_local_agent",
+    f"{PACKAGE}.local_agent.fallback_local_agent",
+)
+
+IMPORT_BACKEND_CLASS = f"""
+import sys
+from {PACKAGE}.wireguard import Wireguard
+print(",".join(module for module in {LOCAL_AGENT_IMPLEMENTATIONS!r} if module in sys.modules))
+"""
+
+
+def test_importing_the_package_does_not_load_deferred_modules():
+    # A new interpreter is used so that no module is already cached.
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PACKAGES], check=True, capture_output=True, text=True
+    ).stdout
+
+    assert output.strip() == ""
+
+
+def test_importing_the_backend_class_does_not_load_the_local_agent():
+    # The backend class needs the base connection packages and NM, which is
+    # loaded by its LinuxNetworkManager base class anyway. Only the local
+    # agent is deferred.
+    pytest.importorskip("proton.vpn.connection")
+    pytest.importorskip("gi")
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_BACKEND_CLASS], check=True, capture_output=True, text=True
+    ).stdout
+
+    assert output.strip() == ""
+
+
+def test_local_agent_implementation_is_selected_on_first_access():
+    state = local_agent.State
+
+    assert state.__module__.endswith(("external_local_agent", "fallback_local_agent"))
+    # Names are cached on the package once the implementation was selected.
+    assert vars(local_agent)["AgentConnector"] is local_agent.AgentConnector
+
+
+def test_local_agent_raises_attribute_error_on_unknown_names():
+    with pytest.raises(AttributeError):
+        local_agent.UnknownName
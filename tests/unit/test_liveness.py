@@ -0,0 +1,78 @@
+from unittest.mock import Mock
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.liveness import LivenessMonitor
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.telemetry import \
+    InterfaceCounters, TunnelStats
+
+
+def sample(timestamp, rx_bytes, tx_bytes, handshake_age=None):
+    return TunnelStats(
+        timestamp=timestamp,
+        counters=InterfaceCounters(
+            rx_bytes=rx_bytes, tx_bytes=tx_bytes, rx_packets=0, tx_packets=0
+        ),
+        handshake_age=handshake_age
+    )
+
+
+def test_rx_stall_while_sending_is_notified_once():
+    on_dead_tunnel = Mock()
+    monitor = LivenessMonitor(on_dead_tunnel, rx_stall_timeout_in_secs=5)
+
+    for second in range(10):
+        monitor(sample(second, rx_bytes=100, tx_bytes=100 * second))
+
+    on_dead_tunnel.assert_called_once()
+    assert "nothing received" in on_dead_tunnel.call_args.args[0]
+    assert monitor.is_dead
+
+
+def test_monitor_is_rearmed_when_traffic_is_received_again():
+    on_dead_tunnel = Mock()
+    monitor = LivenessMonitor(on_dead_tunnel, rx_stall_timeout_in_secs=1)
+
+    monitor(sample(0, rx_bytes=100, tx_bytes=100))
+    monitor(sample(1, rx_bytes=100, tx_bytes=200))
+    monitor(sample(3, rx_bytes=100, tx_bytes=300))
+    monitor(sample(4, rx_bytes=200, tx_bytes=400))
+    assert not monitor.is_dead
+    monitor(sample(5, rx_bytes=200, tx_bytes=500))
+    monitor(sample(7, rx_bytes=200, tx_bytes=600))
+
+    assert on_dead_tunnel.call_count == 2
+
+
+def test_stale_handshake_while_sending_is_notified():
+    on_dead_tunnel = Mock()
+    monitor = LivenessMonitor(
+        on_dead_tunnel, handshake_timeout_in_secs=150, handshake_grace_in_secs=10
+    )
+
+    monitor(sample(0, rx_bytes=100, tx_bytes=100, handshake_age=149))
+    monitor(sample(1, rx_bytes=100, tx_bytes=200, handshake_age=150))
+    monitor(sample(12, rx_bytes=100, tx_bytes=300, handshake_age=161))
+
+    assert "no handshake" in on_dead_tunnel.call_args.args[0]
+
+
+def test_idle_tunnel_is_not_considered_dead():
+    on_dead_tunnel = Mock()
+    monitor = LivenessMonitor(on_dead_tunnel, rx_stall_timeout_in_secs=1)
+
+    for second in range(10):
+        monitor(sample(second, rx_bytes=100, tx_bytes=100, handshake_age=300 + second))
+
+    on_dead_tunnel.assert_not_called()
+
+
+def test_traffic_resuming_after_an_idle_period_is_not_a_stall():
+    on_dead_tunnel = Mock()
+    monitor = LivenessMonitor(on_dead_tunnel, rx_stall_timeout_in_secs=15)
+
+    monitor(sample(0, rx_bytes=100, tx_bytes=100, handshake_age=10))
+    monitor(sample(300, rx_bytes=100, tx_bytes=100, handshake_age=310))
+    # Wireguard handshakes again before the first packets are answered.
+    monitor(sample(301, rx_bytes=100, tx_bytes=200, handshake_age=311))
+    monitor(sample(302, rx_bytes=300, tx_bytes=300, handshake_age=1))
+
+    on_dead_tunnel.assert_not_called()
@@ -0,0 +1,190 @@
+import asyncio
+import socket
+from contextlib import asynccontextmanager
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.mtu import \
+    MIN_PATH_MTU, PROBE_HEADERS_SIZE, PathMtuDiscovery, get_tunnel_mtu, probe_udp_echo
+
+NETWORK_ID = "wlan0/0101A8C0"
+
+
+class StandInPath(asyncio.DatagramProtocol):
+    """
+    Echoes datagrams back, dropping the ones which would not fit the
+    simulated path MTU.
+    """
+
+    def __init__(self, mtu: int):
+        self.mtu = mtu
+        self.received = 0
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        if len(data) + PROBE_HEADERS_SIZE <= self.mtu:
+            self.transport.sendto(data, addr)
+
+
+@pytest.fixture
+def stand_in_paths():
+    """
+    Returns an async context manager yielding a function to start local
+    path stand-ins, which are stopped when exiting the context.
+    """
+    @asynccontextmanager
+    async def _stand_in_paths():
+        transports = []
+
+        async def start_path(mtu: int):
+            loop = asyncio.get_running_loop()
+            transport, path = await loop.create_datagram_endpoint(
+                lambda: StandInPath(mtu), local_addr=("127.0.0.1", 0)
+            )
+            transports.append(transport)
+            return transport.get_extra_info("sockname")[1], path
+
+        try:
+            yield start_path
+        finally:
+            for transport in transports:
+                transport.close()
+
+    return _stand_in_paths
+
+
+def build_discovery(port, network_id_getter=lambda: NETWORK_ID, interface="lo"):
+    timeout = 0.05
+    return PathMtuDiscovery(
+        probe=lambda host, size, interface: probe_udp_echo(host, port, size, timeout, interface),
+        timeout=timeout,
+        network_id_getter=network_id_getter,
+        route_mtu_getter=lambda host, interface: 1500,
+        interface_getter=lambda: interface
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mtu", [MIN_PATH_MTU, 1420, 1499])
+async def test_discover_finds_the_path_mtu(stand_in_paths, mtu):
+    async with stand_in_paths() as start_path:
+        port, _ = await start_path(mtu)
+
+        assert await build_discovery(port).discover("127.0.0.1") == mtu
+
+
+@pytest.mark.asyncio
+async def test_discover_probes_the_route_mtu_first(stand_in_paths):
+    async with stand_in_paths() as start_path:
+        port, path = await start_path(1500)
+
+        assert await build_discovery(port).discover("127.0.0.1") == 1500
+
+    assert path.received == 1
+
+
+@pytest.mark.asyncio
+async def test_discover_skips_probes_when_mtu_is_cached_for_the_network(stand_in_paths):
+    network_id = NETWORK_ID
+    async with stand_in_paths() as start_path:
+        port, path = await start_path(1400)
+        discovery = build_discovery(port, network_id_getter=lambda: network_id)
+        await discovery.discover("127.0.0.1")
+        path.received = 0
+
+        assert await discovery.discover("127.0.0.1") == 1400
+        assert path.received == 0
+
+        network_id = "eth0/0100000A"
+        await discovery.discover("127.0.0.1")
+
+    assert path.received > 0
+
+
+@pytest.mark.asyncio
+async def test_discover_returns_none_when_probes_are_not_answered():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        discovery = build_discovery(sock.getsockname()[1])
+
+        assert await discovery.discover("127.0.0.1") is None
+
+
+@pytest.mark.asyncio
+async def test_discover_skips_probes_when_it_failed_recently_on_the_network(stand_in_paths):
+    network_id = NETWORK_ID
+    async with stand_in_paths() as start_path:
+        # Probes are never answered.
+        port, path = await start_path(0)
+        discovery = build_discovery(port, network_id_getter=lambda: network_id)
+        assert await discovery.discover("127.0.0.1") is None
+        path.received = 0
+
+        assert await discovery.discover("127.0.0.1") is None
+        assert path.received == 0
+
+        network_id = "eth0/0100000A"
+        await discovery.discover("127.0.0.1")
+
+    assert path.received > 0
+
+
+@pytest.mark.asyncio
+async def test_discover_fails_when_the_path_mtu_is_below_the_minimum(stand_in_paths):
+    async with stand_in_paths() as start_path:
+        # E.g. large probes being lost on a lossy path.
+        port, path = await start_path(1000)
+        discovery = build_discovery(port)
+        assert await discovery.discover("127.0.0.1") is None
+        path.received = 0
+
+        assert await discovery.discover("127.0.0.1") is None
+
+    assert path.received == 0
+
+
+@pytest.mark.asyncio
+async def test_discover_gives_up_after_the_maximum_discovery_time():
+    async def probe(host, size, interface):
+        await asyncio.sleep(1)
+        return True
+
+    discovery = PathMtuDiscovery(
+        probe=probe, max_discovery_time=0.1, network_id_getter=lambda: NETWORK_ID,
+        route_mtu_getter=lambda host, interface: 1500, interface_getter=lambda: None
+    )
+
+    assert await asyncio.wait_for(discovery.discover("127.0.0.1"), 0.5) is None
+    # The failure is cached, so the next connection is not delayed again.
+    assert await asyncio.wait_for(discovery.discover("127.0.0.1"), 0.01) is None
+
+
+@pytest.mark.asyncio
+async def test_discover_returns_none_when_probes_cannot_be_sent():
+    async def probe(host, size, interface):
+        raise PermissionError("ICMP sockets are not allowed.")
+
+    discovery = PathMtuDiscovery(
+        probe=probe, network_id_getter=lambda: NETWORK_ID, interface_getter=lambda: None
+    )
+
+    assert await discovery.discover("127.0.0.1") is None
+
+
+@pytest.mark.asyncio
+async def test_discover_sends_probes_through_the_default_route_interface(stand_in_paths):
+    async with stand_in_paths() as start_path:
+        port, path = await start_path(1500)
+        discovery = build_discovery(port, interface="nonexistent0")
+
+        assert await discovery.discover("127.0.0.1") is None
+
+    assert path.received == 0
+
+
+def test_tunnel_mtu_leaves_room_for_the_wireguard_headers():
+    assert get_tunnel_mtu(1500) == 1440
@@ -0,0 +1,32 @@
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.network import \
+    get_default_interface, get_network_id
+
+ROUTES_HEADER = "Iface\tDestination\tGateway\tFlags\tRefCnt\tUse\tMetric\tMask\tMTU\tWindow\tIRTT\n"
+
+
+def write_routes(tmp_path, *routes):
+    routes_path = tmp_path / "route"
+    routes_path.write_text(ROUTES_HEADER + "".join(
+        f"{iface}\t{destination}\t{gateway}\t0003\t0\t0\t{metric}\t00000000\t0\t0\t0\n"
+        for iface, destination, gateway, metric in routes
+    ))
+    return str(routes_path)
+
+
+def test_default_route_with_the_lowest_metric_is_used(tmp_path):
+    routes_path = write_routes(
+        tmp_path,
+        ("wlan0", "00000000", "0101A8C0", 600),
+        ("eth0", "0000A8C0", "00000000", 100),
+        ("eth0", "00000000", "0100000A", 100),
+    )
+
+    assert get_network_id(routes_path) == "eth0/0100000A"
+    assert get_default_interface(routes_path) == "eth0"
+
+
+def test_network_id_is_none_without_default_route(tmp_path):
+    routes_path = write_routes(tmp_path, ("eth0", "0000A8C0", "00000000", 100))
+
+    assert get_network_id(routes_path) is None
+    assert get_default_interface(routes_path) is None
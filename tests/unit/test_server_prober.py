@@ -0,0 +1,99 @@
+import asyncio
+from unittest.mock import Mock
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.server_prober import \
+    ServerProber, ServerProbeResult
+
+SERVER_PUBLIC_KEY = "b8RgyHBpUjFi+ERdjQ0YfbCquAHvfKipZWW0zqrAzKs="
+CLIENT_PRIVATE_KEY = "8tXqsp7btfleug3oq+v4Sv9ABLwvmvt0DYyp+S6ENMU="
+
+
+def create_server(name: str, port: int) -> Mock:
+    server = Mock()
+    server.name = name
+    server.server_ip = "127.0.0.1"
+    server.wireguard_ports.udp = [port]
+    server.x25519pk = SERVER_PUBLIC_KEY
+    return server
+
+
+def create_prober(**kwargs) -> ServerProber:
+    # The stand-in servers are reached through the loopback interface.
+    kwargs.setdefault("interface_getter", lambda: "lo")
+    return ServerProber(timeout=0.3, network_id_getter=lambda: "wlan0", **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_probe_ranks_servers_by_loss_and_round_trip_time(stand_in_servers):
+    prober = create_prober()
+    async with stand_in_servers() as start_server:
+        slow_port, _ = await start_server(delay=0.05)
+        fast_port, _ = await start_server(delay=0)
+        lossy_port, _ = await start_server(delay=0, loss=0.5)
+        servers = [
+            create_server("lossy", lossy_port),
+            create_server("slow", slow_port),
+            create_server("fast", fast_port),
+        ]
+
+        results = await prober.probe(servers, CLIENT_PRIVATE_KEY)
+
+    assert [result.server.name for result in results] == ["fast", "slow", "lossy"]
+    assert results[0].loss == 0
+    assert results[0].rtt < results[1].rtt
+    assert 0 < results[2].loss < 1
+
+
+@pytest.mark.asyncio
+async def test_probe_reports_full_loss_for_unreachable_servers(stand_in_servers):
+    prober = create_prober(attempts=2)
+    async with stand_in_servers() as start_server:
+        port, server = await start_server(delay=0, loss=1)
+
+        result, = await prober.probe([create_server("dead", port)], CLIENT_PRIVATE_KEY)
+
+    assert server.received == 2
+    assert result.loss == 1
+    assert result.rtt is None
+
+
+@pytest.mark.asyncio
+async def test_probe_limits_the_number_of_concurrent_probes(stand_in_servers):
+    prober = create_prober(attempts=1, max_concurrent_probes=2)
+    async with stand_in_servers() as start_server:
+        stand_ins = [await start_server(delay=0.1) for _ in range(4)]
+        servers = [create_server(str(port), port) for port, _ in stand_ins]
+
+        probe = asyncio.ensure_future(prober.probe(servers, CLIENT_PRIVATE_KEY))
+        await asyncio.sleep(0.05)
+        probes_in_flight = sum(server.received for _, server in stand_ins)
+        await probe
+
+    assert probes_in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_probe_sends_handshakes_through_the_default_route_interface(stand_in_servers):
+    prober = create_prober(attempts=1, interface_getter=lambda: "nonexistent0")
+    async with stand_in_servers() as start_server:
+        port, server = await start_server()
+
+        result, = await prober.probe([create_server("server", port)], CLIENT_PRIVATE_KEY)
+
+    assert result.loss == 1
+    assert server.received == 0
+
+
+def test_get_fastest_server_returns_the_best_cached_result():
+    fast_server, slow_server = Mock(server_ip="10.0.0.1"), Mock(server_ip="10.0.0.2")
+    prober = create_prober()
+    prober._cache.set(("wlan0", "10.0.0.1"), ServerProbeResult(fast_server, 2, [0.01, 0.02]))
+    prober._cache.set(("wlan0", "10.0.0.2"), ServerProbeResult(slow_server, 2, [0.05, 0.06]))
+
+    assert prober.get_fastest_server([slow_server, fast_server]) is fast_server
+
+
+def test_get_fastest_server_returns_none_when_no_server_was_probed():
+    assert create_prober().get_fastest_server([Mock(server_ip="10.0.0.1")]) is None
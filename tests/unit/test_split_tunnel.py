@@ -0,0 +1,77 @@
+import ipaddress
+import random
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.split_tunnel import \
+    SplitTunneling, compute_allowed_ips, merge, subtract, to_intervals
+
+
+def covered_addresses(networks, sample):
+    networks = [ipaddress.ip_network(network) for network in networks]
+    return {address for address in sample if any(address in network for network in networks)}
+
+
+def test_merge_joins_overlapping_and_adjacent_intervals():
+    assert merge([(10, 20), (0, 5), (6, 8), (15, 30), (40, 50)]) == [(0, 8), (10, 30), (40, 50)]
+
+
+def test_subtract_splits_intervals_around_the_excluded_ones():
+    intervals = [(0, 100), (200, 300)]
+    excluded = [(10, 20), (50, 250), (290, 400)]
+
+    assert subtract(intervals, excluded) == [(0, 9), (21, 49), (251, 289)]
+
+
+def test_all_addresses_are_allowed_when_nothing_is_excluded():
+    assert compute_allowed_ips(SplitTunneling()) == ("0.0.0.0/0",)
+
+
+def test_excluding_a_network_yields_its_minimal_complement():
+    allowed_ips = compute_allowed_ips(SplitTunneling(exclude=["10.0.0.0/8"]))
+
+    assert allowed_ips == (
+        "0.0.0.0/5", "8.0.0.0/7", "11.0.0.0/8", "12.0.0.0/6", "16.0.0.0/4",
+        "32.0.0.0/3", "64.0.0.0/2", "128.0.0.0/1"
+    )
+
+
+def test_adjacent_included_networks_are_compacted():
+    split_tunneling = SplitTunneling(include=["192.168.0.0/25", "192.168.0.128/25"])
+
+    assert compute_allowed_ips(split_tunneling) == ("192.168.0.0/24",)
+
+
+def test_vpn_server_is_excluded_and_dns_server_is_included():
+    split_tunneling = SplitTunneling(include=["185.0.0.0/8"], exclude=["10.0.0.0/8"])
+
+    allowed_ips = compute_allowed_ips(
+        split_tunneling, always_include=("10.2.0.1",), always_exclude=("185.159.157.1",)
+    )
+
+    addresses = [ipaddress.ip_address(a) for a in ("10.2.0.1", "185.159.157.1", "185.159.157.2")]
+    assert covered_addresses(allowed_ips, addresses) == {addresses[0], addresses[2]}
+
+
+def test_ipv6_networks_are_rejected():
+    with pytest.raises(ValueError):
+        to_intervals(["2001:db8::/32"])
+
+
+def test_allowed_ips_cover_exactly_the_included_minus_the_excluded_addresses():
+    rng = random.Random(42)
+
+    def random_networks(count):
+        return [
+            str(ipaddress.ip_network((rng.getrandbits(32), rng.randint(8, 24)), strict=False))
+            for _ in range(count)
+        ]
+
+    include, exclude = random_networks(50), random_networks(50)
+    sample = [ipaddress.ip_address(rng.getrandbits(32)) for _ in range(2000)]
+    sample += [ipaddress.ip_network(network).network_address for network in include + exclude]
+
+    allowed_ips = compute_allowed_ips(SplitTunneling(include=include, exclude=exclude))
+
+    expected = covered_addresses(include, sample) - covered_addresses(exclude, sample)
+    assert covered_addresses(allowed_ips, sample) == expected
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.state_bridge import \
+    StateChangeBridge, StateTransition, collapse
+
+ACTIVATED = "activated"
+DEACTIVATED = "deactivated"
+
+
+def supersedes(earlier, later):
+    return later.state == earlier.state or (
+        earlier.state == ACTIVATED and later.state == DEACTIVATED
+    )
+
+
+def transition(state):
+    return StateTransition(state=state, reason=None, queued_at=0)
+
+
+@pytest.mark.parametrize("states, expected_states", [
+    ([ACTIVATED, DEACTIVATED], [DEACTIVATED]),
+    ([DEACTIVATED, ACTIVATED], [DEACTIVATED, ACTIVATED]),
+    ([ACTIVATED, ACTIVATED, ACTIVATED], [ACTIVATED]),
+    ([DEACTIVATED, ACTIVATED, DEACTIVATED], [DEACTIVATED]),
+])
+def test_collapse_drops_superseded_transitions(states, expected_states):
+    collapsed = collapse([transition(state) for state in states], supersedes)
+
+    assert [t.state for t in collapsed] == expected_states
+
+
+@pytest.mark.asyncio
+async def test_transitions_queued_from_another_thread_are_drained_in_a_single_batch():
+    handled = []
+    bridge = StateChangeBridge(
+        asyncio.get_running_loop(), lambda t: handled.append(t.state), supersedes
+    )
+
+    def put_transitions():
+        bridge.put(ACTIVATED, None)
+        bridge.put(DEACTIVATED, None)
+
+    thread = threading.Thread(target=put_transitions)
+    thread.start()
+    thread.join()
+    await asyncio.sleep(0)
+
+    assert handled == [DEACTIVATED]
+    assert bridge.metrics.batches == 1
+    assert bridge.metrics.received == 2
+    assert bridge.metrics.collapsed == 1
+    assert bridge.metrics.handled == 1
+
+
+@pytest.mark.asyncio
+async def test_queue_latency_is_recorded():
+    clock = Mock(side_effect=[0.0, 1.0, 3.0])
+    bridge = StateChangeBridge(asyncio.get_running_loop(), Mock(), clock=clock)
+
+    bridge.put(ACTIVATED, None)  # Queued at 0.
+    bridge.put(DEACTIVATED, None)  # Queued at 1.
+    await asyncio.sleep(0)  # Drained at 3.
+
+    assert bridge.metrics.max_latency == 3.0
+    assert bridge.metrics.last_latency == 2.0
+    assert bridge.metrics.mean_latency == 2.5
+    assert bridge.metrics.max_batch_size == 2
+
+
+@pytest.mark.asyncio
+async def test_handler_errors_do_not_prevent_handling_the_next_transitions():
+    handler = Mock(side_effect=[RuntimeError("Expected error"), None])
+    bridge = StateChangeBridge(asyncio.get_running_loop(), handler)
+
+    bridge.put(DEACTIVATED, None)
+    bridge.put(ACTIVATED, None)
+    await asyncio.sleep(0)
+
+    assert handler.call_count == 2
@@ -0,0 +1,136 @@
+import asyncio
+import struct
+from unittest.mock import Mock
+
+import pytest
+
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard import telemetry
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.telemetry import \
+    SysfsStatsReader, TunnelTelemetry, parse_last_handshake
+
+INTERFACE = "proton0"
+
+
+class FakeSysfs:
+    def __init__(self, root):
+        self.root = root
+        (root / INTERFACE / "statistics").mkdir(parents=True)
+        self.write(rx_bytes=0, tx_bytes=0)
+
+    def write(self, rx_bytes, tx_bytes):
+        counters = {"rx_bytes": rx_bytes, "tx_bytes": tx_bytes, "rx_packets": 0, "tx_packets": 0}
+        for counter, value in counters.items():
+            (self.root / INTERFACE / "statistics" / counter).write_text(f"{value}\n")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+    return FakeSysfs(tmp_path)
+
+
+def test_poll_publishes_rolling_throughput_and_handshake_age(sysfs):
+    clock = FakeClock()
+    handshake_reader = Mock()
+    handshake_reader.read_last_handshake.return_value = 1000.0
+    tunnel_telemetry = TunnelTelemetry(
+        stats_reader=SysfsStatsReader(str(sysfs.root)), handshake_reader=handshake_reader,
+        window_size=3, clock=clock, wall_clock=lambda: 1030.0
+    )
+    tunnel_telemetry._interface = INTERFACE
+
+    first_stats = tunnel_telemetry.poll()
+    for rx_bytes in (1000, 3000, 6000):
+        clock.now += 1
+        sysfs.write(rx_bytes=rx_bytes, tx_bytes=rx_bytes // 2)
+        stats = tunnel_telemetry.poll()
+
+    assert first_stats.rx_rate is None
+    # The window only holds the last 3 samples.
+    assert stats.rx_rate == (6000 - 1000) / 2
+    assert stats.tx_rate == (3000 - 500) / 2
+    assert stats.handshake_age == 30.0
+    assert tunnel_telemetry.latest is stats
+
+
+@pytest.mark.asyncio
+async def test_subscribers_are_notified_until_telemetry_is_stopped(sysfs):
+    subscriber = Mock()
+    handshake_reader = Mock()
+    handshake_reader.read_last_handshake.return_value = None
+    tunnel_telemetry = TunnelTelemetry(
+        stats_reader=SysfsStatsReader(str(sysfs.root)), handshake_reader=handshake_reader,
+        poll_interval_in_secs=0.01
+    )
+    tunnel_telemetry.subscribe(subscriber)
+
+    tunnel_telemetry.start(INTERFACE)
+    await asyncio.sleep(0.05)
+    tunnel_telemetry.stop()
+    calls = subscriber.call_count
+    await asyncio.sleep(0.05)
+
+    assert calls >= 2
+    assert subscriber.call_count == calls
+    assert subscriber.call_args.args[0].handshake_age is None
+
+
+def test_poll_interval_backs_off_while_the_tunnel_is_idle(sysfs):
+    handshake_reader = Mock()
+    handshake_reader.read_last_handshake.return_value = None
+    tunnel_telemetry = TunnelTelemetry(
+        stats_reader=SysfsStatsReader(str(sysfs.root)), handshake_reader=handshake_reader,
+        poll_interval_in_secs=1, max_poll_interval_in_secs=4
+    )
+    tunnel_telemetry._interface = INTERFACE
+
+    intervals = []
+    interval = 1
+    for rx_bytes in (0, 0, 0, 0, 0, 100):
+        sysfs.write(rx_bytes=rx_bytes, tx_bytes=0)
+        tunnel_telemetry.poll()
+        interval = tunnel_telemetry._get_next_poll_interval(interval)
+        intervals.append(interval)
+
+    assert intervals == [1, 2, 4, 4, 4, 1]
+
+
+@pytest.mark.asyncio
+async def test_handshake_reader_is_closed_when_telemetry_is_stopped(sysfs):
+    handshake_reader = Mock()
+    handshake_reader.read_last_handshake.return_value = None
+    tunnel_telemetry = TunnelTelemetry(
+        stats_reader=SysfsStatsReader(str(sysfs.root)), handshake_reader=handshake_reader,
+        poll_interval_in_secs=0.01
+    )
+
+    tunnel_telemetry.start(INTERFACE)
+    await asyncio.sleep(0.05)
+    tunnel_telemetry.stop()
+    await asyncio.sleep(0)
+
+    handshake_reader.close.assert_called_once()
+
+
+def test_parse_last_handshake_returns_latest_peer_handshake():
+    def peer(seconds, nanoseconds):
+        return telemetry._attribute(
+            telemetry._WGPEER_A_LAST_HANDSHAKE_TIME, struct.pack("=qq", seconds, nanoseconds)
+        )
+
+    peers = telemetry._attribute(0, peer(100, 500_000_000)) + telemetry._attribute(1, peer(0, 0))
+    payload = (
+        struct.pack("=BBH", 0, 1, 0)
+        + telemetry._attribute(telemetry._WGDEVICE_A_IFNAME, b"proton0\0")
+        + telemetry._attribute(telemetry._WGDEVICE_A_PEERS | 0x8000, peers)
+    )
+
+    assert parse_last_handshake(payload) == 100.5
+    assert parse_last_handshake(struct.pack("=BBH", 0, 1, 0)) is None
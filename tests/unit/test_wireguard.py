@@ -0,0 +1,455 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+
+# The connections are built with the NM GObject introspection bindings.
+gi = pytest.importorskip("gi")
+gi.require_version("NM", "1.0")
+
+from gi.repository import NM
+
+from proton.vpn.connection import states
+from proton.vpn.backend.linux.networkmanager.core import LinuxNetworkManager
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard import Wireguard, local_agent
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.agent_state_cache import \
+    AgentStateCache
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.interfaces import \
+    InterfaceAllocator, TunnelSlot
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.mtu import PathMtuDiscovery
+from proton.vpn.backend.linux.networkmanager.protocol.wireguard.split_tunnel import \
+    SplitTunneling
+
+SERVER_PUBLIC_KEY = "b8RgyHBpUjFi+ERdjQ0YfbCquAHvfKipZWW0zqrAzKs="
+CLIENT_PRIVATE_KEY = "8tXqsp7btfleug3oq+v4Sv9ABLwvmvt0DYyp+S6ENMU="
+
+# Time NM is assumed to take to reapply a profile on a device.
+REAPPLY_LATENCY_IN_SECS = 0.05
+# MTU of the tunnel of the previous connection.
+ACTIVE_TUNNEL_MTU = 1380
+
+
+class MockedNMClient:
+    """NM client where the previous connection is active on a device."""
+
+    def __init__(self):
+        self.active_connection = Mock()
+        self.device = Mock()
+        self.remote_connection = self.active_connection.get_connection.return_value
+        self.active_connection.get_devices.return_value = [self.device]
+        self.remote_connection.get_setting_by_name.return_value.get_mtu.return_value = \
+            ACTIVE_TUNNEL_MTU
+        # Settings of the active profile.
+        self.profile = None
+        self.remote_connection.to_dbus.side_effect = lambda flags: self.profile.to_dbus(flags)
+        self._nm_client = Mock()
+        self._nm_client.get_active_connections.return_value = [self.active_connection]
+
+        def update2(settings, flags, args, cancellable, callback, user_data):
+            callback(self.remote_connection, Mock(), user_data)
+
+        def reapply_async(connection, version_id, flags, cancellable, callback, user_data):
+            time.sleep(REAPPLY_LATENCY_IN_SECS)
+            callback(self.device, Mock(), user_data)
+
+        self.remote_connection.update2.side_effect = update2
+        self.device.reapply_async.side_effect = reapply_async
+
+    def _run_on_glib_loop_thread(self, function):
+        threading.Thread(target=function).start()
+
+
+def build_wireguard(nm_client=None, **kwargs) -> Wireguard:
+    """
+    Builds a Wireguard connection backed by a mocked NM client.
+    It has to be called from the asyncio loop.
+    """
+    server = Mock()
+    server.server_ip = "127.0.0.1"
+    server.domain = "node-ch-01.protonvpn.net"
+    server.x25519pk = SERVER_PUBLIC_KEY
+    server.wireguard_ports.udp = [51820]
+
+    credentials = Mock()
+    credentials.pubkey_credentials.wg_private_key = CLIENT_PRIVATE_KEY
+
+    settings = Mock()
+    settings.dns_custom_ips = []
+    settings.features = None
+
+    return Wireguard(
+        server=server, credentials=credentials, settings=settings,
+        nm_client=nm_client or Mock(), **kwargs
+    )
+
+
+@pytest.fixture(autouse=True)
+def isolated_wireguard(tmp_path, monkeypatch):
+    """
+    Keeps the agent state out of the user cache directory, answers path MTU
+    probes right away and frees the tunnel interfaces of previous tests.
+    """
+    async def probe(host, size, interface):
+        return True
+
+    monkeypatch.setattr(
+        Wireguard, "agent_state_cache", AgentStateCache(directory=tmp_path / "agent_state")
+    )
+    monkeypatch.setattr(
+        Wireguard, "_path_mtu_discovery",
+        PathMtuDiscovery(probe=probe, route_mtu_getter=lambda host, interface: 1500)
+    )
+    monkeypatch.setattr(Wireguard, "_interface_allocator", InterfaceAllocator())
+
+
+@pytest.fixture
+def wireguard_builder():
+    return build_wireguard
+
+
+@pytest.fixture
+def wireguard():
+    async def create():
+        # The NM backend expects to be instantiated from the asyncio loop.
+        return build_wireguard()
+
+    return asyncio.run(create())
+
+
+def _build_connection(wireguard):
+    wireguard._generate_connection()
+    wireguard._modify_connection()
+    return wireguard.connection
+
+
+def test_connection_template_is_not_modified_by_connections(wireguard):
+    Wireguard._connection_templates.clear()
+    first_connection = _build_connection(wireguard)
+    second_connection = _build_connection(wireguard)
+
+    template, = Wireguard._connection_templates.values()
+    assert first_connection.get_uuid() != second_connection.get_uuid()
+    assert template.get_setting_by_name(NM.SETTING_WIREGUARD_SETTING_NAME).get_peers_len() == 0
+
+
+def test_connection_templates_are_not_shared_across_dns_servers(wireguard_builder):
+    dns_ips = ["10.2.0.1", "10.3.0.1"]
+
+    async def build_connections():
+        return [
+            _build_connection(wireguard_builder(dns_ip=dns_ip)) for dns_ip in dns_ips
+        ]
+
+    connections = asyncio.run(build_connections())
+
+    assert [
+        connection.get_setting_ip4_config().get_dns(0) for connection in connections
+    ] == dns_ips
+
+
+def test_in_memory_connection_is_not_written_to_disk(wireguard_builder):
+    nm_client = Mock()
+    nm_client._run_on_glib_loop_thread.side_effect = lambda function: function()
+    remote_connection = Mock()
+
+    def add_connection2(settings, flags, args, ignore_out_result, cancellable, callback):
+        callback(nm_client._nm_client, Mock(), None)
+
+    nm_client._nm_client.add_connection2.side_effect = add_connection2
+    nm_client._nm_client.add_connection2_finish.return_value = (remote_connection, None)
+
+    async def setup():
+        return wireguard_builder(nm_client=nm_client, in_memory=True).setup()
+
+    future = asyncio.run(setup())
+
+    assert future.result() is remote_connection
+    nm_client.add_connection_async.assert_not_called()
+    flags = nm_client._nm_client.add_connection2.call_args.args[1]
+    assert flags & NM.SettingsAddConnection2Flags.IN_MEMORY
+    assert flags & NM.SettingsAddConnection2Flags.BLOCK_AUTOCONNECT
+    assert not flags & NM.SettingsAddConnection2Flags.TO_DISK
+
+
+@pytest.mark.skipif(
+    not local_agent.AgentConnector.supports_interface_binding,
+    reason="Dedicated tunnels are not supported by the local agent implementation."
+)
+def test_in_place_switch_takes_over_the_tunnel_of_the_previous_connection(wireguard_builder):
+    async def switch_servers():
+        nm_client = MockedNMClient()
+        previous = wireguard_builder(nm_client=nm_client, dedicated=True)
+        # The previous connection got the second tunnel.
+        Wireguard._interface_allocator.allocate(object())
+        await previous.prepare()
+        nm_client.active_connection.get_uuid.return_value = previous._unique_id
+
+        new = wireguard_builder(nm_client=nm_client, dedicated=True)
+        for connection in (previous, new):
+            connection._agent_listener = Mock(is_running=False)
+        await new.prepare()
+        await new.switch_from(previous)
+        return nm_client, previous, new
+
+    nm_client, previous, new = asyncio.run(switch_servers())
+
+    assert new.tunnel == previous.tunnel == TunnelSlot(1)
+    reapplied_connection = nm_client.device.reapply_async.call_args.args[0]
+    ipv4_config = reapplied_connection.get_setting_ip4_config()
+    assert reapplied_connection.get_interface_name() == "proton1"
+    assert ipv4_config.get_route_table() == TunnelSlot(1).route_table
+    assert ipv4_config.get_routing_rule(0).get_fwmark() == TunnelSlot(1).fwmark
+
+
+def _done_future(result=None) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def test_fallback_switch_brings_up_the_prepared_profile_without_probing_again(
+        wireguard_builder, monkeypatch
+):
+    async def start(connection):
+        await asyncio.wrap_future(connection.setup())
+        connection._activated.set()
+
+    monkeypatch.setattr(LinuxNetworkManager, "start", start)
+
+    async def switch_servers():
+        nm_client = MockedNMClient()
+        nm_client.remote_connection.update2.side_effect = RuntimeError("Update failed.")
+        nm_client.add_connection_async = Mock(return_value=_done_future())
+        previous = wireguard_builder(nm_client=nm_client)
+        await previous.prepare()
+        nm_client.active_connection.get_uuid.return_value = previous._unique_id
+        previous._release_active_connection_async = Mock(return_value=_done_future())
+        previous.stop = AsyncMock()
+
+        new = wireguard_builder(nm_client=nm_client)
+        for connection in (previous, new):
+            connection._agent_listener = Mock(is_running=False)
+        await new.prepare()
+        new._probe_server = AsyncMock()
+        await new.switch_from(previous)
+        return nm_client, previous, new
+
+    nm_client, previous, new = asyncio.run(switch_servers())
+
+    new._probe_server.assert_not_called()
+    nm_client.add_connection_async.assert_called_once_with(new.connection)
+    assert new._unique_id != previous._unique_id
+    assert new.tunnel == TunnelSlot(1)
+    assert new.connection.get_interface_name() == "proton1"
+    previous.stop.assert_called_once()
+
+
+def test_start_uses_the_profile_built_by_prepare(wireguard_builder, monkeypatch):
+    async def start(connection):
+        await asyncio.wrap_future(connection.setup())
+
+    monkeypatch.setattr(LinuxNetworkManager, "start", start)
+
+    async def prepare_and_start():
+        nm_client = Mock()
+        nm_client.add_connection_async.return_value = _done_future()
+        wireguard = wireguard_builder(nm_client=nm_client)
+        await wireguard.prepare()
+        prepared_connection = wireguard.connection
+        wireguard._probe_server = AsyncMock()
+        await wireguard.start()
+        return nm_client, wireguard, prepared_connection
+
+    nm_client, wireguard, prepared_connection = asyncio.run(prepare_and_start())
+
+    wireguard._probe_server.assert_not_called()
+    assert wireguard.connection is prepared_connection
+    nm_client.add_connection_async.assert_called_once_with(prepared_connection)
+
+
+NEW_PRIVATE_KEY = "mKsQ2Hc0jVt5aDrTWrTOq0mdLxHsUyF+7IxLsfQzFFI="
+
+
+def test_private_key_rotation_is_applied_in_place(wireguard_builder):
+    async def rotate():
+        nm_client = MockedNMClient()
+        wireguard = wireguard_builder(nm_client=nm_client)
+        wireguard._agent_listener = Mock(is_running=False)
+        await wireguard.prepare()
+        nm_client.profile = wireguard.connection
+        nm_client.active_connection.get_uuid.return_value = wireguard._unique_id
+
+        credentials = Mock()
+        credentials.pubkey_credentials.wg_private_key = NEW_PRIVATE_KEY
+        await wireguard.update_credentials(credentials)
+        return nm_client, wireguard
+
+    nm_client, wireguard = asyncio.run(rotate())
+
+    reapplied_connection = nm_client.device.reapply_async.call_args.args[0]
+    wireguard_setting = reapplied_connection.get_setting_by_name("wireguard")
+    assert wireguard_setting.get_private_key() == NEW_PRIVATE_KEY
+    wireguard._agent_listener.invalidate_credentials_cache.assert_called_once()
+    wireguard._agent_listener.start.assert_called_once()
+
+
+def test_private_key_rotation_keeps_the_settings_of_a_restored_connection(wireguard_builder):
+    async def rotate():
+        nm_client = MockedNMClient()
+        previous = wireguard_builder(nm_client=nm_client)
+        await previous.prepare()
+        nm_client.profile = previous.connection
+        nm_client.active_connection.get_uuid.return_value = previous._unique_id
+
+        # The profile is not built when the connection is restored on start-up.
+        restored = wireguard_builder(nm_client=nm_client)
+        restored._unique_id = previous._unique_id
+        restored._agent_listener = Mock(is_running=False)
+        credentials = Mock()
+        credentials.pubkey_credentials.wg_private_key = NEW_PRIVATE_KEY
+        await restored.update_credentials(credentials)
+        return nm_client, previous
+
+    nm_client, previous = asyncio.run(rotate())
+
+    reapplied_connection = nm_client.device.reapply_async.call_args.args[0]
+    wireguard_setting = reapplied_connection.get_setting_by_name("wireguard")
+    assert wireguard_setting.get_private_key() == NEW_PRIVATE_KEY
+    assert reapplied_connection.get_id() == previous.connection.get_id()
+    assert wireguard_setting.get_peer(0).get_endpoint() == \
+        previous.connection.get_setting_by_name("wireguard").get_peer(0).get_endpoint()
+
+
+@pytest.mark.parametrize("status, is_restored", [
+    (local_agent.Status(state=local_agent.State.CONNECTED), True),
+    (local_agent.Status(
+        state=local_agent.State.HARD_JAILED,
+        reason=local_agent.Reason(code=local_agent.ReasonCode.MAX_SESSIONS_PLUS)
+    ), False),
+])
+def test_only_a_cached_connected_status_is_restored(wireguard, status, is_restored):
+    wireguard._unique_id = "6b3a1d6e-4b9f-4b43-9d58-1f0c2a4f7a11"
+    Wireguard.agent_state_cache.save(wireguard._unique_id, wireguard._vpnserver.domain, status)
+    wireguard._restored_agent_state = Wireguard.agent_state_cache.load(
+        wireguard._unique_id, wireguard._vpnserver.domain
+    )
+    wireguard._handle_agent_status = Mock()
+
+    wireguard._restore_agent_state()
+
+    assert wireguard._handle_agent_status.called is is_restored
+    assert (wireguard._agent_status is not None) is is_restored
+
+
+@pytest.mark.parametrize("dns_custom_ips, dns_ip", [
+    ([], "10.2.0.1"),
+    (["192.0.2.53"], "192.0.2.53"),
+])
+def test_split_tunnel_routes_the_dns_server_through_the_tunnel(
+        wireguard_builder, dns_custom_ips, dns_ip
+):
+    async def build():
+        wireguard = wireguard_builder(
+            split_tunneling=SplitTunneling(include=("198.51.100.0/24",))
+        )
+        wireguard._settings.dns_custom_ips = dns_custom_ips
+        return wireguard
+
+    wireguard = asyncio.run(build())
+
+    assert f"{dns_ip}/32" in wireguard._get_allowed_ips()
+
+
+@pytest.mark.skipif(
+    not local_agent.AgentConnector.supports_interface_binding,
+    reason="The local agent implementation does not bind its connection."
+)
+@pytest.mark.parametrize("dedicated, other_tunnels, interface", [
+    (False, 0, None),
+    (False, 1, "proton1"),
+    (True, 0, "proton0"),
+])
+def test_agent_connection_is_only_bound_to_the_tunnel_when_needed(
+        wireguard_builder, dedicated, other_tunnels, interface
+):
+    async def restart_listener():
+        for _ in range(other_tunnels):
+            Wireguard._interface_allocator.allocate(object())
+        wireguard = wireguard_builder(dedicated=dedicated)
+        wireguard._agent_listener = Mock(is_running=False)
+        wireguard._slot = Wireguard._interface_allocator.allocate(wireguard)
+        wireguard._restart_local_agent_listener()
+        return wireguard
+
+    wireguard = asyncio.run(restart_listener())
+
+    assert wireguard._agent_connector.interface == interface
+    wireguard._agent_listener.start.assert_called_once()
+
+
+def test_restored_connection_reserves_the_tunnel_of_its_interface(
+        wireguard_builder, monkeypatch
+):
+    connection_id = "6b3a1d6e-4b9f-4b43-9d58-1f0c2a4f7a11"
+
+    def initialize_persisted_connection(connection, connection_id):
+        connection._unique_id = connection_id
+        return Mock(spec=states.Connected)
+
+    monkeypatch.setattr(
+        LinuxNetworkManager, "_initialize_persisted_connection", initialize_persisted_connection
+    )
+
+    async def restore():
+        nm_client = MockedNMClient()
+        nm_client.active_connection.get_uuid.return_value = connection_id
+        nm_client.remote_connection.get_interface_name.return_value = "proton1"
+        wireguard = wireguard_builder(nm_client=nm_client)
+        wireguard._initialize_persisted_connection(connection_id)
+        return wireguard
+
+    wireguard = asyncio.run(restore())
+
+    assert wireguard.tunnel == TunnelSlot(1)
+    assert Wireguard._interface_allocator.get_slot(wireguard) == TunnelSlot(1)
+
+
+@pytest.mark.skipif(
+    not local_agent.AgentConnector.supports_interface_binding,
+    reason="Dedicated tunnels are not supported by the local agent implementation."
+)
+def test_concurrent_tunnels_are_added_with_their_own_interface_table_and_fwmark(
+        wireguard_builder, monkeypatch
+):
+    async def start(connection):
+        await asyncio.wrap_future(connection.setup())
+
+    monkeypatch.setattr(LinuxNetworkManager, "start", start)
+
+    async def start_tunnels():
+        nm_client = Mock()
+        nm_client.add_connection_async.side_effect = _done_future
+        tunnels = [wireguard_builder(nm_client=nm_client, dedicated=True) for _ in range(3)]
+        await asyncio.gather(*(tunnel.start() for tunnel in tunnels))
+        return nm_client, tunnels
+
+    nm_client, tunnels = asyncio.run(start_tunnels())
+
+    added_connections = {
+        call.args[0].get_uuid(): call.args[0]
+        for call in nm_client.add_connection_async.call_args_list
+    }
+    assert len(added_connections) == len(tunnels)
+    assert {tunnel.tunnel for tunnel in tunnels} == {TunnelSlot(0), TunnelSlot(1), TunnelSlot(2)}
+    for tunnel in tunnels:
+        connection = added_connections[tunnel._unique_id]
+        ipv4_config = connection.get_setting_ip4_config()
+        assert connection.verify()
+        assert connection.get_interface_name() == tunnel.tunnel.interface_name
+        assert ipv4_config.get_route_table() == tunnel.tunnel.route_table
+        assert ipv4_config.get_routing_rule(0).get_fwmark() == tunnel.tunnel.fwmark
+        # Dedicated tunnels do not set the system DNS servers.
+        assert ipv4_config.get_num_dns() == 0